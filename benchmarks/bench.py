@@ -0,0 +1,433 @@
+#!/usr/bin/env python
+"""
+Benchmarks the Git and SVN merge scripts end to end against stub OBIEE tools, synthetic RPDs and local repositories.
+
+Each scenario is run against a freshly built repository, so every run starts from the same state. Results are written
+as JSON, and two result files can be compared with --compare.
+"""
+
+import json
+import os
+import platform
+import random
+import socket
+import struct
+import sys
+import time
+from argparse import ArgumentParser
+from datetime import datetime
+from shutil import rmtree
+from subprocess import Popen, PIPE, STDOUT
+
+BENCH_DIR = os.path.abspath(os.path.dirname(sys.argv[0]))
+PACKAGE_DIR = os.path.dirname(BENCH_DIR)
+GIT_SCRIPT = os.path.join(PACKAGE_DIR, 'obi-merge-git.py')
+SVN_SCRIPT = os.path.join(PACKAGE_DIR, 'obi-merge-svn.py')
+STUB_TOOL = os.path.join(BENCH_DIR, 'stub_tool.py')
+
+RPD = 'Base.rpd'
+RPD_PASS = 'Admin123'
+BLOCK = 1048576
+SCENARIOS = ['startFeature', 'finishFeature', 'refreshFeature', 'finishRelease', 'standaloneRPDMerge', 'batchRPDMerge']
+STANDALONE_SCENARIOS = ['standaloneRPDMerge', 'batchRPDMerge']  # SVN script only, merging RPD files outside SVN
+
+
+def which(command):
+	for path in os.environ.get('PATH', '').split(os.pathsep):
+		executable = os.path.join(path, command)
+		if os.path.isfile(executable) and os.access(executable, os.X_OK):
+			return executable
+	return None
+
+
+def run(command, cwd=None, stdin=None, env=None):
+	"""Runs a command, returning its exit code and combined output."""
+	p = Popen(command, cwd=cwd, stdin=PIPE, stdout=PIPE, stderr=STDOUT, env=env)
+	output = p.communicate(stdin)[0]
+	return p.returncode, output
+
+
+def check(command, cwd=None):
+	"""Runs a fixture command, failing the benchmark if it fails."""
+	returncode, output = run(command, cwd)
+	if returncode != 0:
+		print '\n**Fixture command failed: %s\n%s' % (' '.join(command), output)
+		sys.exit(1)
+	return output
+
+
+def make_rpd(path, size_mb, variant=0, changed_pct=1.0):
+	"""
+	Writes a synthetic RPD of `size_mb` MB. Blocks are drawn from a pool of random data so the file neither compresses
+	nor deltas against itself. Variants share all but `changed_pct` percent of their blocks with variant 0, each variant
+	changing a different set, so two variants of the same base conflict like two edits of a real RPD.
+	"""
+	pool_rng = random.Random(1)
+	pool = [''.join(struct.pack('<Q', pool_rng.getrandbits(64)) for i in range(0, BLOCK / 8)) for j in range(0, 8)]
+	layout_rng = random.Random(size_mb)
+	changed = set()
+	if variant:
+		changed_rng = random.Random(variant)
+		changed = set(changed_rng.sample(range(0, size_mb), max(1, int(size_mb * changed_pct / 100))))
+	with open(path, 'wb') as f:
+		f.write('OBIEE RPD bench\0')
+		for i in range(0, size_mb):
+			block = layout_rng.randrange(0, len(pool))
+			if i in changed:
+				f.write(struct.pack('<QQ', variant, i) + pool[(block + variant) % len(pool)][16:])
+			else:
+				f.write(struct.pack('<QQ', 0, i) + pool[block][16:])
+
+
+def install_stubs(client_dir):
+	"""Installs wrappers for the stub tools where the scripts expect a 12c client's bitools."""
+	bin_dir = os.path.join(client_dir, 'bi', 'bitools', 'bin')
+	os.makedirs(bin_dir)
+	for tool in ['comparerpd', 'patchrpd', 'admintool', 'biserverxmlgen', 'biserverxmlexec']:
+		with open(os.path.join(bin_dir, tool + '.sh'), 'w') as f:
+			f.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n' % (sys.executable, STUB_TOOL, tool))
+		os.chmod(os.path.join(bin_dir, tool + '.sh'), 0755)
+		with open(os.path.join(bin_dir, tool + '.cmd'), 'w') as f:
+			f.write('@"%s" "%s" %s %%*\r\n' % (sys.executable, STUB_TOOL, tool))
+
+
+def write_config(work_dir, client_dir, repo, svn_url, storage, workspace):
+	config = os.path.join(work_dir, 'config.ini')
+	with open(config, 'w') as f:
+		f.write('[OBIEE]\nOBIEE_VERSION=12\nCLIENT_ONLY=True\nOBIEE_HOME=%s\nOBIEE_CLIENT=%s\nRPD_PW=%s\n\n'
+				% (client_dir, client_dir, RPD_PASS))
+		f.write('[Git]\nGIT_EXE=%s\nGIT_REPO=%s\nGIT_RPD=%s\nGIT_REMOTE=origin\nGIT_DEVELOP=develop\n'
+				'GIT_MASTER=master\nFEATURE_PREFIX=feature/\nHOTFIX_PREFIX=hotfix/\nRELEASE_PREFIX=release/\n\n'
+				% (which('git') or 'git', repo, RPD))
+		f.write('[SVN]\nSVN_BIN=%s\nSVN_BASE_URL=%s\nSVN_TRUNK=trunk\nSVN_DEVELOP=branches/develop\n'
+				'SVN_DEV_BRANCH_ROOT=branches/feature\nSVN_RELEASE_BRANCH_ROOT=branches/release\n'
+				'SVN_RELEASE_HF_BRANCH_ROOT=branches/release-hotfix\nSVN_HF_BRANCH_ROOT=branches/hotfix\n'
+				'SVN_WC_POOL=%s\n\n' % (which('svn') or 'svn', svn_url, os.path.join(work_dir, 'wc_pool')))
+		f.write('[Cache]\nPATCH_CACHE_DIR=%s\nRESOLUTION_CACHE_DIR=%s\nREFRESH_STATE_FILE=%s\nPRECOMPUTE_STATE_FILE=%s\n\n'
+				% (os.path.join(work_dir, 'patch_cache'), os.path.join(work_dir, 'resolution_cache'),
+				   os.path.join(work_dir, 'refresh_state.json'), os.path.join(work_dir, 'precompute_state.json')))
+		f.write('[Storage]\nRPD_STORAGE=%s\n\n' % storage)
+		f.write('[Workspace]\nWORKSPACE_DIR=%s\n' % (workspace or os.path.join(work_dir, 'workspace')))
+	return config
+
+
+def git_fixture(work_dir, scenario, rpds, python, config, storage):
+	"""
+	Builds a bare remote and a clone with master, develop, a feature branch and a release branch. For the merge
+	scenarios both sides change the RPD, so Git reports a conflict and the OBIEE merge runs. With text storage the
+	script converts the base RPD on master before any other branch is made.
+	"""
+	remote = os.path.join(work_dir, 'remote.git')
+	repo = os.path.join(work_dir, 'repo')
+	check(['git', 'init', '-q', '--bare', remote])
+	check(['git', 'clone', '-q', remote, repo])
+
+	def git(*args):
+		return check(['git', '-C', repo] + list(args))
+
+	def commit_rpd(variant, message):
+		with open(os.path.join(repo, RPD), 'wb') as f:
+			with open(rpds[variant], 'rb') as src:
+				f.write(src.read())
+		git('add', RPD)
+		git('commit', '-q', '-m', message)
+
+	git('config', 'user.email', 'bench@localhost')
+	git('config', 'user.name', 'bench')
+	git('checkout', '-q', '-b', 'master')
+	commit_rpd('base', 'Base RPD')
+	if storage == 'text':
+		check([python, GIT_SCRIPT, 'convertStorage', '-c', config])
+	git('push', '-q', '-u', 'origin', 'master')
+	git('checkout', '-q', '-b', 'develop')
+	git('push', '-q', '-u', 'origin', 'develop')
+	if scenario in ('finishFeature', 'refreshFeature'):
+		git('checkout', '-q', '-b', 'feature/BENCH')
+		commit_rpd('feature', 'Feature change')
+		git('push', '-q', '-u', 'origin', 'feature/BENCH')
+		git('checkout', '-q', 'develop')
+		commit_rpd('develop', 'Develop change')
+		git('push', '-q', 'origin', 'develop')
+	elif scenario == 'finishRelease':
+		git('checkout', '-q', '-b', 'release/R1')
+		commit_rpd('feature', 'Release change')
+		git('push', '-q', '-u', 'origin', 'release/R1')
+		git('checkout', '-q', 'develop')
+		commit_rpd('develop', 'Develop change')
+		git('push', '-q', 'origin', 'develop')
+		git('checkout', '-q', 'master')
+		commit_rpd('hotfix', 'Master change')
+		git('push', '-q', 'origin', 'master')
+	git('checkout', '-q', 'develop')
+	return repo
+
+
+def git_verify(repo, scenario):
+	def subject(ref):
+		return run(['git', '-C', repo, 'log', '-1', '--format=%s', ref])[1]
+
+	if scenario == 'startFeature':
+		return run(['git', '-C', repo, 'rev-parse', '--verify', '-q', 'feature/BENCH'])[0] == 0
+	elif scenario == 'finishFeature':
+		return 'feature/BENCH' in subject('develop')
+	elif scenario == 'refreshFeature':
+		return 'develop' in subject('feature/BENCH')
+	elif scenario == 'finishRelease':
+		return 'release/R1' in subject('master') and 'release/R1' in subject('develop')
+	return False
+
+
+def svn_fixture(work_dir, scenario, rpds):
+	"""Builds a file:// repository with trunk, develop and, depending on the scenario, a feature or release branch."""
+	repo_dir = os.path.join(work_dir, 'svnrepo')
+	url = 'file://' + repo_dir.replace(os.sep, '/')
+	check(['svnadmin', 'create', repo_dir])
+	check(['svn', 'mkdir', '-q', '--parents', '-m', 'Layout', url + '/trunk', url + '/branches'])
+	wc = os.path.join(work_dir, 'fixture_wc')
+
+	def commit_rpd(branch, variant, message):
+		rmtree(wc, True)
+		check(['svn', 'checkout', '-q', '%s/%s' % (url, branch), wc])
+		exists = os.path.exists(os.path.join(wc, RPD))
+		with open(os.path.join(wc, RPD), 'wb') as f:
+			with open(rpds[variant], 'rb') as src:
+				f.write(src.read())
+		if not exists:
+			check(['svn', 'add', '-q', os.path.join(wc, RPD)])
+		check(['svn', 'commit', '-q', '-m', message, wc])
+
+	commit_rpd('trunk', 'base', 'Base RPD')
+	check(['svn', 'copy', '-q', '-m', 'Develop', url + '/trunk', url + '/branches/develop'])
+	if scenario in ('finishFeature', 'refreshFeature'):
+		check(['svn', 'copy', '-q', '-m', 'Feature', url + '/branches/develop', url + '/branches/feature-BENCH'])
+		commit_rpd('branches/feature-BENCH', 'feature', 'Feature change')
+		commit_rpd('branches/develop', 'develop', 'Develop change')
+	elif scenario == 'finishRelease':
+		check(['svn', 'copy', '-q', '-m', 'Release', url + '/branches/develop', url + '/branches/release-R1'])
+		commit_rpd('branches/release-R1', 'feature', 'Release change')
+		commit_rpd('trunk', 'hotfix', 'Trunk change')
+	rmtree(wc, True)
+	return url
+
+
+def svn_verify(url, scenario):
+	def message(branch):
+		return run(['svn', 'log', '-l', '1', '%s/%s' % (url, branch)])[1]
+
+	if scenario == 'startFeature':
+		return run(['svn', 'info', url + '/branches/feature-BENCH'])[0] == 0
+	elif scenario == 'finishFeature':
+		return 'Finish Feature' in message('branches/develop')
+	elif scenario == 'refreshFeature':
+		return 'Refresh Feature' in message('branches/feature-BENCH')
+	elif scenario == 'finishRelease':
+		return 'Finish Release' in message('trunk')
+	return False
+
+
+def script_args(tool, scenario, config, work_dir, rpds):
+	if tool == 'git':
+		names = {'startFeature': 'BENCH', 'finishFeature': 'BENCH', 'refreshFeature': 'BENCH', 'finishRelease': 'R1'}
+		return [GIT_SCRIPT, scenario, names[scenario], '-p', '-c', config]
+	elif scenario in STANDALONE_SCENARIOS:
+		currents = ['-u', rpds['develop']] + (['-u', rpds['hotfix']] if scenario == 'batchRPDMerge' else [])
+		return [SVN_SCRIPT, '-r', rpds['base'], '-m', rpds['feature'], '-o', os.path.join(work_dir, 'output.rpd'),
+				'-p', RPD_PASS, '-c', config] + currents
+	else:
+		names = {'startFeature': '--featureName', 'finishFeature': '--featureName', 'refreshFeature': '--featureName',
+				 'finishRelease': '--releaseName'}
+		values = {'--featureName': 'BENCH', '--releaseName': 'R1'}
+		return [SVN_SCRIPT, '--action', scenario, names[scenario], values[names[scenario]], '-p', RPD_PASS,
+				'-c', config]
+
+
+def run_scenario(tool, scenario, args, rpds, run_dir):
+	"""Builds the fixture for one scenario, times the script against it and checks the result."""
+	rmtree(run_dir, True)
+	os.makedirs(run_dir)
+	client_dir = os.path.join(run_dir, 'obiee')
+	install_stubs(client_dir)
+
+	repo, url = os.path.join(run_dir, 'repo'), 'file:///nonexistent'
+	if tool == 'svn' and scenario not in STANDALONE_SCENARIOS:
+		url = svn_fixture(run_dir, scenario, rpds)
+	config = write_config(run_dir, client_dir, repo, url, args.storage, args.workspace)
+	if tool == 'git':
+		git_fixture(run_dir, scenario, rpds, args.python, config, args.storage)
+	profile = os.path.join(run_dir, 'profile.jsonl')
+
+	env = dict(os.environ)
+	env['OBI_STUB_LATENCY'] = str(args.latency)
+	env['OBI_STUB_SEC_PER_GB'] = str(args.secPerGb)
+	env['OBI_STUB_PATCH_KB'] = str(args.patchKb)
+	env['OBI_STUB_CONFLICT'] = str(args.conflict)
+	env['OBI_STUB_SEED'] = str(args.seed)
+	command = [args.python] + script_args(tool, scenario, config, run_dir, rpds) + ['--profile', '--profileFile', profile]
+
+	times = os.times()
+	start = time.time()
+	returncode, output = run(command, cwd=run_dir, stdin='\n' * 10, env=env)
+	wall = time.time() - start
+	after = os.times()
+	with open(os.path.join(run_dir, 'output.log'), 'w') as f:
+		f.write(output)
+
+	result = {}
+	if tool == 'git':
+		ok = git_verify(repo, scenario)
+		result['remote_mb'] = remote_size(os.path.join(run_dir, 'remote.git'))
+	elif scenario in STANDALONE_SCENARIOS:
+		ok = os.path.exists(os.path.join(run_dir, 'output.rpd'))
+	else:
+		ok = svn_verify(url, scenario)
+
+	phases = {}
+	if os.path.exists(profile):
+		with open(profile, 'r') as f:
+			for line in f:
+				record = json.loads(line)
+				phases[record['phase']] = round(phases.get(record['phase'], 0) + record['wall'], 3)
+
+	result.update({'wall': round(wall, 3), 'child_cpu': round(after[2] + after[3] - times[2] - times[3], 3),
+				   'returncode': returncode, 'ok': ok and returncode == 0, 'phases': phases})
+	return result
+
+
+def remote_size(remote):
+	"""Size in MB of the objects in a bare repository, once packed as a clone or fetch would send them."""
+	check(['git', '-C', remote, 'gc', '-q'])
+	counts = dict(line.split(': ') for line in run(['git', '-C', remote, 'count-objects', '-v'])[1].splitlines())
+	return round((int(counts['size']) + int(counts['size-pack'])) / 1024.0, 2)
+
+
+def median(values):
+	values = sorted(values)
+	middle = len(values) / 2
+	if len(values) % 2:
+		return values[middle]
+	return (values[middle - 1] + values[middle]) / 2.0
+
+
+def version(command):
+	try:
+		return run(command)[1].splitlines()[0].strip()
+	except (OSError, IndexError):
+		return None
+
+
+def benchmark(args):
+	work_dir = os.path.abspath(args.workDir)
+	rmtree(work_dir, True)
+	os.makedirs(work_dir)
+
+	tools = [tool for tool in args.tools.split(',') if tool]
+	scenarios = [scenario for scenario in args.scenarios.split(',') if scenario]
+	if 'svn' in tools and not (which('svn') and which('svnadmin')):
+		print 'svn/svnadmin not found, only %s will be run for SVN.' % ' and '.join(STANDALONE_SCENARIOS)
+
+	print 'Generating %d MB synthetic RPDs in %s' % (args.rpdMb, work_dir)
+	rpds = {}
+	for variant, name in enumerate(['base', 'feature', 'develop', 'hotfix']):
+		rpds[name] = os.path.join(work_dir, '%s.rpd' % name)
+		make_rpd(rpds[name], args.rpdMb, variant, args.changedPct)
+
+	results = []
+	for tool in tools:
+		for scenario in scenarios:
+			if tool == 'git' and scenario in STANDALONE_SCENARIOS:
+				continue  # Only the SVN script has a standalone merge
+			if tool == 'svn' and scenario not in STANDALONE_SCENARIOS and not (which('svn') and which('svnadmin')):
+				continue
+			runs = []
+			for i in range(0, args.repeat):
+				run_dir = os.path.join(work_dir, '%s-%s-%d' % (tool, scenario, i))
+				runs.append(run_scenario(tool, scenario, args, rpds, run_dir))
+				print '\t%s %-20s run %d: %7.2fs %s' % (tool, scenario, i + 1, runs[-1]['wall'],
+														 'ok' if runs[-1]['ok'] else 'FAILED (see %s)' % run_dir)
+				if runs[-1]['ok'] and not args.keep:
+					rmtree(run_dir, True)
+			walls = [r['wall'] for r in runs]
+			results.append({'tool': tool, 'scenario': scenario, 'runs': runs, 'ok': all(r['ok'] for r in runs),
+							'wall_min': min(walls), 'wall_median': median(walls),
+							'child_cpu_median': median([r['child_cpu'] for r in runs])})
+
+	revision = run(['git', '-C', PACKAGE_DIR, 'rev-parse', 'HEAD'])[1].strip()
+	report = {'meta': {'date': datetime.now().isoformat(), 'host': socket.gethostname(), 'platform': platform.platform(),
+					   'python': args.python, 'git': version(['git', '--version']),
+					   'svn': version(['svn', '--version', '--quiet']), 'revision': revision, 'rpd_mb': args.rpdMb,
+					   'changed_pct': args.changedPct, 'latency': args.latency, 'sec_per_gb': args.secPerGb,
+					   'patch_kb': args.patchKb, 'conflict': args.conflict, 'seed': args.seed, 'repeat': args.repeat,
+					   'storage': args.storage, 'workspace': args.workspace},
+			  'results': results}
+	with open(args.output, 'w') as f:
+		json.dump(report, f, indent=2, sort_keys=True)
+	print '\nResults written to %s' % args.output
+
+
+def compare(base_file, new_file, threshold):
+	"""Prints the change in median wall time per scenario between two result files."""
+	with open(base_file, 'r') as f:
+		base = json.load(f)
+	with open(new_file, 'r') as f:
+		new = json.load(f)
+	base_results = dict(((r['tool'], r['scenario']), r) for r in base['results'])
+
+	print '%-4s %-20s %10s %10s %9s' % ('Tool', 'Scenario', 'Base (s)', 'New (s)', 'Change')
+	regressions = 0
+	for result in new['results']:
+		previous = base_results.get((result['tool'], result['scenario']))
+		if previous is None:
+			print '%-4s %-20s %10s %10.2f' % (result['tool'], result['scenario'], '-', result['wall_median'])
+			continue
+		change = (result['wall_median'] - previous['wall_median']) * 100.0 / max(previous['wall_median'], 0.001)
+		flag = ''
+		if change > threshold:
+			flag = '  slower'
+			regressions += 1
+		elif change < -threshold:
+			flag = '  faster'
+		if not result['ok']:
+			flag += '  FAILED'
+		print '%-4s %-20s %10.2f %10.2f %8.1f%%%s' % (result['tool'], result['scenario'], previous['wall_median'],
+													  result['wall_median'], change, flag)
+	return regressions
+
+
+if __name__ == '__main__':
+	arg_parser = ArgumentParser(description='Benchmarks the OBIEE merge scripts against stub OBIEE tools.')
+	arg_parser.add_argument('--tools', default='git,svn', help='Comma separated scripts to benchmark. Default: git,svn')
+	arg_parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+							help='Comma separated scenarios to run. Default: %s' % ','.join(SCENARIOS))
+	arg_parser.add_argument('--rpdMb', type=int, default=100, help='Size of the synthetic RPDs in MB. Default: 100')
+	arg_parser.add_argument('--changedPct', type=float, default=1.0,
+							help='Percentage of the RPD changed on each branch. Default: 1')
+	arg_parser.add_argument('--latency', type=float, default=1.0,
+							help='Fixed delay of each stub tool run in seconds. Default: 1')
+	arg_parser.add_argument('--secPerGb', type=float, default=10.0,
+							help='Extra stub tool delay in seconds per GB of RPD read. Default: 10')
+	arg_parser.add_argument('--patchKb', type=int, default=64, help='Size of the stub XML patches in KB. Default: 64')
+	arg_parser.add_argument('--conflict', type=float, default=0.0,
+							help='Probability of patchrpd reporting conflicts, forcing a manual merge. Default: 0')
+	arg_parser.add_argument('--seed', type=int, default=0, help='Seed for conflict injection. Default: 0')
+	arg_parser.add_argument('--storage', choices=['binary', 'text'], default='binary',
+							help='How the Git scenarios store the RPD (RPD_STORAGE). Default: binary')
+	arg_parser.add_argument('--workspace',
+							help='Directory the scripts write intermediate files to (WORKSPACE_DIR), e.g. on tmpfs. '
+								 'Default: a directory in each run\'s fixture')
+	arg_parser.add_argument('--repeat', type=int, default=3, help='Runs of each scenario. Default: 3')
+	arg_parser.add_argument('--python', default=sys.executable, help='Python 2.7 used to run the scripts.')
+	arg_parser.add_argument('--workDir', default=os.path.join(BENCH_DIR, 'work'),
+							help='Scratch directory, emptied at the start. Default: benchmarks/work')
+	arg_parser.add_argument('--keep', action='store_true', default=False,
+							help='Keep the repositories and logs of successful runs.')
+	arg_parser.add_argument('-o', '--output', default='bench-results.json',
+							help='Results file. Default: "bench-results.json"')
+	arg_parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'),
+							help='Compare two results files instead of running the benchmark.')
+	arg_parser.add_argument('--threshold', type=float, default=5.0,
+							help='Percentage change in median wall time reported as faster or slower. Default: 5')
+	args = arg_parser.parse_args()
+
+	if args.compare:
+		sys.exit(1 if compare(args.compare[0], args.compare[1], args.threshold) else 0)
+	benchmark(args)
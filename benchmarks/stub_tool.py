@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+"""
+Stand-in for the OBIEE command line tools used by the merge scripts, so the scripts can be benchmarked without an
+OBIEE install. The benchmark harness (bench.py) installs shell wrappers named comparerpd, patchrpd, admintool,
+biserverxmlgen and biserverxmlexec that call this script with the tool name as the first argument.
+
+Behaviour is configured with environment variables:
+
+	OBI_STUB_LATENCY	Fixed delay in seconds added to each tool run. Default: 0
+	OBI_STUB_SEC_PER_GB	Extra delay in seconds per GB of RPD read. Default: 0
+	OBI_STUB_PATCH_KB	Size of the XML patch written by comparerpd in KB. Default: 64
+	OBI_STUB_CONFLICT	Probability (0 to 1) of patchrpd reporting conflicts. Default: 0
+	OBI_STUB_SEED		Seed for the conflict injection, so runs are reproducible. Default: 0
+"""
+
+import binascii
+import hashlib
+import os
+import random
+import sys
+import time
+from shutil import copyfileobj
+
+CHUNK = 1048576
+
+
+def setting(name, default):
+	return float(os.environ.get(name, default))
+
+
+def read_rpds(*paths):
+	"""Reads each input fully, as the real tools do, and returns the number of bytes read."""
+	total = 0
+	for path in paths:
+		with open(path, 'rb') as f:
+			for block in iter(lambda: f.read(CHUNK), ''):
+				total += len(block)
+	return total
+
+
+def wait(bytes_read):
+	time.sleep(setting('OBI_STUB_LATENCY', 0) + setting('OBI_STUB_SEC_PER_GB', 0) * bytes_read / 1073741824.0)
+
+
+def options(argv):
+	"""Parses `-X value` pairs into a dict keyed by the flag letter."""
+	parsed = {}
+	for i in range(0, len(argv) - 1):
+		if argv[i].startswith('-') and len(argv[i]) == 2:
+			parsed[argv[i][1]] = argv[i + 1]
+	return parsed
+
+
+def comparerpd(argv):
+	opts = options(argv)
+	print 'Loading repository %s' % opts['C']
+	print 'Loading repository %s' % opts['G']
+	bytes_read = read_rpds(opts['C'], opts['G'])
+	print 'Comparing repositories'
+	wait(bytes_read)
+
+	# Enough declarations to reach the configured size, named after the inputs so different inputs give different patches
+	stamp = hashlib.sha1(opts['C'] + opts['G']).hexdigest()[:8]
+	size = int(setting('OBI_STUB_PATCH_KB', 64) * 1024)
+	print 'Writing patch %s' % opts['D']
+	with open(opts['D'], 'w') as f:
+		f.write('<?xml version="1.0" encoding="UTF-8" ?>\n<Repository xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+				'\n<DECLARE>\n')
+		written, i = 0, 0
+		while written < size:
+			line = '<LogicalTable name="Bench %s %d" parentName="&quot;Bench&quot;" uid="%s%08x" />\n' % (stamp, i, stamp, i)
+			f.write(line)
+			written += len(line)
+			i += 1
+		f.write('</DECLARE>\n</Repository>\n')
+	return 0
+
+
+def patchrpd(argv):
+	opts = options(argv)
+	print 'Loading repository %s' % opts['C']
+	print 'Loading repository %s' % opts['G']
+	bytes_read = read_rpds(opts['C'], opts['G'], opts['I'])
+	print 'Applying patch %s' % opts['I']
+	wait(bytes_read)
+
+	conflict = random.Random('%s %s' % (os.environ.get('OBI_STUB_SEED', '0'), opts['I'])).random()
+	if conflict < setting('OBI_STUB_CONFLICT', 0):
+		print 'Conflicts are found.'
+		return 1
+
+	print 'Writing repository %s' % opts['O']
+	with open(opts['C'], 'rb') as src:
+		with open(opts['O'], 'wb') as dest:
+			copyfileobj(src, dest, CHUNK)
+			dest.write('patched %s\n' % os.path.basename(opts['I']))
+	return 0
+
+
+def biserverxmlgen(argv):
+	"""Writes an RPD as text: hex, a line per 64 bytes, so unchanged parts of the RPD give unchanged lines."""
+	opts = options(argv)
+	wait(read_rpds(opts['R']))
+	with open(opts['R'], 'rb') as src:
+		with open(opts['O'], 'w') as dest:
+			for block in iter(lambda: src.read(64), ''):
+				dest.write(binascii.hexlify(block) + '\n')
+	return 0
+
+
+def biserverxmlexec(argv):
+	"""Turns the text written by `biserverxmlgen` back into the RPD."""
+	opts = options(argv)
+	wait(read_rpds(opts['I']))
+	with open(opts['I'], 'r') as src:
+		with open(opts['O'], 'wb') as dest:
+			for line in src:
+				dest.write(binascii.unhexlify(line.strip()))
+	return 0
+
+
+def admintool(argv):
+	"""Simulates a user completing a full merge, saving the result under the Admin Tool's default output name."""
+	with open(argv[1], 'r') as f:
+		rpd = f.read().split()[1]
+	wait(read_rpds(rpd))
+	output = os.path.splitext(rpd)[0] + '(1).rpd'
+	with open(rpd, 'rb') as src:
+		with open(output, 'wb') as dest:
+			copyfileobj(src, dest, CHUNK)
+			dest.write('merged manually\n')
+	return 0
+
+
+if __name__ == '__main__':
+	tools = {'comparerpd': comparerpd, 'patchrpd': patchrpd, 'admintool': admintool, 'biserverxmlgen': biserverxmlgen,
+			 'biserverxmlexec': biserverxmlexec}
+	sys.exit(tools[sys.argv[1]](sys.argv[2:]))
@@ -8,12 +8,28 @@ Prerequisites:
 """
 
 import os
+import atexit
 import re
 import sys
+import signal
+import shlex
+import tempfile
+import io
+import json
+import socket
+import urllib2
+import time
+import hashlib
 import platform
+import threading
 from glob import glob
-from shutil import copyfile
+from itertools import combinations
+from functools import wraps
+from shutil import copyfile, copyfileobj, rmtree
 from argparse import ArgumentParser
+from xml.etree import cElementTree as ElementTree
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
 from ConfigParser import SafeConfigParser
 from subprocess import Popen, PIPE, STDOUT, call
 
@@ -26,18 +42,58 @@ try:
 
 	# ArgumentParser to parse arguments and options
 	arg_parser = ArgumentParser(description="Rittman Mead RPD Git Merge Script \n(MP/RM Jul 2016)")
-	arg_parser.add_argument('action', choices=['startFeature', 'finishFeature', 'refreshFeature', 'startRelease',
-											   'finishRelease', 'startHotfix', 'finishHotfix', 'bugfix'], help='Gitflow action.')
-	arg_parser.add_argument('name', help='Name of a feature, release or hotfix depending on the action chosen.')
+	arg_parser.add_argument('action', choices=['startFeature', 'finishFeature', 'finishFeatures', 'refreshFeature',
+											   'startRelease', 'finishRelease', 'startHotfix', 'finishHotfix', 'bugfix',
+											   'serve', 'precompute', 'analyzeConflicts', 'convertStorage', 'rpdToText',
+											   'textToRpd', 'composePatches', 'forgetResolution'],
+							help='Gitflow action.')
+	arg_parser.add_argument('name', nargs='?',
+							help='Name of a feature, release or hotfix depending on the action chosen. For finishFeatures, '
+								 'a comma separated list of features or a file listing one per line. For composePatches, a '
+								 'comma separated list of patch files, applied in that order. For forgetResolution, the key of a '
+								 'recorded merge resolution (or its start), or "all".')
 	arg_parser.add_argument('-p', '--push', action="store_true", default=False, help='Push directly to origin.')
 	arg_parser.add_argument('-a', '--autoOpen', action="store_true", default=False,
 						help='Automatically opens new RPD after merge.')
 	arg_parser.add_argument('-t', '--tag', action="store", help='Specify tag annotation if finishing a release.')
+	arg_parser.add_argument('-o', '--output', default='composed.xml',
+						help='File composePatches writes the composed patch to. Default: "composed.xml"')
 	arg_parser.add_argument('-c', '--config', default='config.ini', help='Config file to be used. Default: "config.ini"')
+	arg_parser.add_argument('-w', '--worktrees', action="store_true", default=False,
+						help='Merge master and develop concurrently in separate worktrees when finishing releases and '
+							 'hotfixes.')
+	arg_parser.add_argument('-j', '--jobs', type=int, default=2,
+						help='Number of conflicted RPDs to merge at the same time. Default: 2')
+	arg_parser.add_argument('--abortOnConflict', action="store_true", default=False,
+						help='Stop patchrpd as soon as it reports a conflict and go straight to the manual merge.')
+	arg_parser.add_argument('--profile', action="store_true", default=False,
+						help='Record the time taken by each phase of the run and print a summary at the end.')
+	arg_parser.add_argument('--profileFile', default='profile.jsonl',
+						help='File to append profile records to as JSON lines. Default: "profile.jsonl"')
+	arg_parser.add_argument('--interval', type=int,
+						help='With precompute, check for new work every this many seconds rather than just once.')
+	arg_parser.add_argument('--listen', default='127.0.0.1:8765',
+						help='Address (host:port) the serve action listens on. Default: 127.0.0.1:8765')
+	arg_parser.add_argument('--server',
+						help='Run the action on a merge server started with the serve action, e.g. '
+							 'http://buildhost:8765, streaming its output.')
+	arg_parser.add_argument('--no-patch-cache', dest='no_patch_cache', action="store_true", default=False,
+						help='Always run comparerpd rather than reusing a cached patch.')
+	arg_parser.add_argument('--no-resolution-cache', dest='no_resolution_cache', action="store_true", default=False,
+						help='Neither reuse nor record resolutions of manual RPD merges.')
+	arg_parser.add_argument('--workspace',
+						help='Directory for intermediate files such as merge candidates, patches and logs, ideally on '
+							 'fast local storage. Overrides WORKSPACE_DIR in [Workspace].')
+	arg_parser.add_argument('--tidyup', action="store_true", default=False,
+						help='Remove all intermediate files, including those kept by earlier runs for inspection.')
+	arg_parser.add_argument('--resume', action="store_true", default=False,
+						help='Continue the last interrupted run of the same action and name, skipping the steps it '
+							 'completed.')
 	args = arg_parser.parse_args()
 
 	# Parse config parameters
 	config_file = args.config
+	CONFIG_FILE = os.path.abspath(config_file)
 	if not os.path.exists(config_file):
 		print '\n**Config file %s not found. Exiting.' % config_file
 		sys.exit(1)
@@ -60,6 +116,8 @@ try:
 
 	RPD_PW = conf_parser.get('OBIEE', 'RPD_PW')
 
+	BI_ENV_CACHE_FILE = os.path.join(SCRIPT_DIR, '.bi_env_cache.json')
+
 	# Initiliases bi-init and runcat command variables
 	if platform.system() == 'Linux':
 		# This won't work for multi-instance BI Homes (instance2 etc)
@@ -84,13 +142,90 @@ try:
 	HOTFIX_PREFIX = conf_parser.get('Git', 'HOTFIX_PREFIX')
 	RELEASE_PREFIX = conf_parser.get('Git', 'RELEASE_PREFIX')
 
+	# Optional storage settings: with RPD_STORAGE=text the RPD is committed as text, converted by these commands
+	RPD_STORAGE = 'binary'
+	if conf_parser.has_option('Storage', 'RPD_STORAGE'):
+		RPD_STORAGE = conf_parser.get('Storage', 'RPD_STORAGE').lower()
+	if RPD_STORAGE not in ('binary', 'text'):
+		print '\n**RPD_STORAGE must be binary or text, not %s. Exiting.' % RPD_STORAGE
+		sys.exit(1)
+	if conf_parser.has_option('Storage', 'RPD_TO_TEXT_CMD'):
+		RPD_TO_TEXT_CMD = conf_parser.get('Storage', 'RPD_TO_TEXT_CMD')
+	else:
+		RPD_TO_TEXT_CMD = 'biserverxmlgen -R {rpd} -P {password} -O {text} -8'
+	if conf_parser.has_option('Storage', 'TEXT_TO_RPD_CMD'):
+		TEXT_TO_RPD_CMD = conf_parser.get('Storage', 'TEXT_TO_RPD_CMD')
+	else:
+		TEXT_TO_RPD_CMD = 'biserverxmlexec -I {text} -P {password} -O {rpd}'
+
+	# Optional timeouts in seconds for Git commands and the OBIEE command line tools. Default: none
+	COMMAND_TIMEOUT = None
+	if conf_parser.has_option('Timeouts', 'COMMAND_TIMEOUT'):
+		COMMAND_TIMEOUT = conf_parser.getint('Timeouts', 'COMMAND_TIMEOUT') or None
+	TOOL_TIMEOUT = None
+	if conf_parser.has_option('Timeouts', 'TOOL_TIMEOUT'):
+		TOOL_TIMEOUT = conf_parser.getint('Timeouts', 'TOOL_TIMEOUT') or None
+
+	# Optional patch cache settings
+	if conf_parser.has_option('Cache', 'PATCH_CACHE_DIR'):
+		PATCH_CACHE_DIR = os.path.abspath(conf_parser.get('Cache', 'PATCH_CACHE_DIR'))
+	else:
+		PATCH_CACHE_DIR = os.path.join(SCRIPT_DIR, '.patch_cache')
+	if conf_parser.has_option('Cache', 'PATCH_CACHE_MAX_MB'):
+		PATCH_CACHE_MAX_MB = conf_parser.getint('Cache', 'PATCH_CACHE_MAX_MB')
+	else:
+		PATCH_CACHE_MAX_MB = 2048
+
+	# Optional store of manual merge resolutions, reused when the same merge candidates come up again
+	if conf_parser.has_option('Cache', 'RESOLUTION_CACHE_DIR'):
+		RESOLUTION_CACHE_DIR = os.path.abspath(conf_parser.get('Cache', 'RESOLUTION_CACHE_DIR'))
+	else:
+		RESOLUTION_CACHE_DIR = os.path.join(SCRIPT_DIR, '.resolution_cache')
+	if conf_parser.has_option('Cache', 'RESOLUTION_CACHE_MAX_MB'):
+		RESOLUTION_CACHE_MAX_MB = conf_parser.getint('Cache', 'RESOLUTION_CACHE_MAX_MB')
+	else:
+		RESOLUTION_CACHE_MAX_MB = 4096
+
+	# Optional files recording what refreshFeature and precompute have done so far, for each repository
+	if conf_parser.has_option('Cache', 'REFRESH_STATE_FILE'):
+		REFRESH_STATE_FILE = os.path.abspath(conf_parser.get('Cache', 'REFRESH_STATE_FILE'))
+	else:
+		REFRESH_STATE_FILE = os.path.join(SCRIPT_DIR, '.refresh_state.json')
+	if conf_parser.has_option('Cache', 'PRECOMPUTE_STATE_FILE'):
+		PRECOMPUTE_STATE_FILE = os.path.abspath(conf_parser.get('Cache', 'PRECOMPUTE_STATE_FILE'))
+	else:
+		PRECOMPUTE_STATE_FILE = os.path.join(SCRIPT_DIR, '.precompute_state.json')
+
+	# Optional scratch workspace for intermediate files, e.g. on a local NVMe disk or tmpfs
+	if args.workspace:
+		WORKSPACE_DIR = os.path.abspath(os.path.join(CURRENT_DIR, args.workspace))
+	elif conf_parser.has_option('Workspace', 'WORKSPACE_DIR'):
+		WORKSPACE_DIR = os.path.abspath(conf_parser.get('Workspace', 'WORKSPACE_DIR'))
+	else:
+		WORKSPACE_DIR = os.path.join(SCRIPT_DIR, '.workspace')
+
 	ACTION = args.action
 	NAME = args.name
+	OUTPUT = os.path.join(CURRENT_DIR, args.output)
+	RUN = (ACTION, NAME)  # Identifies the run for --resume
 	PUSH = args.push
 	TAG = args.tag
 	AUTO_OPEN = args.autoOpen
-
-	if (ACTION == 'startFeature' or ACTION == 'finishFeature' or ACTION == 'refreshFeature') and NAME is None:
+	WORKTREES = args.worktrees
+	PATCH_CACHE = not args.no_patch_cache
+	RESOLUTION_CACHE = not args.no_resolution_cache
+	TIDY = args.tidyup
+	RESUME = args.resume
+	ABORT_ON_CONFLICT = args.abortOnConflict
+	LISTEN = args.listen
+	INTERVAL = args.interval
+	SERVER = args.server
+	JOBS = max(1, args.jobs)
+	PROFILE_FILE = None
+	if args.profile:
+		PROFILE_FILE = os.path.join(CURRENT_DIR, args.profileFile)
+
+	if ACTION not in ('serve', 'precompute', 'analyzeConflicts', 'convertStorage', 'forgetResolution') and NAME is None:
 		arg_parser.print_help()
 		print '\n\tError: Name (-n, --name) must be specified.'
 		sys.exit(1)
@@ -101,33 +236,296 @@ except Exception, err:
 	sys.exit(1)
 
 
-def cmd(command):
+RUN_START = time.time()
+PROFILE_RECORDS = []
+PROFILE_LOCK = threading.Lock()
+
+
+def io_counters():
+	"""Bytes read and written so far by this process (not its children), where the platform reports them."""
+	try:
+		with open('/proc/self/io', 'r') as f:
+			counters = dict(line.split(': ') for line in f.read().splitlines())
+		return int(counters['rchar']), int(counters['wchar'])
+	except (IOError, KeyError, ValueError):
+		return None, None
+
+
+class Phase(object):
+	"""
+	Times a phase of the run when `--profile` is given. Records wall time, CPU time of finished child processes, bytes
+	read and written and the exit status, appending each record as a JSON line to `PROFILE_FILE`.
+
+	E.g.
+
+	with Phase('git fetch') as phase:
+		phase.status = p.returncode
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.status = None
+
+	def __enter__(self):
+		if PROFILE_FILE:
+			self.start = time.time()
+			self.times = os.times()
+			self.io = io_counters()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if PROFILE_FILE:
+			times = os.times()
+			io = io_counters()
+			record = {'phase': self.name, 'start': round(self.start, 3), 'wall': round(time.time() - self.start, 3),
+					  'child_cpu': round(times[2] + times[3] - self.times[2] - self.times[3], 3),
+					  'bytes_read': None, 'bytes_written': None, 'status': self.status,
+					  'thread': threading.current_thread().name}
+			if exc_type is not None:
+				record['status'] = exc_type.__name__
+			if io[0] is not None:
+				record['bytes_read'] = io[0] - self.io[0]
+				record['bytes_written'] = io[1] - self.io[1]
+			with PROFILE_LOCK:
+				PROFILE_RECORDS.append(record)
+				with open(PROFILE_FILE, 'a') as f:
+					f.write(json.dumps(record) + '\n')
+		return False
+
+
+def profiled(name):
+	"""Decorator recording each call of a function as a `Phase`. A false return value is recorded as exit status 1."""
+	def decorate(function):
+		@wraps(function)
+		def wrapper(*args, **kwargs):
+			with Phase(name) as phase:
+				result = function(*args, **kwargs)
+				phase.status = 0 if result else 1
+			return result
+		return wrapper
+	return decorate
+
+
+def profile_report():
+	"""Prints a summary of the recorded phases, slowest first."""
+	if not PROFILE_FILE:
+		return
+	phases = {}
+	for record in PROFILE_RECORDS:
+		phase = phases.setdefault(record['phase'], {'count': 0, 'wall': 0, 'child_cpu': 0, 'read': 0, 'written': 0,
+													'failed': 0})
+		phase['count'] += 1
+		phase['wall'] += record['wall']
+		phase['child_cpu'] += record['child_cpu']
+		phase['read'] += record['bytes_read'] or 0
+		phase['written'] += record['bytes_written'] or 0
+		if record['status'] not in (0, None):
+			phase['failed'] += 1
+
+	print '\nProfile (%.1fs in total, details in %s):\n' % (time.time() - RUN_START, PROFILE_FILE)
+	print '\t%-24s %6s %10s %10s %10s %10s %7s' % ('Phase', 'Count', 'Wall (s)', 'CPU (s)', 'Read (MB)', 'Write (MB)',
+												   'Failed')
+	for name, phase in sorted(phases.items(), key=lambda item: -item[1]['wall']):
+		print '\t%-24s %6d %10.1f %10.1f %10.1f %10.1f %7d' % (name, phase['count'], phase['wall'], phase['child_cpu'],
+															   phase['read'] / 1048576.0, phase['written'] / 1048576.0,
+															   phase['failed'])
+
+
+RUNS = []
+RUNS_LOCK = threading.Lock()
+
+
+class Run(object):
+	"""
+	A command run in the background. Each of its stdout and stderr left as `PIPE` is read by a thread of its own and
+	handed line by line to `sinks` (callables such as `list.append` or a log file's `write`), so neither pipe can fill
+	up and stall the command. Stderr goes to `err_sinks`, or to `sinks` as well if not given. The command is stopped
+	if it runs for longer than `timeout` seconds, or when cancelled. With `group` the command is started in a process
+	group of its own, and everything it has started is stopped along with it. Other keyword arguments are passed to
+	`Popen`.
+	"""
+
+	def __init__(self, command, sinks=(), err_sinks=None, timeout=None, stdout=PIPE, stderr=PIPE, group=False,
+				 **kwargs):
+		self.command = command
+		self.timeout = timeout
+		self.group = group
+		self.timed_out = False
+		self.cancelled = False
+		self.streams = [(stdout, list(sinks)), (stderr, list(sinks if err_sinks is None else err_sinks))]
+		self.kwargs = kwargs
+		if group and platform.system() == 'Windows':
+			self.kwargs['creationflags'] = 0x200  # CREATE_NEW_PROCESS_GROUP
+		elif group:
+			self.kwargs['preexec_fn'] = os.setsid
+		self.process = None
+		self.readers = []
+		self.timer = None
+		self.lock = threading.Lock()  # Sinks are never called by both readers at once
+
+	def start(self):
+		# Other commands started at the same time must not inherit these pipes, or they won't close when this one exits
+		self.process = Popen(self.command, stdout=self.streams[0][0], stderr=self.streams[1][0],
+							 close_fds=platform.system() != 'Windows', **self.kwargs)
+		for pipe, (stream, sinks) in zip([self.process.stdout, self.process.stderr], self.streams):
+			if stream == PIPE:
+				reader = threading.Thread(target=self.read, args=(pipe, sinks))
+				reader.daemon = True
+				reader.start()
+				self.readers.append(reader)
+		if self.timeout:
+			self.timer = threading.Timer(self.timeout, self.expire)
+			self.timer.daemon = True
+			self.timer.start()
+		with RUNS_LOCK:
+			RUNS.append(self)
+		return self
+
+	def read(self, pipe, sinks):
+		for line in iter(pipe.readline, ''):
+			with self.lock:
+				for sink in sinks:
+					sink(line)
+		pipe.close()
+
+	def expire(self):
+		self.timed_out = True
+		self.cancel()
+
+	def cancel(self):
+		"""Stops the command, killing it if it hasn't exited five seconds after being asked to."""
+		self.cancelled = True
+		self.stop(False)
+		for i in range(0, 50):
+			if self.process.poll() is not None:
+				break
+			time.sleep(0.1)
+		if self.group or self.process.poll() is None:
+			self.stop(True)
+
+	def stop(self, kill):
+		try:
+			if self.group and platform.system() == 'Windows':
+				with open(os.devnull, 'w') as devnull:
+					call(['taskkill', '/T', '/F', '/PID', str(self.process.pid)], stdout=devnull, stderr=STDOUT)
+			elif self.group:
+				os.killpg(self.process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+			elif kill:
+				self.process.kill()
+			else:
+				self.process.terminate()
+		except OSError:
+			pass  # Already exited
+
+	def wait(self):
+		"""Waits for the command and its output. Returns the exit code, or None if the command was stopped."""
+		returncode = self.process.wait()
+		for reader in self.readers:
+			reader.join(5 if self.cancelled else None)  # Anything the command started may still hold its pipes
+		if self.timer:
+			self.timer.cancel()
+		with RUNS_LOCK:
+			if self in RUNS:
+				RUNS.remove(self)
+		if self.cancelled:
+			return None
+		return returncode
+
+
+def run_commands(commands, timeout=None, merge_stderr=False, **kwargs):
+	"""
+	Runs independent commands side by side and waits for all of them. Returns the exit code (None if it timed out),
+	stdout and stderr of each, in order. With `merge_stderr` stderr is interleaved with stdout.
+	"""
+	outputs = [([], []) for command in commands]
+	runs = [Run(command, [out.append], None if merge_stderr else [err.append], timeout, **kwargs).start()
+			for command, (out, err) in zip(commands, outputs)]
+	results = []
+	for run, (out, err) in zip(runs, outputs):
+		returncode = run.wait()
+		if run.timed_out:
+			name = run.command if isinstance(run.command, basestring) else os.path.basename(run.command[0])
+			(out if merge_stderr else err).append('Error: %s timed out after %d seconds.\n' % (name, timeout))
+		results.append((returncode, ''.join(out), ''.join(err)))
+	return results
+
+
+def run_command(command, timeout=None, merge_stderr=False, **kwargs):
+	"""Runs a command to completion, as `Popen.communicate` would but with a timeout. See `run_commands`."""
+	return run_commands([command], timeout, merge_stderr, **kwargs)[0]
+
+
+def cancel_runs():
+	"""Stops every command still running, when this run exits early."""
+	with RUNS_LOCK:
+		runs = list(RUNS)
+	for run in runs:
+		run.cancel()
+
+
+atexit.register(cancel_runs)
+
+
+def cmd(command, repo=None):
 	"""
 	Executes a Git command and reports an error if one is detected.
+	Runs against `GIT_REPO` unless another working tree is given as `repo`.
 
 	E.g.
 
 	cmd(['pull'])
 	"""
 
-	command = [GIT_EXE, '-C', GIT_REPO] + command
-	output = Popen(command, stdout=PIPE, stderr=PIPE).communicate()
+	command = [GIT_EXE, '-C', repo or GIT_REPO] + command
+	with Phase('git %s' % command[3]) as phase:
+		returncode, out, err = run_command(command, COMMAND_TIMEOUT)
+		phase.status = returncode
+	output = (out, err)
 	if output[1]:
 		print(output[1])
 	return output
 
 
-def checkout(branch_name):
+def checkout(branch_name, repo=None):
 	"""Checks out a Git branch."""
 
 	print('Checking out %s...' % branch_name)
-	cmd(['checkout', branch_name])
+	cmd(['checkout', branch_name], repo)
+
+
+REMOTE_TIPS = None
+FETCH_LOCK = threading.Lock()
 
 
-def pull():
-	"""Pulls latest changes from the tracked remote Git repository."""
-	cmd(['fetch'])
-	out = cmd(['pull'])
+def fetch(repo=None):
+	"""Fetches from the remote and records its branch tips, which the rest of the run then works from."""
+	global REMOTE_TIPS
+	with FETCH_LOCK:
+		out = cmd(['fetch', GIT_REMOTE], repo)
+		refs = cmd(['for-each-ref', '--format=%(refname:short) %(objectname)', 'refs/remotes/' + GIT_REMOTE], repo)[0]
+		REMOTE_TIPS = dict(line.rsplit(' ', 1) for line in refs.splitlines())
+	return out
+
+
+def fetch_once(repo=None):
+	"""Fetches from the remote unless this run already has."""
+	if REMOTE_TIPS is None:
+		return fetch(repo)
+
+
+def pull(repo=None):
+	"""
+	Brings the checked out branch up to date with its remote branch. The remote is fetched once per run and later pulls
+	merge the tip recorded then, so a run only talks to the remote once and works against a single snapshot of it.
+	"""
+	fetch_once(repo)
+	out = cmd(['rev-parse', '--abbrev-ref', '--symbolic-full-name', '@{upstream}'], repo)
+	if out[1]:  # No tracking information
+		return out
+	upstream = out[0].strip()
+	if upstream not in REMOTE_TIPS:
+		return '', 'Error: %s was not found on the remote.' % upstream
+	out = cmd(['merge', '--ff', '-m', "Merge remote-tracking branch '%s'" % upstream, REMOTE_TIPS[upstream]], repo)
 	return out
 
 
@@ -145,41 +543,145 @@ def delete_branch(branch_name):
 	return out
 
 
-def merge(trunk, branch_name, no_ff=False):
-	"""Merges a Git branch to a trunk."""
-	checkout(trunk)
-	out = pull()
-	if out[1]:
-		if re.search('no tracking information', out[1]):  # Check if pull failed because there is no remote
-			if trunk in [GIT_DEVELOP, GIT_MASTER]:  # If trunk is not one of the main trunks we should exit with failure
-				return out
+def merge(trunk, branch_name, no_ff=False, repo=None, sync=True, no_commit=False):
+	"""
+	Merges a Git branch to a trunk.
+	Set `sync` to False when the trunk has already been pulled, and `no_commit` to leave the merge result uncommitted.
+	"""
+	checkout(trunk, repo)
+	if sync:
+		out = pull(repo)
+		if out[1]:
+			if re.search('no upstream', out[1]):  # Check if pull failed because there is no remote
+				if trunk in [GIT_DEVELOP, GIT_MASTER]:  # If trunk is not one of the main trunks we should exit with failure
+					return out
 
 	print('Merging %s into %s...' % (branch_name, trunk))
+	options = []
 	if no_ff:
-		out = cmd(['merge', '--no-ff', branch_name])
-	else:
-		out = cmd(['merge', branch_name])
+		options.append('--no-ff')
+	if no_commit:
+		options.append('--no-commit')
+	out = cmd(['merge'] + options + [branch_name], repo)
 	return out
 
 
-def push(remote, branch_name):
-	"""Pushes a branch to a remote repository."""
+def push(remote, branch_name, repo=None):
+	"""
+	Pushes a branch to a remote repository. If the push is rejected because the remote branch has moved on since this
+	run fetched it, the remote is fetched again, merged in (resolving any RPD conflict) and the push retried once.
+	"""
 	print('Pushing %s to %s...' % (branch_name, remote))
-	out = cmd(['push', remote, branch_name])
+	out = cmd(['push', remote, branch_name], repo)
+	if re.search('\\[rejected\\]', out[1]):
+		print('Push rejected, merging the latest %s from %s before retrying...' % (branch_name, remote))
+		fetch(repo)
+		if git_bi_merge(branch_name, '%s/%s' % (remote, branch_name), repo, sync=False):
+			out = cmd(['push', remote, branch_name], repo)
 	return out
 
 
-def commit_all(msg):
+def commit_all(msg, repo=None):
 	"""Commits all changes."""
-	out = cmd(['commit', '-a', '-m', msg])
+	out = cmd(['commit', '-a', '-m', msg], repo)
 	return out
 
 
-def tag(tag_name, branch_name, msg=""):
+def tag(tag_name, branch_name, msg="", repo=None):
 	"""Tag commit on a specific branch, optionally using a message."""
 	print('Tagging %s with %s...' % (branch_name, tag_name))
-	checkout(branch_name)
-	cmd(['tag', '-a', tag_name, '-m', msg])
+	checkout(branch_name, repo)
+	cmd(['tag', '-a', tag_name, '-m', msg], repo)
+
+
+def uncommitted(repo=None):
+	"""Returns True if a working tree has changes to tracked files or a merge in progress."""
+	if cmd(['rev-parse', '-q', '--verify', 'MERGE_HEAD'], repo)[0].strip():
+		return True
+	return bool(cmd(['status', '--porcelain', '--untracked-files=no'], repo)[0].strip())
+
+
+def unmerged(repo=None):
+	"""Lists the files the last merge left conflicted. Newer Git versions report conflicts on stdout only."""
+	return cmd(['diff', '--name-only', '--diff-filter=U'], repo)[0].splitlines()
+
+
+def run_jobs(function, jobs):
+	"""
+	Calls `function` with each tuple of arguments in `jobs`, at most `JOBS` at a time, and returns the results in the
+	same order. Threads are enough as each job spends its time waiting on the OBIEE tools.
+	"""
+	results = [False] * len(jobs)
+	pending = list(enumerate(jobs))
+	lock = threading.Lock()
+
+	def worker():
+		while True:
+			with lock:
+				if not pending:
+					return
+				i, args = pending.pop(0)
+			try:
+				results[i] = function(*args)
+			except Exception, error:
+				print('Error during %s: %s' % (function.__name__, error))
+
+	threads = [threading.Thread(target=worker) for i in range(0, min(JOBS, len(jobs)))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return results
+
+
+def checkout_stages(path, dests, repo=None, base=None):
+	"""
+	Writes the base, ours and theirs versions of a conflicted file straight to `dests`, e.g. in the workspace, rather
+	than next to the file. With `base`, that blob is written as the base version instead of the merge base's. Returns
+	the number of bytes written, or None if the file has no content conflict, e.g. was deleted on one side.
+	"""
+	stages = {}
+	for line in cmd(['ls-files', '--unmerged', '--', path], repo)[0].splitlines():
+		mode, blob, stage = line.split('\t')[0].split()
+		stages[stage] = blob
+	if sorted(stages) != ['1', '2', '3']:
+		return None
+	if base and base != stages['1']:
+		print('Merging %s against %s rather than the merge base version %s.' % (path, base[:10], stages['1'][:10]))
+	if not git_blobs([base or stages['1'], stages['2'], stages['3']], path, dests, repo):
+		return None
+	return sum(os.path.getsize(dest) for dest in dests)
+
+
+def git_dir(repo=None):
+	"""Returns the absolute path of the Git directory shared by all worktrees of the repository."""
+	path = cmd(['rev-parse', '--git-common-dir'], repo)[0].strip()
+	return os.path.join(repo or GIT_REPO, path)
+
+
+def add_worktree(trunk):
+	"""
+	Checks out a trunk into its own worktree under the Git directory, replacing any stale worktree. A worktree left with
+	uncommitted changes or an unfinished merge is kept, and None returned.
+	"""
+	path = os.path.join(git_dir(), 'obi-worktrees', trunk.replace('/', '_'))
+	if os.path.exists(os.path.join(path, '.git')) and uncommitted(path):
+		print('Error: The %s worktree at %s has uncommitted changes or an unfinished merge. Commit them, or discard them'
+			  ' with "git merge --abort" or "git reset --hard" there, and run again.' % (trunk, path))
+		return None
+	remove_worktree(path)
+	cmd(['worktree', 'add', path, trunk])
+	if os.path.exists(path):
+		return path
+	print('Error: Failed to create a worktree for %s at %s.' % (trunk, path))
+	return None
+
+
+def remove_worktree(path):
+	"""Deletes a worktree and its administrative files."""
+	if os.path.exists(path):
+		rmtree(path)
+	cmd(['worktree', 'prune'])
 
 
 def delete_file(f):
@@ -207,41 +709,430 @@ def copy_file(orig, dest, delete=False):
 			delete_file(f)
 
 
+FICLONE = 0x40049409  # Linux ioctl sharing a file's extents with another on copy-on-write filesystems (Btrfs, XFS)
+
+
+def reflink(src, dest):
+	"""Clones `src` to `dest` without copying its data, where the platform and filesystem support it."""
+	if platform.system() != 'Linux':
+		return False
+	import fcntl
+	try:
+		with open(src, 'rb') as s:
+			with open(dest, 'wb') as d:
+				fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+		return True
+	except (IOError, OSError):
+		delete_file(dest)
+		return False
+
+
+def stage_file(src, dest, keep_source=False, link=True):
+	"""
+	Puts `src` at `dest` writing as little as possible: a rename when the source isn't kept, otherwise a hardlink
+	(unless `link` is False, for files that will be modified in place) or a reflink, and only failing those a streamed
+	copy. Returns the number of bytes written.
+	"""
+	delete_file(dest)
+	if not keep_source:
+		try:
+			os.rename(src, dest)
+			return 0
+		except OSError:
+			pass
+	elif link:
+		try:
+			os.link(src, dest)
+			return 0
+		except (OSError, AttributeError):  # No hardlinks across filesystems, or on Windows in Python 2
+			pass
+	if reflink(src, dest):
+		written = 0
+	else:
+		with open(src, 'rb') as s:
+			with open(dest, 'wb') as d:
+				copyfileobj(s, d, 1048576)
+		written = os.path.getsize(dest)
+	if not keep_source:
+		delete_file(src)
+	return written
+
+
+WORKSPACE = None  # This run's directory in WORKSPACE_DIR
+WORKSPACE_MANIFEST = {}
+WORKSPACE_LOCK = threading.Lock()
+WORKSPACE_RPD_COPIES = 6  # Merge candidates, output and the tools' working copies, per RPD
+
+
+def pid_alive(pid):
+	"""Checks whether a process is still running."""
+	if platform.system() == 'Windows':
+		import ctypes
+		handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+		if not handle:
+			return False
+		exit_code = ctypes.c_ulong()
+		ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+		ctypes.windll.kernel32.CloseHandle(handle)
+		return exit_code.value == 259  # STILL_ACTIVE
+	try:
+		os.kill(pid, 0)
+		return True
+	except OSError:
+		return False
+
+
+def read_manifest(run_dir):
+	"""Returns the manifest of a run's workspace directory, or None if it has none (yet)."""
+	try:
+		with open(os.path.join(run_dir, 'manifest.json'), 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
+
+
+def write_manifest():
+	"""Saves this run's manifest, replacing the old one only once written so a crash never leaves it unreadable."""
+	manifest = os.path.join(WORKSPACE, 'manifest.json')
+	tmp = '%s.%d.tmp' % (manifest, os.getpid())
+	with open(tmp, 'w') as f:
+		json.dump(WORKSPACE_MANIFEST, f)
+	if os.path.exists(manifest):
+		os.remove(manifest)  # Windows will not rename over an existing file
+	os.rename(tmp, manifest)
+
+
+def start_workspace(tidy=True):
+	"""
+	Creates this run's directory in `WORKSPACE_DIR`, with a manifest of the intermediate files the run creates. Unless
+	`tidy` is False, files left by runs that crashed are removed first, and with `--tidyup` those kept by finished runs.
+	With `--resume`, the directory of the last interrupted run of the same action and name is taken over instead.
+	"""
+	global WORKSPACE
+	if not os.path.exists(WORKSPACE_DIR):
+		os.makedirs(WORKSPACE_DIR)
+	if RESUME:
+		resume_workspace(*RUN)
+	if tidy:
+		tidy_workspace(TIDY)
+	if WORKSPACE:
+		return
+	WORKSPACE = tempfile.mkdtemp(prefix='run-%s-%d-' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid()), dir=WORKSPACE_DIR)
+	WORKSPACE_MANIFEST.update({'pid': os.getpid(), 'action': ACTION, 'name': NAME, 'started': time.time(),
+							   'finished': None, 'paths': []})
+	write_manifest()
+
+
+def track(*paths):
+	"""Records intermediate files or directories in this run's manifest, so they are removed even if the run crashes."""
+	with WORKSPACE_LOCK:
+		for path in paths:
+			path = os.path.abspath(path)
+			if path not in WORKSPACE_MANIFEST['paths']:
+				WORKSPACE_MANIFEST['paths'].append(path)
+		write_manifest()
+
+
+def workspace_dir(*names):
+	"""Returns a directory for intermediate files in this run's workspace, creating it if need be."""
+	path = os.path.join(WORKSPACE, *names)
+	if not os.path.exists(path):
+		os.makedirs(path)
+		track(path)
+	return path
+
+
+def remove_run(run_dir, manifest):
+	"""Removes exactly the files a run recorded in its manifest, then its workspace directory."""
+	for path in reversed(manifest['paths']):
+		if os.path.isdir(path):
+			rmtree(path, True)
+		elif os.path.exists(path):
+			delete_file(str(path))
+	rmtree(run_dir, True)
+
+
+def tidy_workspace(everything=False):
+	"""
+	Removes the intermediate files of runs that died without finishing, and if `everything` is set those of finished
+	runs that kept theirs for inspection. Runs still going are left alone, as are interrupted runs of other actions
+	that `--resume` could continue.
+	"""
+	for run_dir in sorted(glob(os.path.join(WORKSPACE_DIR, 'run-*'))):
+		manifest = read_manifest(run_dir)
+		if run_dir == WORKSPACE or manifest is None:
+			continue
+		if manifest['finished'] is None and pid_alive(manifest['pid']):
+			continue
+		if manifest['finished'] is None and not everything and (manifest['action'], manifest.get('name')) != RUN \
+				and completed_steps(read_journal(run_dir)):
+			print 'Kept the interrupted run of %s, which can be continued with --resume.' % run_label(manifest)
+			continue
+		if manifest['finished'] is None or everything:
+			remove_run(run_dir, manifest)
+			print 'Removed the intermediate files of %s, %s on %s.' \
+				  % (run_label(manifest), 'finished' if manifest['finished'] else 'unfinished',
+					 time.strftime('%Y-%m-%d %H:%M', time.localtime(manifest['started'])))
+
+
+def finish_workspace():
+	"""
+	Removes this run's intermediate files if none are left over, e.g. the logs of a failed merge, or `--tidyup` is set.
+	Otherwise the run is marked finished, keeping them until a run with `--tidyup`.
+	"""
+	inside = os.path.join(WORKSPACE, '')
+	journal_dir = os.path.join(WORKSPACE, 'journal')
+	kept = [path for path in WORKSPACE_MANIFEST['paths'] if not path.startswith(inside) and os.path.exists(path)]
+	kept += [name for folder, dirs, files in os.walk(WORKSPACE) if folder != journal_dir
+			 for name in files if name not in ('manifest.json', 'journal.json')]
+	if TIDY or not kept:
+		remove_run(WORKSPACE, WORKSPACE_MANIFEST)
+		return
+	WORKSPACE_MANIFEST['finished'] = time.time()
+	write_manifest()
+	print '\nIntermediate files of this run are kept in %s. Run with --tidyup to remove them.' % WORKSPACE
+	if completed_steps(JOURNAL):
+		print 'Run again with --resume to skip the %d step(s) this run completed.' % completed_steps(JOURNAL)
+
+
+JOURNAL = {}  # Steps of this run, and of the interrupted run it resumes, by name
+JOURNAL_LOCK = threading.Lock()
+
+
+def run_label(manifest):
+	"""Describes a run by its action and name, e.g. "finishRelease v1.00"."""
+	return '%s%s' % (manifest['action'], ' ' + manifest['name'] if manifest.get('name') else '')
+
+
+def read_journal(run_dir):
+	"""Returns the step journal of a run's workspace directory, or None if it has none."""
+	try:
+		with open(os.path.join(run_dir, 'journal.json'), 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
+
+
+def write_journal():
+	"""Saves this run's step journal, replacing the old one only once written so a crash never leaves it unreadable."""
+	journal = os.path.join(WORKSPACE, 'journal.json')
+	tmp = '%s.%d.tmp' % (journal, os.getpid())
+	with open(tmp, 'w') as f:
+		json.dump(JOURNAL, f)
+	if os.path.exists(journal):
+		os.remove(journal)  # Windows will not rename over an existing file
+	os.rename(tmp, journal)
+
+
+def completed_steps(journal):
+	"""Counts the steps a journal records as completed."""
+	return len([entry for entry in (journal or {}).values() if entry.get('done')])
+
+
+def resume_workspace(action, name):
+	"""
+	Takes over the workspace directory and step journal of the latest run of `action` and `name` that was interrupted
+	or failed, so the steps it completed are skipped. Returns False, having said so, if there is none.
+	"""
+	global WORKSPACE
+	runs = []
+	for run_dir in glob(os.path.join(WORKSPACE_DIR, 'run-*')):
+		manifest = read_manifest(run_dir)
+		journal = read_journal(run_dir)
+		if manifest is None or not completed_steps(journal) or (manifest['action'], manifest.get('name')) != (action, name):
+			continue
+		if manifest['finished'] is None and pid_alive(manifest['pid']):
+			continue  # Still going
+		runs.append((manifest['started'], run_dir, manifest, journal))
+	if not runs:
+		print 'No interrupted run of %s to resume, starting afresh.' % run_label({'action': action, 'name': name})
+		return False
+
+	started, WORKSPACE, manifest, journal = max(runs)
+	WORKSPACE_MANIFEST.update(manifest)
+	WORKSPACE_MANIFEST.update({'pid': os.getpid(), 'finished': None, 'resumed': time.time()})
+	write_manifest()
+	JOURNAL.update(journal)
+	print 'Resuming %s started %s, which completed %d step(s).' \
+		  % (run_label(manifest), time.strftime('%Y-%m-%d %H:%M', time.localtime(started)), completed_steps(journal))
+	journal_rescue()
+	return True
+
+
+def journal_rescue():
+	"""
+	Copies the files journalled by the interrupted run that are still intact but outside the workspace into it, before
+	resuming reverts the merge that left them in the repository or working copy.
+	"""
+	inside = os.path.join(WORKSPACE, '')
+	for step, entry in JOURNAL.items():
+		if not entry.get('done'):
+			continue
+		for path, digest in entry['artefacts'].items():
+			path = str(path)
+			if path.startswith(inside) or not os.path.exists(path) or file_hash(path) != digest:
+				continue
+			copy = os.path.join(workspace_dir('journal'), hashlib.sha1(step).hexdigest() + os.path.splitext(path)[1])
+			stage_file(path, copy, keep_source=True)
+			journal_record(step, artefacts={copy: digest})
+
+
+def journal_record(step, **fields):
+	"""Updates the journal entry of `step` with `fields` and saves the journal."""
+	with JOURNAL_LOCK:
+		entry = JOURNAL.setdefault(step, {'started': time.time(), 'done': None, 'result': None, 'artefacts': {}})
+		entry.update(fields)
+		write_journal()
+
+
+def step_completed(step):
+	"""
+	Returns the journal entry of `step` if the interrupted run being resumed completed it and the files it produced are
+	unchanged since, saying the step is skipped. Returns None otherwise.
+	"""
+	with JOURNAL_LOCK:
+		entry = JOURNAL.get(step)
+	if not entry or not entry.get('done'):
+		return None
+	for path, digest in entry['artefacts'].items():
+		if not os.path.exists(path) or file_hash(path) != digest:
+			print '\nRedoing %s, as %s has changed since the interrupted run.' % (step, path)
+			return None
+	print '\nSkipping %s, completed by the interrupted run.' % step
+	return entry
+
+
+def journaled(step, function, *args, **kwargs):
+	"""
+	Calls `function` as the step `step` of this run, journalling it as completed unless it returns False. When resuming,
+	a step the interrupted run completed is skipped and the result it recorded returned instead.
+	"""
+	entry = step_completed(step)
+	if entry:
+		return entry['result']
+	journal_record(step, started=time.time(), done=None)
+	result = function(*args, **kwargs)
+	if result is not False:
+		journal_record(step, done=time.time(), result=result)
+	return result
+
+
+def journal_keep(step, path):
+	"""
+	Journals `step` as completed with the path and hash of the file it produced, for `journal_restore`. The file is
+	only copied into the workspace should `--resume` need it, see `journal_rescue`.
+	"""
+	journal_record(step, done=time.time(), artefacts={os.path.abspath(path): file_hash(path)})
+
+
+def journal_moved(src, dest):
+	"""Follows a journalled file moved from `src` to `dest`."""
+	src = os.path.abspath(src)
+	with JOURNAL_LOCK:
+		steps = [step for step, entry in JOURNAL.items() if src in entry['artefacts']]
+	for step in steps:
+		journal_record(step, artefacts={os.path.abspath(dest): JOURNAL[step]['artefacts'][src]})
+
+
+def journal_restore(step, path):
+	"""Puts the file journalled for `step` at `path`, if the run being resumed completed it. Returns True if so."""
+	entry = step_completed(step)
+	if not entry:
+		return False
+	journalled = str(entry['artefacts'].keys()[0])
+	if os.path.abspath(journalled) != os.path.abspath(path):
+		stage_file(journalled, path, keep_source=True)
+	return True
+
+
+def free_space(path):
+	"""Returns the free space in bytes on the filesystem holding `path`."""
+	if platform.system() == 'Windows':
+		import ctypes
+		free = ctypes.c_ulonglong(0)
+		ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(unicode(path)), None, None, ctypes.byref(free))
+		return free.value
+	stat = os.statvfs(path)
+	return stat.f_bavail * stat.f_frsize
+
+
+def check_free_space(rpds):
+	"""
+	Checks up front that the workspace has room to merge `rpds`, `JOBS` at a time, each needing about
+	`WORKSPACE_RPD_COPIES` times its size. Returns False, having said so, if not.
+	"""
+	sizes = sorted([os.path.getsize(rpd) for rpd in rpds if os.path.exists(rpd)], reverse=True)
+	needed = sum(sizes[:JOBS]) * WORKSPACE_RPD_COPIES
+	free = free_space(WORKSPACE)
+	if needed > free:
+		print '\n**Not enough free space in %s: merging needs about %d MB, %d MB is free. Set WORKSPACE_DIR in ' \
+			  '[Workspace] or --workspace to somewhere with more space.' % (WORKSPACE_DIR, needed / 1048576, free / 1048576)
+		return False
+	return True
+
+
 def read_file(filename, skip_lines=0):
 	"""Read file and return the full output. `skip_lines` will allow headers (and other content) to be ignored."""
-	output = ''
 	with open(filename, 'r') as f:
 		f.seek(0)
 		for i in range(skip_lines):
 			next(f)
 
-		for line in f:
-			output += line
-
-		f.close()
+		output = ''.join(f)
 	return output
 
 
-def git_bi_merge(trunk, branch_name):
-	"""Merges an RPD branch into a different trunk branch, calling the Admin Tool to resolve OBI conflicts."""
-	merge_out = merge(trunk, branch_name)
-	if merge_out[1]:  # Indicates merge failure/conflict
-		# Get candidates for 3-way merge
-		cmd(['checkout-index', '--stage=all', '--temp', GIT_RPD])
+def git_bi_merge(trunk, branch_name, repo=None, sync=True, commit=True, bases=None):
+	"""
+	Merges an RPD branch into a different trunk branch, calling the Admin Tool to resolve OBI conflicts.
+	With `commit` set to False the merge is left uncommitted and the commit message to use is returned on success.
+	`bases` maps RPD paths to the blob to merge against instead of the merge base's, see `refresh_feature`.
+	"""
+	repo = repo or GIT_REPO
+	merge_out = merge(trunk, branch_name, repo=repo, sync=sync, no_commit=not commit)
+	conflicts = unmerged(repo)
+	if conflicts or (commit and merge_out[1]):  # Indicates merge failure/conflict
+		rpds = [path for path in conflicts if path.lower().endswith('.rpd')]
+		if not rpds or len(rpds) < len(conflicts):
+			print('Error: Failed to merge %s to the %s branch, %s. Please complete the merge manually, or discard all '
+				  'changes on the branch.' % (branch_name, trunk, 'files other than RPDs are in conflict' if rpds
+											  else 'no RPD is in conflict'))
+			return False
 
-		# Rename by wildcards
-		orig_rpd = os.path.join(GIT_REPO, 'a.rpd')
-		mod_rpd = os.path.join(GIT_REPO, 'b.rpd')
-		curr_rpd = os.path.join(GIT_REPO, 'c.rpd')
-		out_rpd = os.path.join(GIT_REPO, GIT_RPD)
+		if not check_free_space([os.path.join(repo, rpd) for rpd in rpds]):
+			return False
 
-		copy_file(os.path.join(GIT_REPO, '.merge_file_a*'), orig_rpd, True)
-		copy_file(os.path.join(GIT_REPO, '.merge_file_b*'), mod_rpd, True)
-		copy_file(os.path.join(GIT_REPO, '.merge_file_c*'), curr_rpd, True)
+		# Each RPD is merged in a workspace directory of its own, keeping patches and logs of concurrent merges apart
+		merge_dir = workspace_dir('merge', trunk.replace('/', '_'))
 
-		bi_merge_out = three_way_merge(orig_rpd, curr_rpd, mod_rpd, out_rpd, RPD_PW, AUTO_OPEN, True)
+		# Get candidates for 3-way merge
+		merges = []
+		with Phase('stage candidates'):
+			for rpd in rpds:
+				work_dir = workspace_dir('merge', trunk.replace('/', '_'), rpd.replace('/', '_'))
+				orig_rpd = os.path.join(work_dir, 'a.rpd')
+				mod_rpd = os.path.join(work_dir, 'b.rpd')
+				curr_rpd = os.path.join(work_dir, 'c.rpd')
+				out_rpd = os.path.join(repo, rpd)
+
+				written = checkout_stages(rpd, [orig_rpd, mod_rpd, curr_rpd], repo, (bases or {}).get(rpd))
+				if written is None:
+					print('Error: Failed to merge %s to the %s branch, %s is not in conflict. Please complete the merge '
+						  'manually, or discard all changes on the branch.' % (branch_name, trunk, rpd))
+					return False
+				print('Staged merge candidates for %s (%.1f MB written).' % (rpd, written / 1048576.0))
+				merges.append((orig_rpd, curr_rpd, mod_rpd, out_rpd, RPD_PW, AUTO_OPEN, True, work_dir))
+
+		results = run_jobs(three_way_merge, merges)
+		if not all(results):
+			print('Error: Failed to merge %s.' % ', '.join(rpd for rpd, result in zip(rpds, results) if not result))
+		else:
+			rmtree(merge_dir, True)
+		bi_merge_out = all(results)
 		if bi_merge_out:
-			commit_out = commit_all('OBI Merged %s into %s.' % (branch_name, trunk))
+			if not commit:
+				return 'OBI Merged %s into %s.' % (branch_name, trunk)
+			commit_out = commit_all('OBI Merged %s into %s.' % (branch_name, trunk), repo)
 			if commit_out:
 				return True
 			else:
@@ -251,21 +1142,84 @@ def git_bi_merge(trunk, branch_name):
 			print('Error: Failed to merge %s to the %s branch. Please complete the merge manually,'
 				  ' or discard all changes on the branch.' % (branch_name, trunk))
 			return False
+	elif not commit:
+		return "Merge branch '%s' into %s" % (branch_name, trunk)
 	else:
 		return True
 
 
+def merge_to_both_worktrees(branch_name, tag_name=None):
+	"""
+	Merges to master and develop concurrently, each in its own Git worktree.
+	Commits, tags and pushes are then completed in a fixed order: master first, then develop.
+	"""
+	responses = {}
+	trunks = []
+	for trunk in [GIT_MASTER, GIT_DEVELOP]:
+		if step_completed('merge %s into %s' % (branch_name, trunk)):
+			responses[trunk] = True
+		else:
+			trunks.append(trunk)
+
+	cmd(['checkout', '--detach'])  # A branch cannot be checked out here and in a worktree at the same time
+
+	worktrees = {}
+	for trunk in trunks:
+		worktrees[trunk] = add_worktree(trunk)
+		if worktrees[trunk] is None:
+			for path in worktrees.values():
+				if path:
+					remove_worktree(path)
+			checkout(GIT_DEVELOP)
+			return
+		pull(worktrees[trunk])  # Pull up front so the concurrent merges don't fetch into the same refs
+
+	def run_merge(trunk):
+		responses[trunk] = git_bi_merge(trunk, branch_name, worktrees[trunk], sync=False, commit=False)
+
+	threads = [threading.Thread(target=run_merge, args=(trunk,)) for trunk in trunks]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+	for trunk in trunks:
+		message = responses.get(trunk)
+		if message:
+			commit_all(message, worktrees[trunk])
+			if uncommitted(worktrees[trunk]):
+				print('Error: Failed to commit the merge into %s.' % trunk)
+				responses[trunk] = False
+		if message and responses[trunk]:
+			merge_success(trunk, branch_name, repo=worktrees[trunk])
+			if tag_name and trunk == GIT_MASTER:
+				tag(tag_name, GIT_MASTER, repo=worktrees[trunk])
+			journal_record('merge %s into %s' % (branch_name, trunk), done=time.time())
+			remove_worktree(worktrees[trunk])
+		else:
+			print('The %s branch has been left checked out at %s to complete the merge.' % (trunk, worktrees[trunk]))
+
+	if responses.get(GIT_DEVELOP):
+		checkout(GIT_DEVELOP)
+	if responses.get(GIT_MASTER) and responses.get(GIT_DEVELOP):
+		delete_branch(branch_name)
+
+
 def merge_to_both(branch_name, tag_name=None):
 	"""Merges to develop and master trunks"""
-	master_response = git_bi_merge(GIT_MASTER, branch_name)
+	if WORKTREES:
+		return merge_to_both_worktrees(branch_name, tag_name)
+
+	master_response = journaled('merge %s into %s' % (branch_name, GIT_MASTER), git_bi_merge, GIT_MASTER, branch_name)
 	if master_response:
-		merge_success(GIT_MASTER, branch_name)
+		journaled('finish merge of %s into %s' % (branch_name, GIT_MASTER), merge_success, GIT_MASTER, branch_name)
 		if tag_name:
-			tag(tag_name, GIT_MASTER)
+			journaled('tag %s' % tag_name, tag, tag_name, GIT_MASTER)
 
-	develop_response = git_bi_merge(GIT_DEVELOP, branch_name)
+	develop_response = journaled('merge %s into %s' % (branch_name, GIT_DEVELOP), git_bi_merge, GIT_DEVELOP,
+								 branch_name)
 	if develop_response:
-		merge_success(GIT_DEVELOP, branch_name)
+		journaled('finish merge of %s into %s' % (branch_name, GIT_DEVELOP), merge_success, GIT_DEVELOP, branch_name)
 
 	if master_response and develop_response:
 		delete_branch(branch_name)
@@ -279,17 +1233,42 @@ def check_file_exists(file_path):
 			sys.exit(1)
 
 
+BI_ENV = {}
+
+
 def source(script, service=None):
 	"""
-	Update environment variables to allow execution of 11g BI commands.
+	Returns the environment variables needed to execute 11g BI commands, leaving this process's environment untouched.
 	Accepts a path to the `bi-init` shell or Windows command file.
 	Optionally accepts a `service` argument of "BI_Server" or "Presentation_Server" when an application needs to be
 	specified.
+	The environment is sourced once and persisted in `BI_ENV_CACHE_FILE`, keyed by the script path, its modification
+	time and `service`, so it is only sourced again when bi-init changes. Returns None on failure.
 	"""
 	try:
+		script_path = script.replace('^ ', ' ')
+		if os.path.exists(script_path):
+			mtime = os.path.getmtime(script_path)
+		else:
+			mtime = 0
+		cache_key = '%s|%s|%s' % (script, mtime, service)
+		if cache_key in BI_ENV:
+			return BI_ENV[cache_key]
+
+		cached = {}
+		if os.path.exists(BI_ENV_CACHE_FILE):
+			try:
+				with open(BI_ENV_CACHE_FILE, 'r') as f:
+					cached = json.load(f)
+			except ValueError:
+				cached = {}  # Corrupt cache, source again
+		if cache_key in cached:
+			BI_ENV[cache_key] = dict((k.encode('latin-1'), v.encode('latin-1')) for k, v in cached[cache_key].items())
+			return BI_ENV[cache_key]
+
 		# Based on http://pythonwise.blogspot.fr/2010/04/sourcing-shell-script.html
 		if platform.system() == 'Linux':
-			pipe = Popen(". %s; env" % script, stdout=PIPE, shell=True)
+			command = ". %s; env" % script
 		else:
 			# On a OBIEE-server install, bi-init.cmd will open a command window unless we pass in a dummy command for it.
 			# bi-init.cmd (as installed with OBIEE server) != bi_init.bat (as installed with OBIEE admin tools).
@@ -305,15 +1284,49 @@ def source(script, service=None):
 
 			command = '%s %s rem & set' % (script, application)
 
-			pipe = Popen(command, stdout=PIPE, shell=True)
-		data = pipe.communicate()[0]
-		env = dict(line.split("=", 1) for line in data.splitlines())
-		os.environ.update(env)
-		return True
+		data = run_command(command, COMMAND_TIMEOUT, shell=True)[1]
+		env = dict(line.split("=", 1) for line in data.splitlines() if '=' in line)
+		BI_ENV[cache_key] = env
+
+		# Drop snapshots of older versions of the same script and service
+		for key in cached.keys():
+			if key.rsplit('|', 2)[0] == script and key.rsplit('|', 1)[1] == str(service):
+				del cached[key]
+		cached[cache_key] = env
+		tmp = '%s.%d.tmp' % (BI_ENV_CACHE_FILE, os.getpid())
+		try:
+			with open(tmp, 'w') as f:
+				json.dump(cached, f, encoding='latin-1')  # Round-trips any console code page
+			delete_file(BI_ENV_CACHE_FILE)
+			os.rename(tmp, BI_ENV_CACHE_FILE)
+		except (IOError, OSError), error:
+			print '\tCould not save BI environment cache %s: %s' % (BI_ENV_CACHE_FILE, error)
+		return env
 	except Exception, error:
 		print '\n\nError in source() routine\nException caught: %s ' % error
 		print '\nExiting.'
-		return False
+		return None
+
+
+def bi_env():
+	"""Environment for OBIEE tool processes: the sourced bi-init environment on 11g, otherwise None (inherited)."""
+	if OBIEE_VERSION == '12':
+		return None
+	return source(BIINIT_PATH, 'BI_Server')
+
+
+def find_executable(command, env):
+	"""Resolves a command against the PATH in `env`, as Windows would otherwise search this process's own PATH."""
+	variables = dict((key.upper(), value) for key, value in env.items())
+	extensions = ['']
+	if platform.system() != 'Linux':
+		extensions += variables.get('PATHEXT', '.EXE;.CMD;.BAT').lower().split(';')
+	for folder in variables.get('PATH', '').split(os.pathsep):
+		for extension in extensions:
+			executable = os.path.join(folder.strip('"'), command + extension)
+			if os.path.isfile(executable):
+				return executable
+	return command
 
 
 def bi_command(command, server=False):
@@ -333,31 +1346,625 @@ def bi_command(command, server=False):
 		else:
 			executable += '.cmd'
 	else:
-		if not source(BIINIT_PATH, 'BI_Server'):
+		env = bi_env()
+		if env is None:
 			print '\n**Failed to set BI Environment (bi-init). Aborting.'
 			return False
-		executable = command
+		executable = find_executable(command, env)
 	return executable
 
 
-def create_patch(orig_rpd, orig_pass, curr_rpd, curr_pass, patch_file):
-	"""Create XML patch from RPD comparison using OBIEE's `compareRPD` method."""
+RPD_FILTER = 'obi-rpd'
 
-	print '\nCreating patch...\n'
-	compare_log = os.path.join(CURRENT_DIR, 'compareRPD.log')
-	log = open(compare_log, 'w')
-	script = [bi_command('comparerpd'), '-C', curr_rpd, '-p', curr_pass, '-G', orig_rpd, '-W', orig_pass, '-D', patch_file]
-	p = Popen(script, stdout=log, stderr=STDOUT)
-	p.wait()
-
-	if os.path.exists(patch_file):
-		print '\tPatch created successfully.'
-		delete_file(log)
+
+def storage_command(template, rpd, text):
+	"""
+	Builds a converter command from a `[Storage]` template, filling in the `{rpd}`, `{text}` and `{password}`
+	placeholders. A bare tool name is resolved like the other OBIEE tools.
+	"""
+	script = [arg.strip('"').replace('{rpd}', rpd).replace('{text}', text).replace('{password}', RPD_PW)
+			  for arg in shlex.split(template, posix=platform.system() == 'Linux')]
+	if script and not os.path.dirname(script[0]):
+		script[0] = bi_command(script[0])
+	return script
+
+
+def convert_rpd(template, rpd, text, output, log_file):
+	"""Runs a converter command, logging its output to `log_file`. Returns True if it wrote `output`."""
+	delete_file(output)
+	with open(log_file, 'w') as log:
+		returncode = Run(storage_command(template, rpd, text), [log.write], timeout=TOOL_TIMEOUT, env=bi_env()).start().wait()
+	return returncode == 0 and os.path.exists(output)
+
+
+def storage_filter(direction, path):
+	"""
+	Git clean (`rpdToText`) or smudge (`textToRpd`) filter for the RPD at `path`: converts the content on stdin with
+	the configured converter command and writes the result to stdout. Content already in the target form, e.g. a binary
+	RPD committed before the repository moved to text storage, is passed through unchanged. Returns the exit code.
+	"""
+	if platform.system() == 'Windows':
+		import msvcrt
+		msvcrt.setmode(sys.stdin.fileno(), os.O_BINARY)
+		msvcrt.setmode(sys.stdout.fileno(), os.O_BINARY)
+
+	start_workspace(False)  # Not tidying, which would write to stdout
+	work_dir = WORKSPACE
+	try:
+		rpd = os.path.join(work_dir, 'repository.rpd')
+		text = os.path.join(work_dir, 'repository.xml')
+		log_file = os.path.join(work_dir, 'convert.log')
+		source, output = (rpd, text) if direction == 'rpdToText' else (text, rpd)
+		with open(source, 'wb') as f:
+			copyfileobj(sys.stdin, f, 1048576)
+		with open(source, 'rb') as f:
+			binary = '\0' in f.read(8000)
+
+		if binary != (direction == 'rpdToText'):
+			output = source
+		elif not convert_rpd(RPD_TO_TEXT_CMD if direction == 'rpdToText' else TEXT_TO_RPD_CMD, rpd, text, output,
+							 log_file):
+			sys.stderr.write('Error: Failed to convert %s (%s).\n%s' % (path, direction, read_file(log_file)))
+			return 1
+
+		with open(output, 'rb') as f:
+			copyfileobj(f, sys.stdout, 1048576)
+		return 0
+	finally:
+		remove_run(WORKSPACE, WORKSPACE_MANIFEST)
+
+
+def configure_storage(repo=None):
+	"""Sets this script up as the Git filter converting the RPD between binary and text, for text storage."""
+	command = '"%s" "%s" %%s %%%%f -c "%s"' % (sys.executable, os.path.join(SCRIPT_DIR, os.path.basename(sys.argv[0])),
+											   CONFIG_FILE)
+	command = command.replace('\\', '/')  # Git runs filters through a POSIX shell, also on Windows
+	cmd(['config', 'filter.%s.clean' % RPD_FILTER, command % 'rpdToText'], repo)
+	cmd(['config', 'filter.%s.smudge' % RPD_FILTER, command % 'textToRpd'], repo)
+	cmd(['config', 'filter.%s.required' % RPD_FILTER, 'true'], repo)
+
+
+def convert_storage():
+	"""
+	Moves the checked out branch to text storage, marking `GIT_RPD` in `.gitattributes` as converted by the filter
+	and committing it as text. Other branches pick this up when they next merge with the branch. In a fresh clone of a
+	branch already stored as text, this only replaces the text checked out in place of the RPD with the binary RPD.
+	"""
+	if RPD_STORAGE != 'text':
+		print 'Error: Set RPD_STORAGE=text in the [Storage] section of %s first.' % CONFIG_FILE
+		return False
+
+	rpd = os.path.join(GIT_REPO, GIT_RPD)
+	with open(rpd, 'rb') as f:
+		binary = '\0' in f.read(8000)
+	if not binary:  # Checked out before the filter was set up
+		print('Converting %s in the working copy to binary...' % GIT_RPD)
+		delete_file(rpd)
+		cmd(['checkout', '--', GIT_RPD])
+
+	attributes_file = os.path.join(GIT_REPO, '.gitattributes')
+	attributes = read_file(attributes_file).splitlines() if os.path.exists(attributes_file) else []
+	line = '/%s filter=%s merge=binary' % (GIT_RPD.replace('\\', '/'), RPD_FILTER)
+	if line not in attributes:
+		with open(attributes_file, 'w') as f:
+			f.write(''.join('%s\n' % attribute for attribute in attributes + [line]))
+
+	cmd(['add', '.gitattributes'])
+	out = cmd(['add', '--renormalize', GIT_RPD])
+	if re.search('error|fatal', out[1]):
+		print('Error: Failed to convert %s to text.' % GIT_RPD)
+		return False
+	if run_command([GIT_EXE, '-C', GIT_REPO, 'diff', '--cached', '--quiet', '--', '.gitattributes', GIT_RPD])[0] != 0:
+		print('Converting %s to text...' % GIT_RPD)
+		cmd(['commit', '-m', 'Store %s as text.' % GIT_RPD, '--', '.gitattributes', GIT_RPD])
+	print('%s is stored as text on this branch.' % GIT_RPD)
+	return True
+
+
+PATCH_CACHE_STATS = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+RESOLUTION_STATS = {'reused': 0, 'recorded': 0, 'evicted': 0}
+FILE_HASHES = {}
+
+
+def file_hash(filename):
+	"""Returns the SHA-1 of a file's contents, read in chunks. Memoised by path, size and modification time."""
+	stat = os.stat(filename)
+	memo_key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+	if memo_key not in FILE_HASHES:
+		sha = hashlib.sha1()
+		with open(filename, 'rb') as f:
+			for chunk in iter(lambda: f.read(1024 * 1024), ''):
+				sha.update(chunk)
+		FILE_HASHES[memo_key] = sha.hexdigest()
+	return FILE_HASHES[memo_key]
+
+
+def patch_cache_key(orig_rpd, orig_pass, curr_rpd, curr_pass):
+	"""Key for a `comparerpd` patch: content hashes of both RPDs plus a hash (never the value) of the passwords."""
+	key = hashlib.sha1()
+	key.update(file_hash(orig_rpd))
+	key.update(file_hash(curr_rpd))
+	key.update(hashlib.sha1('%s\0%s' % (orig_pass, curr_pass)).hexdigest())
+	return key.hexdigest()
+
+
+def patch_cache_path(key):
+	"""Path of the cached patch XML for `key`. Sidecar files for the same entry share the `key.` prefix."""
+	return os.path.join(PATCH_CACHE_DIR, '%s.xml' % key)
+
+
+def patch_cache_get(key, patch_file):
+	"""Copies a cached patch to `patch_file`. Returns True on a cache hit."""
+	cached = patch_cache_path(key)
+	try:
+		copyfile(cached, patch_file)
+		os.utime(cached, None)  # Mark as recently used for LRU eviction
+	except (IOError, OSError):
+		PATCH_CACHE_STATS['misses'] += 1
+		return False
+	PATCH_CACHE_STATS['hits'] += 1
+	return True
+
+
+def patch_cache_put(key, patch_file):
+	"""Stores a patch in the cache, then evicts the least recently used entries over `PATCH_CACHE_MAX_MB`."""
+	cached = patch_cache_path(key)
+	tmp = '%s.%d.tmp' % (cached, os.getpid())
+	try:
+		if not os.path.exists(PATCH_CACHE_DIR):
+			os.makedirs(PATCH_CACHE_DIR)
+		copyfile(patch_file, tmp)
+		if os.path.exists(cached):
+			os.remove(cached)  # Windows will not rename over an existing file
+		os.rename(tmp, cached)
+	except (IOError, OSError), error:
+		print '\tCould not store patch in cache %s: %s' % (PATCH_CACHE_DIR, error)
+		delete_file(tmp)
+		return False
+	PATCH_CACHE_STATS['stored'] += 1
+	PATCH_CACHE_STATS['evicted'] += cache_evict(PATCH_CACHE_DIR, patch_cache_path, PATCH_CACHE_MAX_MB)
+	return True
+
+
+def cache_entries(cache_dir):
+	"""Groups the files of an on-disk cache by entry key, the part of each name before the first dot."""
+	entries = {}
+	for f in glob(os.path.join(cache_dir, '*')):
+		if not f.endswith('.tmp'):
+			entries.setdefault(os.path.basename(f).split('.')[0], []).append(f)
+	return entries
+
+
+def cache_evict(cache_dir, entry_path, max_mb):
+	"""
+	Removes least recently used entries of an on-disk cache, including their sidecar files, until under `max_mb`. An
+	entry's last use is the modification time of its `entry_path(key)`. Returns the number of entries removed.
+	"""
+	entries = {}
+	for key, files in cache_entries(cache_dir).items():
+		entry = entries.setdefault(key, {'files': [], 'size': 0, 'used': 0})
+		for f in files:
+			try:
+				entry['size'] += os.path.getsize(f)
+				if f == entry_path(key):
+					entry['used'] = os.path.getmtime(f)
+			except OSError:
+				continue  # Removed by a concurrent run
+			entry['files'].append(f)
+
+	evicted = 0
+	total = sum(entry['size'] for entry in entries.values())
+	for key, entry in sorted(entries.items(), key=lambda item: item[1]['used']):
+		if total <= max_mb * 1024 * 1024:
+			break
+		for f in entry['files']:
+			delete_file(f)
+		total -= entry['size']
+		evicted += 1
+	return evicted
+
+
+def patch_cache_report():
+	"""Prints patch cache usage for this run, if the cache was consulted."""
+	if PATCH_CACHE_STATS['hits'] or PATCH_CACHE_STATS['misses']:
+		print '\nPatch cache: %(hits)d hit(s), %(misses)d miss(es), %(stored)d stored, %(evicted)d evicted.' \
+			  % PATCH_CACHE_STATS
+
+
+def merge_key(orig_rpd, curr_rpd, mod_rpd, rpd_pass):
+	"""
+	Identifies a three way merge: content hashes of the original, current and modified RPDs, in those roles, plus a hash
+	(never the value) of the password.
+	"""
+	key = hashlib.sha1()
+	for rpd in (orig_rpd, curr_rpd, mod_rpd):
+		key.update(file_hash(rpd))
+	key.update(hashlib.sha1(rpd_pass or '').hexdigest())
+	return key.hexdigest()
+
+
+def resolution_key(orig_rpd, curr_rpd, mod_rpd, rpd_pass):
+	"""Key for a merge resolution, see `merge_key`. None when the resolution cache is turned off."""
+	if not RESOLUTION_CACHE:
+		return None
+	return merge_key(orig_rpd, curr_rpd, mod_rpd, rpd_pass)
+
+
+def resolution_path(key):
+	"""Path of the resolved RPD recorded for `key`. Its details are kept beside it in `key.json`."""
+	return os.path.join(RESOLUTION_CACHE_DIR, '%s.rpd' % key)
+
+
+def resolution_details(key):
+	"""Reads the details recorded with a resolution, or an empty dict if they are missing."""
+	try:
+		with open(os.path.join(RESOLUTION_CACHE_DIR, '%s.json' % key), 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return {}
+
+
+def resolution_get(key, out_rpd):
+	"""Copies the resolution recorded for `key` to `out_rpd`. Returns True if there was one."""
+	recorded = resolution_path(key) if key else None
+	if not recorded or not os.path.exists(recorded):
+		return False
+	try:
+		copyfile(recorded, out_rpd)
+		os.utime(recorded, None)  # Mark as recently used for LRU eviction
+	except (IOError, OSError), error:
+		print '\tCould not reuse recorded resolution %s: %s' % (recorded, error)
+		delete_file(out_rpd)
+		return False
+	RESOLUTION_STATS['reused'] += 1
+	print '\n\tReused the merge resolution recorded %s for the same merge candidates (%s).' \
+		  % (resolution_details(key).get('recorded', 'earlier'), key[:12])
+	print '\tIf it is no longer wanted, run forgetResolution %s and merge again.' % key[:12]
+	return True
+
+
+def resolution_put(key, out_rpd, candidates):
+	"""
+	Records `out_rpd` as the resolution of the merge of `candidates` (original, current and modified RPDs), then evicts
+	the least recently used resolutions over `RESOLUTION_CACHE_MAX_MB`.
+	"""
+	if not key:
+		return False
+	recorded = resolution_path(key)
+	tmp = '%s.%d.tmp' % (recorded, os.getpid())
+	try:
+		if not os.path.exists(RESOLUTION_CACHE_DIR):
+			os.makedirs(RESOLUTION_CACHE_DIR)
+		copyfile(out_rpd, tmp)
+		if os.path.exists(recorded):
+			os.remove(recorded)  # Windows will not rename over an existing file
+		os.rename(tmp, recorded)
+		with open(os.path.join(RESOLUTION_CACHE_DIR, '%s.json' % key), 'w') as f:
+			json.dump({'recorded': time.strftime('%Y-%m-%d %H:%M:%S'), 'action': ' '.join(filter(None, [ACTION, NAME])),
+					   'candidates': dict(zip(('original', 'current', 'modified'), candidates))}, f, indent=1)
+	except (IOError, OSError), error:
+		print '\tCould not record merge resolution in %s: %s' % (RESOLUTION_CACHE_DIR, error)
+		delete_file(tmp)
+		return False
+	RESOLUTION_STATS['recorded'] += 1
+	print '\tRecorded the merge resolution (%s) for reuse.' % key[:12]
+	RESOLUTION_STATS['evicted'] += cache_evict(RESOLUTION_CACHE_DIR, resolution_path, RESOLUTION_CACHE_MAX_MB)
+	return True
+
+
+def forget_resolutions(name):
+	"""
+	Lists the recorded merge resolutions if `name` is not given. Otherwise forgets those whose key starts with `name`,
+	or all of them if it is "all", so the next merge of their candidates is done afresh.
+	"""
+	entries = cache_entries(RESOLUTION_CACHE_DIR)
+	if not name:
+		if not entries:
+			print 'No merge resolutions recorded in %s.' % RESOLUTION_CACHE_DIR
+		for key in sorted(entries, key=lambda key: resolution_details(key).get('recorded')):
+			details = resolution_details(key)
+			candidates = details.get('candidates', {})
+			print '%s  %s  %s' % (key[:12], details.get('recorded', '?'), details.get('action', '?'))
+			for role in ('original', 'current', 'modified'):
+				print '\t%s:\t%s' % (role.capitalize(), candidates.get(role, '?'))
 		return True
-	else:
-		print '\n\tFailed to create patch. See %s for details.\n'\
-			  % os.path.abspath(compare_log)
+
+	keys = [key for key in entries if name == 'all' or key.startswith(name)]
+	if not keys:
+		print '\n**No recorded merge resolution matches %s.' % name
 		return False
+	for key in keys:
+		for f in entries[key]:
+			delete_file(f)
+	print 'Forgot %d recorded merge resolution(s).' % len(keys)
+	return True
+
+
+def resolution_report():
+	"""Prints merge resolution cache usage for this run, if any resolution was reused or recorded."""
+	if RESOLUTION_STATS['reused'] or RESOLUTION_STATS['recorded']:
+		print '\nMerge resolutions: %(reused)d reused, %(recorded)d recorded, %(evicted)d evicted.' % RESOLUTION_STATS
+
+
+TOOL_MATCHERS = [
+	('conflict', re.compile('Conflicts are found')),
+	('error', re.compile('\\[nQSError|^\\s*Error|Exception', re.IGNORECASE)),
+	('progress', re.compile('^\\s*(Loading|Reading|Comparing|Equalizing|Applying|Patching|Writing|Saving)',
+							re.IGNORECASE)),
+]
+
+
+PATCH_OPERATIONS = {'DECLARE': 'declare', 'DELETE': 'delete'}
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+ElementTree.register_namespace('xsi', XSI_NAMESPACE)  # Keeps the usual prefix when patches are rewritten
+
+
+def index_patch(patch_file, index_file):
+	"""
+	Writes an index of the repository objects a patch touches to `index_file`, one object per line with its operation,
+	type, qualified name and UID, tab separated. The patch is parsed as a stream and each object is dropped once read,
+	so memory use stays flat however big the patch. Returns the number of objects indexed per operation, or None if the
+	patch could not be parsed.
+	"""
+	counts = {}
+	elements = []
+	names = []
+	operation = None
+	tmp = '%s.%d.tmp' % (index_file, os.getpid())
+	try:
+		with open(tmp, 'w') as index:
+			for event, element in ElementTree.iterparse(patch_file, events=('start', 'end')):
+				tag = element.tag.split('}')[-1]
+				if event == 'start':
+					elements.append(element)
+					if len(elements) == 2:  # DECLARE or DELETE section
+						operation = PATCH_OPERATIONS.get(tag.upper(), tag.lower())
+					elif len(elements) > 2:  # An object, or a property of the object it is nested in
+						name = element.get('name')
+						parent = element.get('parentName') or (names[-1] if names else None)
+						if name is None:
+							names.append(parent)
+						elif parent:
+							names.append('%s."%s"' % (parent, name))
+						else:
+							names.append('"%s"' % name)
+					continue
+
+				elements.pop()
+				if len(elements) >= 2:
+					name = names.pop()
+					if element.get('name') is not None:
+						uid = element.get('uid') or element.get('id') or ''
+						line = '\t'.join([operation, tag, name, uid]).replace('\n', ' ')
+						index.write(line.encode('utf-8') + '\n')
+						counts[operation] = counts.get(operation, 0) + 1
+				if elements:
+					elements[-1].remove(element)  # Always its only child by now, as earlier ones were removed too
+		if os.path.exists(index_file):
+			os.remove(index_file)  # Windows will not rename over an existing file
+		os.rename(tmp, index_file)
+	except (SyntaxError, IOError, OSError), error:  # ElementTree.ParseError is a SyntaxError
+		print '\tCould not index patch %s: %s' % (patch_file, error)
+		delete_file(tmp)
+		return None
+	return counts
+
+
+def read_patch_index(index_file):
+	"""Yields (operation, type, qualified name, UID) for each object in a patch index, reading it as a stream."""
+	with open(index_file, 'r') as index:
+		for line in index:
+			yield tuple(line.decode('utf-8').rstrip('\n').split('\t'))
+
+
+def patch_index(key, patch_file, summary=True):
+	"""
+	Returns the path of the index stored beside a cached patch, indexing `patch_file` first if it hasn't been.
+	Optionally prints a summary of what the patch changes.
+	"""
+	index_file = '%s.idx' % os.path.splitext(patch_cache_path(key))[0]
+	if os.path.exists(index_file):
+		if not summary:
+			return index_file
+		counts = {}
+		for entry in read_patch_index(index_file):
+			counts[entry[0]] = counts.get(entry[0], 0) + 1
+	else:
+		counts = index_patch(patch_file, index_file)
+		if counts is None:
+			return None
+	if summary:
+		print '\tPatch touches %d object(s): %s.' % (sum(counts.values()), ', '.join(
+			'%d %s' % (count, operation) for operation, count in sorted(counts.items())) or 'none')
+	return index_file
+
+
+def print_conflict_report(changes, objects):
+	"""
+	Prints the pairs of features changing the same objects, most shared objects first, and a suggested merge order.
+	`changes` is the number of objects changed by each feature, and `objects` the features changing each object.
+	"""
+	pairs = {}
+	shared = dict((feature, 0) for feature in changes)
+	for key, features in objects.items():
+		if len(features) > 1:
+			for feature in features:
+				shared[feature] += 1
+			for pair in combinations(sorted(features), 2):
+				pairs.setdefault(pair, []).append(key)
+
+	print '\nConflict report for %d open feature(s)\n' % len(changes)
+	if pairs:
+		print 'Features changing the same objects, most first:\n'
+		for pair, keys in sorted(pairs.items(), key=lambda item: (-len(item[1]), item[0])):
+			examples = ', '.join('%s %s' % (object_type, name) for rpd, object_type, name in sorted(keys)[:3])
+			print '\t%4d\t%s and %s\t(%s%s)' % (len(keys), pair[0], pair[1], examples, ', ...' if len(keys) > 3 else '')
+	else:
+		print 'No two features change the same objects.'
+
+	print '\nSuggested merge order, fewest objects shared with other features first:\n'
+	order = sorted(changes, key=lambda feature: (shared[feature], changes[feature], feature))
+	for i, feature in enumerate(order):
+		print '\t%2d. %s\t(%d of %d changed objects shared)' % (i + 1, feature, shared[feature], changes[feature])
+
+
+def patch_objects(patch_file):
+	"""
+	Yields (section, object) for each top level object of a patch, with `section` the tag of the DECLARE or DELETE
+	section it is in. The patch is parsed as a stream and each object is dropped once yielded.
+	"""
+	elements = []
+	for event, element in ElementTree.iterparse(patch_file, events=('start', 'end')):
+		if event == 'start':
+			elements.append(element)
+			continue
+		elements.pop()
+		if len(elements) == 2:
+			yield elements[1].tag, element
+			elements[1].remove(element)
+
+
+def patch_object_key(element):
+	"""Returns the type of a patch object, its UID (or qualified name if it has no UID) and its qualified name."""
+	name = element.get('name') or ''
+	if element.get('parentName'):
+		name = '%s."%s"' % (element.get('parentName'), name)
+	return element.tag.split('}')[-1], element.get('uid') or element.get('id') or name, name
+
+
+def compose_patches(patch_files, output):
+	"""
+	Folds patches into one with the effect of applying them in order, for patches made against the same original (or
+	each against the result of the one before). Objects touched by several patches are reported as overlaps, as applying
+	the patches one at a time would have merged or conflicted on them, and as keeping any one patch's version would
+	drop the others' changes, nothing is written then. Patches are read as streams, first to find the patches touching
+	each object, then once per section to write the objects, so only object keys are held in memory. Returns the
+	overlaps as a list of (type, name, patch numbers), or None if a patch could not be read.
+	"""
+	touched = {}
+	names = {}
+	sections = []
+	tmp = '%s.%d.tmp' % (output, os.getpid())
+	try:
+		for number, patch_file in enumerate(patch_files, 1):
+			for section, element in patch_objects(patch_file):
+				object_type, uid, name = patch_object_key(element)
+				names[object_type, uid] = name
+				if number not in touched.setdefault((object_type, uid), []):
+					touched[object_type, uid].append(number)
+				if section not in sections:
+					sections.append(section)
+
+		overlaps = sorted((key[0], names[key], numbers) for key, numbers in touched.items() if len(numbers) > 1)
+		if overlaps:
+			print '\tCould not compose %d patch(es): %d object(s) are touched by more than one patch.' \
+				  % (len(patch_files), len(overlaps))
+			for object_type, name, numbers in overlaps[:10]:
+				print '\t\t%s %s: patches %s' % (object_type, name, ', '.join(str(number) for number in numbers))
+			if len(overlaps) > 10:
+				print '\t\t... and %d more' % (len(overlaps) - 10)
+			return overlaps
+
+		with open(tmp, 'w') as f:
+			f.write('<?xml version="1.0" encoding="UTF-8" ?>\n<Repository xmlns:xsi="%s">\n' % XSI_NAMESPACE)
+			for section in sections:
+				f.write('<%s>\n' % section.split('}')[-1])
+				for number, patch_file in enumerate(patch_files, 1):
+					for object_section, element in patch_objects(patch_file):
+						if object_section == section and touched[patch_object_key(element)[:2]][-1] == number:
+							element.tail = '\n'
+							f.write(ElementTree.tostring(element))
+				f.write('</%s>\n' % section.split('}')[-1])
+			f.write('</Repository>\n')
+		if os.path.exists(output):
+			os.remove(output)  # Windows will not rename over an existing file
+		os.rename(tmp, output)
+	except (SyntaxError, IOError, OSError), error:  # ElementTree.ParseError is a SyntaxError
+		print '\tCould not compose patches: %s' % error
+		delete_file(tmp)
+		return None
+
+	print '\tComposed %d patch(es) into %s: %d object(s).' % (len(patch_files), output, len(touched))
+	return overlaps
+
+
+def run_tool(script, log_file, abort_on_conflict=False):
+	"""
+	Runs an OBIEE command line tool, streaming its output line by line into `log_file` so memory use stays flat.
+	Progress lines are echoed as they arrive and conflicts are reported the moment they appear. With
+	`abort_on_conflict` the tool is stopped at the first conflict, as the merge will have to be finished manually.
+	The tool is also stopped if it runs for longer than `TOOL_TIMEOUT`.
+	Returns the exit code (None if stopped) and a count of the lines matching each of `TOOL_MATCHERS`.
+	"""
+	found = dict((marker, 0) for marker, pattern in TOOL_MATCHERS)
+	log = open(log_file, 'w')
+
+	def scan(line):
+		log.write(line)
+		for marker, pattern in TOOL_MATCHERS:
+			if pattern.search(line):
+				found[marker] += 1
+				if marker == 'progress':
+					print '\t%s' % line.strip()
+				elif marker == 'conflict' and found[marker] == 1:
+					print '\n\tConflicts detected. Can resolve manually using the Admin Tool.'
+					if abort_on_conflict:
+						print '\tStopping %s early.' % os.path.basename(script[0])
+						run.cancel()
+				break
+
+	run = Run(script, [scan], timeout=TOOL_TIMEOUT, env=bi_env())
+	returncode = run.start().wait()
+	log.close()
+	if run.timed_out:
+		print '\n\t%s timed out after %d seconds.' % (os.path.basename(script[0]), TOOL_TIMEOUT)
+	return returncode, found
+
+
+PATCHES_IN_FLIGHT = {}
+PATCHES_IN_FLIGHT_LOCK = threading.Lock()
+
+
+@profiled('comparerpd')
+def create_patch(orig_rpd, orig_pass, curr_rpd, curr_pass, patch_file, log_dir=None):
+	"""
+	Create XML patch from RPD comparison using OBIEE's `compareRPD` method. A merge needing a patch that a concurrent
+	merge is already creating waits for it and then takes it from the cache, rather than comparing the RPDs again.
+	"""
+
+	print '\nCreating patch...\n'
+	cache_key = None
+	in_flight = threading.Lock()
+	if PATCH_CACHE:
+		cache_key = patch_cache_key(orig_rpd, orig_pass, curr_rpd, curr_pass)
+		with PATCHES_IN_FLIGHT_LOCK:
+			in_flight = PATCHES_IN_FLIGHT.setdefault(cache_key, in_flight)
+
+	with in_flight:
+		if cache_key and patch_cache_get(cache_key, patch_file):
+			print '\tPatch found in cache (%s).' % cache_key
+			patch_index(cache_key, patch_file)
+			return True
+
+		delete_file(patch_file)  # A stale or placeholder file must not be mistaken for comparerpd output
+		compare_log = os.path.join(log_dir or WORKSPACE, 'compareRPD.log')
+		script = [bi_command('comparerpd'), '-C', curr_rpd, '-p', curr_pass, '-G', orig_rpd, '-W', orig_pass, '-D',
+				  patch_file]
+		run_tool(script, compare_log)
+
+		if os.path.exists(patch_file):
+			print '\tPatch created successfully.'
+			delete_file(compare_log)
+			if cache_key and patch_cache_put(cache_key, patch_file):
+				patch_index(cache_key, patch_file)
+			return True
+		else:
+			print '\n\tFailed to create patch. See %s for details.\n'\
+				  % os.path.abspath(compare_log)
+			return False
+
+
+ADMIN_TOOL_LOCK = threading.Lock()
 
 
 def admin_tool():
@@ -370,48 +1977,59 @@ def admin_tool():
 		else:
 			executable = os.path.join(OBIEE_CLIENT, 'bi', 'bitools', 'bin', 'admintool.cmd')
 	else:
-		if not source(BIINIT_PATH, 'BI_Server'):
+		env = bi_env()
+		if env is None:
 			print '\n**Failed to set BI Environment (bi-init). Aborting.'
 			return False
-		executable = 'admintool.exe'
+		executable = find_executable('admintool.exe', env)
 	return executable
 
 
 def open_rpd(rpd, password, prompt=True):
-	"""Programatically pens an RPD using the Admin Tool."""
+	"""Programatically pens an RPD using the Admin Tool. Concurrent merges take turns using the Admin Tool."""
 
-	with open('openRPD.txt', 'w') as f:
-		f.write('OpenOffline %s %s' % (rpd, password))
-		f.close()
+	with ADMIN_TOOL_LOCK:
+		command_file = os.path.join(WORKSPACE, 'openRPD.txt')
+		with open(command_file, 'w') as f:
+			f.write('OpenOffline %s %s' % (rpd, password))
+			f.close()
 
-	if prompt:
-		raw_input('\nWill open RPD using the Admin Tool. \n\nPress Enter key to continue.'
-				  '\n\nYou must close the AdminTool after completing the merge manually in order for this'
-				  ' script to continue.\n\n')
+		if prompt:
+			try:
+				raw_input('\nWill open RPD using the Admin Tool. \n\nPress Enter key to continue.'
+						  '\n\nYou must close the AdminTool after completing the merge manually in order for this'
+						  ' script to continue.\n\n')
+			except EOFError:  # E.g. run by the merge server
+				print '\n**No one is available to complete the merge in the Admin Tool.'
+				return False
 
-	call([admin_tool(), '/Command', 'openRPD.txt'])
-	delete_file('openRPD.txt')
+		call([admin_tool(), '/Command', command_file], env=bi_env())
+		delete_file(command_file)
 	return True
 
 
+@profiled('patchrpd')
 def patch_rpd(mod_rpd, mod_pass, orig_rpd, orig_pass, patch_file, out_rpd, out_pass, patch_pass, curr_rpd=False,
-			  curr_pass=False, auto_open=False, delete_patch=False):
+			  curr_pass=False, auto_open=False, delete_patch=False, log_dir=None):
 	"""
 	Patches RPD with an XML patch. If conflicts arise, the RPD is opened in the Admin Tool, prompting the user to complete
 	the merge manually.
 	Current RPD and Password are not mandatory. If not specified, there must NOT be conflicts.
 	"""
 	print '\nPatching RPD...\n'
-	patch_log = os.path.join(CURRENT_DIR, 'patch_rpd.log')
-	log = open(patch_log, 'w')
+	patch_log = os.path.join(log_dir or WORKSPACE, 'patch_rpd.log')
 
 	# Ref: OBIEE 11g Administration Tool: Patch Repository Merge Not Working (Doc ID 1999105.1)
 	# -A flag tells patchrpd to skip subset patching and apply patch using input rpds
 	script = [bi_command('patchrpd'), '-A', '-C', mod_rpd, '-p', mod_pass, '-G', orig_rpd, '-Q', orig_pass, '-I',
 			  patch_file, '-S', patch_pass, '-O', out_rpd]
 
-	p = Popen(script, stdout=log, stderr=STDOUT)
-	p.wait()
+	side_dirs = set(os.path.dirname(os.path.abspath(rpd)) for rpd in (mod_rpd, orig_rpd, out_rpd))
+	existing = set(f for directory in side_dirs for f in rpd_side_files(directory))
+	returncode, found = run_tool(script, patch_log, ABORT_ON_CONFLICT)
+	track(*[f for directory in side_dirs for f in rpd_side_files(directory) if f not in existing])
+	if returncode is None:
+		delete_file(out_rpd)  # Partially written before patchrpd was stopped
 
 	if delete_patch:
 		delete_file(patch_file)
@@ -423,9 +2041,7 @@ def patch_rpd(mod_rpd, mod_pass, orig_rpd, orig_pass, patch_file, out_rpd, out_p
 		return True
 	else:
 		print '\tFailed to patch RPD. See %s for details.' % patch_log
-		log_contents = read_file(patch_log)
-		if re.search('Conflicts are found.', log_contents):
-			print '\n\tConflicts detected. Can resolve manually using the Admin Tool.'
+		if found['conflict']:
 			if manual_merge(orig_rpd, mod_rpd, curr_rpd, curr_pass, out_rpd):
 				return True
 			else:
@@ -434,10 +2050,12 @@ def patch_rpd(mod_rpd, mod_pass, orig_rpd, orig_pass, patch_file, out_rpd, out_p
 			return False
 
 
+@profiled('manual merge')
 def manual_merge(orig_rpd, mod_rpd, curr_rpd, curr_pass, out_rpd):
 	"""Prompts for a manual merge using the Admin Tool after detecting conflicts whilst attempting to automatically
-	patch.
+	patch. A successful merge is recorded in the resolution cache for reuse.
 	"""
+	resolution = resolution_key(orig_rpd, curr_rpd, mod_rpd, curr_pass)  # Before the Admin Tool can touch the RPDs
 
 	if os.path.basename(orig_rpd) == 'original.rpd':
 		orig_copy = os.path.join(os.path.dirname(orig_rpd), 'original1.rpd')
@@ -459,56 +2077,70 @@ def manual_merge(orig_rpd, mod_rpd, curr_rpd, curr_pass, out_rpd):
 	print '\tModified RPD:\t%s (%s)' % (mod_rpd, os.path.basename(mod_copy))
 	print '\nPerform a full repository merge using the Admin Tool and keep the output name as the default or %s' % out_rpd
 
-	copyfile(curr_rpd, curr_copy)
-	copyfile(orig_rpd, orig_copy)
-	copyfile(mod_rpd,  mod_copy)
+	track(orig_copy, mod_copy, curr_copy)
+	# The Admin Tool only reads the original and modified RPDs, but may write to the current RPD it opens
+	stage_file(curr_rpd, curr_copy, keep_source=True, link=False)
+	stage_file(orig_rpd, orig_copy, keep_source=True)
+	stage_file(mod_rpd, mod_copy, keep_source=True)
 
-	open_rpd(curr_copy, curr_pass)
+	if not open_rpd(curr_copy, curr_pass):
+		delete_file(orig_copy)
+		delete_file(mod_copy)
+		delete_file(curr_copy)
+		return False
 
 	output_file = os.path.basename(os.path.splitext(curr_copy)[0])
 	output_file += '(1).rpd'
 	output_file = os.path.join(os.path.dirname(curr_rpd), output_file)
+	track(output_file)
 
 	if not os.path.exists(out_rpd):
 		if os.path.exists(output_file):
-			copyfile(output_file, out_rpd)
-			delete_file(output_file)
+			stage_file(output_file, out_rpd)
 			delete_file(orig_copy)
 			delete_file(mod_copy)
 			delete_file(curr_copy)
-			return True
 		else:
 			print '\nError: Output RPD not found. Looking for %s or %s.' % (out_rpd, output_file)
 			return False
+	resolution_put(resolution, out_rpd, (orig_rpd, curr_rpd, mod_rpd))
 	return True
 
 
+RPD_SIDE_FILES = ['*_equalized.rpd', '*_patched.rpd', '*.merge_log.csv']  # Written by patchrpd next to its inputs
+
+
+def rpd_side_files(directory):
+	"""Lists the files patchrpd writes next to its inputs found in `directory`."""
+	return [os.path.abspath(f) for pattern in RPD_SIDE_FILES for f in glob(os.path.join(directory, pattern))]
+
+
 def cleanup_rpd_files(directory):
-	"""Remove temporary RPD files (from a patch merge)."""
+	"""Remove temporary RPD files (from a patch merge), leaving any this run did not create."""
 
-	for f in glob(os.path.join(directory, '*_equalized.rpd')):
-		delete_file(f)
-	for f in glob(os.path.join(directory, '*_patched.rpd')):
-		delete_file(f)
-	for f in glob(os.path.join(directory, '*.merge_log.csv')):
-		delete_file(f)
+	for f in rpd_side_files(directory):
+		if f in WORKSPACE_MANIFEST['paths']:
+			delete_file(f)
 
 
-def three_way_merge(orig_rpd, curr_rpd, mod_rpd, out_rpd, rpd_pass=False, auto_open=False, tidy=False):
+@profiled('three way merge')
+def three_way_merge(orig_rpd, curr_rpd, mod_rpd, out_rpd, rpd_pass=False, auto_open=False, tidy=False, work_dir=None):
 	"""
 	Performs a full three way RPD merge by first creating a patch using `compareRPD` between the original and current RPDs.
 	This patch is then applied to the modified RPD using the original as a baseline.
 	If merge conflicts are detected, the RPD is opened in the Admin Tool and the user is prompted to resolve the merge
-	manually.
+	manually. The resolution is recorded, and reused without running the tools when the same RPDs are merged again.
+	The merged RPD is also journalled, so resuming an interrupted run reuses it.
 	Requires original, current and modified RPDs as well as specified output.
 	If `rpd_pass` is unset, the `rm_sys.RPD_PW` global variable (set in [OBIEE]) will be used.
 	Setting `auto_open` to True will cause hte program to open the output RPD in the Admin Tool after the merge, which can
 	be useful for manual checking.
 	Setting `tidy` to True will remove all working RPD files, **including** the original, modified and current RPDs.
 	This leaves **only** the output RPD.
+	`work_dir` holds the patch and tool logs, defaulting to the workspace.
 	"""
 
-	patch_file = os.path.join(CURRENT_DIR, 'patch.xml')
+	patch_file = os.path.join(work_dir or WORKSPACE, 'patch.xml')
 
 	if not rpd_pass:
 		rpd_pass = RPD_PW
@@ -527,12 +2159,17 @@ def three_way_merge(orig_rpd, curr_rpd, mod_rpd, out_rpd, rpd_pass=False, auto_o
 		print 'Exiting'
 		return False
 
-	if not create_patch(orig_rpd, rpd_pass, curr_rpd, rpd_pass, patch_file):
+	step = 'RPD merge %s' % merge_key(orig_rpd, curr_rpd, mod_rpd, rpd_pass)
+	reused = resolution_get(resolution_key(orig_rpd, curr_rpd, mod_rpd, rpd_pass), out_rpd) or \
+		journal_restore(step, out_rpd)
+	if not reused and not create_patch(orig_rpd, rpd_pass, curr_rpd, rpd_pass, patch_file, work_dir):
 		print '\n**create_patch failed. Aborting.'
 		return False
 
-	if patch_rpd(mod_rpd, rpd_pass, orig_rpd, rpd_pass, patch_file, out_rpd, rpd_pass, rpd_pass, curr_rpd, rpd_pass,
-				 auto_open, tidy):
+	if reused or patch_rpd(mod_rpd, rpd_pass, orig_rpd, rpd_pass, patch_file, out_rpd, rpd_pass, rpd_pass, curr_rpd,
+						   rpd_pass, auto_open, tidy, work_dir):
+		if not reused:
+			journal_keep(step, out_rpd)
 		if tidy:
 			cleanup_rpd_files(os.path.dirname(curr_rpd))
 
@@ -547,11 +2184,11 @@ def three_way_merge(orig_rpd, curr_rpd, mod_rpd, out_rpd, rpd_pass=False, auto_o
 		return False
 
 
-def merge_success(trunk, branch_name, delete=False):
+def merge_success(trunk, branch_name, delete=False, repo=None):
 	if delete:
 		delete_branch(branch_name)  # Delete feature branch if merge is successful
 	if PUSH:
-		push(GIT_REMOTE, trunk)
+		push(GIT_REMOTE, trunk, repo)
 	print('Successfully merged %s to the %s branch.' % (branch_name, trunk))
 
 
@@ -562,16 +2199,132 @@ def start_feature(feature):
 
 def finish_feature(feature):
 	feature_name = FEATURE_PREFIX + feature
-	response = git_bi_merge(GIT_DEVELOP, feature_name)
+	response = journaled('merge %s into %s' % (feature_name, GIT_DEVELOP), git_bi_merge, GIT_DEVELOP, feature_name)
 	if response:
-		merge_success(GIT_DEVELOP, feature_name, True)
+		journaled('finish merge of %s into %s' % (feature_name, GIT_DEVELOP), merge_success, GIT_DEVELOP, feature_name,
+				  True)
+
+
+def feature_list(names):
+	"""Reads feature names from a comma separated list, or from a file with one name per line."""
+	path = os.path.join(CURRENT_DIR, names)
+	if os.path.isfile(path):
+		with open(path, 'r') as f:
+			names = ','.join(line.split('#')[0] for line in f)
+	return [name.strip() for name in names.split(',') if name.strip()]
+
+
+def finish_features(features):
+	"""
+	Finishes a queue of features in one go. Develop is pulled once, each feature is merged in turn onto the local
+	develop branch, and develop is pushed once at the end. A feature that fails to merge is rolled back and skipped.
+	"""
+	checkout(GIT_DEVELOP)
+	pull()
+	results = []
+	for feature in features:
+		feature_name = FEATURE_PREFIX + feature
+		step = 'merge %s into %s' % (feature_name, GIT_DEVELOP)
+		if step_completed(step):
+			results.append((feature, 'Merged'))
+			continue
+		head = cmd(['rev-parse', 'HEAD'])[0].strip()
+		if git_bi_merge(GIT_DEVELOP, feature_name, sync=False):
+			delete_branch(feature_name)
+			journal_record(step, done=time.time())
+			results.append((feature, 'Merged'))
+		else:
+			cmd(['reset', '--hard', head])
+			results.append((feature, 'FAILED'))
+
+	if PUSH and any(result == 'Merged' for _, result in results):
+		push(GIT_REMOTE, GIT_DEVELOP)
+
+	merged = sum(1 for _, result in results if result == 'Merged')
+	print('\nFinished %d of %d features into %s:' % (merged, len(results), GIT_DEVELOP))
+	for feature, result in results:
+		print('\t%s\t%s' % (result, FEATURE_PREFIX + feature))
+
+
+def load_state(state_file):
+	"""Returns what `state_file` records for this repository (`GIT_REPO`)."""
+	if os.path.exists(state_file):
+		with open(state_file, 'r') as f:
+			return json.load(f).get(GIT_REPO, {})
+	return {}
+
+
+def save_state(state_file, state):
+	"""Records `state` for this repository in `state_file`, keeping what it records for other repositories."""
+	states = {}
+	if os.path.exists(state_file):
+		with open(state_file, 'r') as f:
+			states = json.load(f)
+	elif not os.path.exists(os.path.dirname(state_file)):
+		os.makedirs(os.path.dirname(state_file))
+	states[GIT_REPO] = state
+	tmp = '%s.%d.tmp' % (state_file, os.getpid())
+	with open(tmp, 'w') as f:
+		json.dump(states, f)
+	if os.path.exists(state_file):
+		os.remove(state_file)  # Windows will not rename over an existing file
+	os.rename(tmp, state_file)
+
+
+def load_refresh_state():
+	"""What each feature branch absorbed from develop at its last refresh, see `refresh_feature`."""
+	return load_state(REFRESH_STATE_FILE)
+
+
+def save_refresh_state(state):
+	"""Records what each feature branch absorbed from develop at its last refresh."""
+	save_state(REFRESH_STATE_FILE, state)
+
+
+def tree_rpds(commit):
+	"""Returns the blob of each RPD in a commit, by path."""
+	rpds = {}
+	for line in cmd(['ls-tree', '-r', commit])[0].splitlines():
+		info, path = line.split('\t', 1)
+		if path.lower().endswith('.rpd'):
+			rpds[path] = info.split()[2]
+	return rpds
 
 
 def refresh_feature(feature):
+	"""
+	Merges develop, as on the remote, into a feature branch. Each refresh records the develop commit absorbed and its
+	RPDs, keyed by feature, in `REFRESH_STATE_FILE`. A refresh when develop has not moved since is skipped, and
+	a conflicted RPD is merged against the develop RPD last absorbed, so only develop's changes since the last refresh
+	are compared and patched, whatever merge base Git picks. The record is only trusted while the commit the last
+	refresh made is still in the feature's history.
+	"""
 	feature_name = FEATURE_PREFIX + feature
-	response = git_bi_merge(feature_name, GIT_DEVELOP)
+	state = load_refresh_state()
+	fetch_once()
+	upstream = '%s/%s' % (GIT_REMOTE, GIT_DEVELOP)
+	source = upstream if upstream in REMOTE_TIPS else GIT_DEVELOP
+	develop = REMOTE_TIPS.get(upstream) or cmd(['rev-parse', GIT_DEVELOP])[0].strip()
+	previous = state.get(feature_name)
+	if previous and run_command([GIT_EXE, '-C', GIT_REPO, 'merge-base', '--is-ancestor', previous['commit'],
+								 feature_name], COMMAND_TIMEOUT)[0] != 0:
+		print('%s has been rewritten since its last refresh, merging against the merge base.' % feature_name)
+		previous = None
+	if previous and previous['develop'] == develop:
+		print('\n%s is up to date with %s (%s).' % (feature, GIT_DEVELOP, develop[:10]))
+		return True
+
+	bases = {}
+	if previous:
+		bases = dict((path, rpd['develop']) for path, rpd in previous['rpds'].items())
+	response = git_bi_merge(feature_name, source, bases=bases)
 	if response:
+		head = cmd(['rev-parse', 'HEAD'])[0].strip()
+		state[feature_name] = {'commit': head, 'develop': develop, 'time': time.time(),
+							   'rpds': dict((path, {'develop': blob}) for path, blob in tree_rpds(develop).items())}
+		save_refresh_state(state)
 		print('\nRefreshed %s successfully from %s.' % (feature, GIT_DEVELOP))
+	return response
 
 
 def start_release(release):
@@ -601,11 +2354,425 @@ def finish_hotfix(hotfix, tag_name):
 	merge_to_both(hotfix_name, tag_name)
 
 
+def git_blobs(blobs, path, dests, repo=None):
+	"""
+	Writes each of `blobs` to the file of the same position in `dests`, all at the same time and streaming them rather
+	than reading them into memory. With text storage the blobs go through the filters set for `path`, so an RPD comes
+	out as binary. Returns True if all were written.
+	"""
+	script = [GIT_EXE, '-C', repo or GIT_REPO, 'cat-file', 'blob']
+	if RPD_STORAGE == 'text':
+		script = [GIT_EXE, '-C', repo or GIT_REPO, 'cat-file', '--filters', '--path=%s' % path]
+	files = [open(dest, 'wb') for dest in dests]
+	try:
+		runs = [Run(script + [blob], err_sinks=[], timeout=COMMAND_TIMEOUT, stdout=f).start()
+				for blob, f in zip(blobs, files)]
+		return all([run.wait() == 0 for run in runs])
+	finally:
+		for f in files:
+			f.close()
+
+
+def open_features():
+	"""Returns the open feature branches, local or on the remote, as a dict of branch name by tip commit."""
+	features = {}
+	refs = cmd(['for-each-ref', '--format=%(refname:short) %(objectname)', 'refs/heads', 'refs/remotes/' + GIT_REMOTE])[0]
+	for line in refs.splitlines():
+		name, tip = line.rsplit(' ', 1)
+		if name.startswith(GIT_REMOTE + '/'):
+			name = name[len(GIT_REMOTE) + 1:]
+		if name.startswith(FEATURE_PREFIX):
+			features.setdefault(tip, name)
+	return features
+
+
+def feature_patches(features, develop):
+	"""
+	Yields (feature, RPD, patch index) for each RPD changed on each of the open `features` since its merge base with
+	`develop`. This is the patch finishing the feature will apply to develop. Patches are created unless already in the
+	patch cache. Pairs of RPD versions already done are recorded in `PRECOMPUTE_STATE_FILE`, so that only features or
+	merge bases that have moved need their RPDs extracted again.
+	"""
+	state = load_state(PRECOMPUTE_STATE_FILE)
+	work_dir = workspace_dir('precompute')
+	try:
+		for tip, name in sorted(features.items(), key=lambda feature: feature[1]):
+			base = cmd(['merge-base', develop, tip])[0].strip()
+			if not base:
+				continue
+			for path in cmd(['diff', '--name-only', base, tip])[0].splitlines():
+				if not path.lower().endswith('.rpd'):
+					continue
+				blobs = [cmd(['rev-parse', '--verify', '-q', '%s:%s' % (commit, path)])[0].strip() for commit in (base, tip)]
+				pair = ':'.join(blobs)
+				if not all(blobs):
+					continue  # Added or deleted on the feature
+				if pair in state and os.path.exists(patch_cache_path(state[pair])):
+					yield name, path, patch_index(state[pair], patch_cache_path(state[pair]), False)
+					continue
+
+				print '\nCreating the patch of %s in %s...' % (path, name)
+				orig_rpd = os.path.join(work_dir, '%s.rpd' % blobs[0])  # Named by content, as file hashes are memoised by path
+				curr_rpd = os.path.join(work_dir, '%s.rpd' % blobs[1])
+				patch_file = os.path.join(work_dir, 'patch.xml')
+				if git_blobs(blobs, path, [orig_rpd, curr_rpd]) and \
+						create_patch(orig_rpd, RPD_PW, curr_rpd, RPD_PW, patch_file, work_dir):
+					state[pair] = patch_cache_key(orig_rpd, RPD_PW, curr_rpd, RPD_PW)
+					yield name, path, patch_index(state[pair], patch_file, False)
+				delete_file(orig_rpd)
+				delete_file(curr_rpd)
+				delete_file(patch_file)
+	finally:
+		save_state(PRECOMPUTE_STATE_FILE, state)
+
+
+def precompute_patches():
+	"""
+	Creates ahead of time the patches that finishing each open feature will need, so that `finishFeature` finds them in
+	the patch cache and only has to run `patchrpd`.
+	"""
+	if not PATCH_CACHE:
+		print '\n**Precomputed patches are kept in the patch cache, which is turned off (--no-patch-cache).'
+		return False
+
+	fetch()
+	develop = REMOTE_TIPS.get('%s/%s' % (GIT_REMOTE, GIT_DEVELOP)) or cmd(['rev-parse', GIT_DEVELOP])[0].strip()
+	features = open_features()
+	stored = PATCH_CACHE_STATS['stored']
+	ready = len(list(feature_patches(features, develop)))
+	print '\nPrecomputed %d patch(es), %d ready for %d open feature branch(es).' \
+		  % (PATCH_CACHE_STATS['stored'] - stored, ready, len(features))
+	return True
+
+
+def precompute(interval=None):
+	"""Precomputes patches for open features once, or every `interval` seconds until interrupted."""
+	try:
+		while precompute_patches() and interval:
+			print 'Checking again in %d seconds. Press Ctrl+C to stop.' % interval
+			time.sleep(interval)
+	except KeyboardInterrupt:
+		print '\nStopping.'
+
+
+def analyze_conflicts():
+	"""
+	Reports which open features change the same repository objects, without merging them. The objects each feature
+	changes are read from the index of its patch against develop (created if not in the patch cache), and an inverted
+	index from object to features gives the overlapping pairs in a single pass. Features are then suggested in merge
+	order, those sharing the fewest objects with other features first.
+	"""
+	if not PATCH_CACHE:
+		print '\n**Conflict analysis reads patches from the patch cache, which is turned off (--no-patch-cache).'
+		return False
+
+	fetch()
+	develop = REMOTE_TIPS.get('%s/%s' % (GIT_REMOTE, GIT_DEVELOP)) or cmd(['rev-parse', GIT_DEVELOP])[0].strip()
+	features = open_features()
+	changes = dict((name, 0) for name in features.values())
+	objects = {}
+	for feature, rpd, index_file in feature_patches(features, develop):
+		if index_file is None:
+			print '\n**Could not read the changes of %s in %s, leaving it out.' % (rpd, feature)
+			continue
+		for operation, object_type, name, uid in read_patch_index(index_file):
+			touched = objects.setdefault((rpd, object_type, name), set())
+			if feature not in touched:
+				touched.add(feature)
+				changes[feature] += 1
+
+	print_conflict_report(changes, objects)
+	return True
+
+
+SERVER_JOBS = []
+SERVER_LOCK = threading.Condition()
+
+
+def job_args(argv, drop=()):
+	"""
+	Arguments of a job submitted to a merge server: this run's arguments less the server and config options, and any
+	options in `drop`.
+	"""
+	args = []
+	skip = False
+	options = ('--server', '-c', '--config') + tuple(drop)
+	for arg in argv:
+		if skip:
+			skip = False
+		elif arg in options:
+			skip = True
+		elif not any(arg.startswith(option + '=') for option in options if option.startswith('--')):
+			args.append(arg)
+	return args
+
+
+def submit_job(server, args):
+	"""Submits a run to a merge server, then streams its log until it finishes. Returns the exit code of the run."""
+	server = server.rstrip('/')
+	request = urllib2.Request(server + '/jobs', json.dumps({'args': args}), {'Content-Type': 'application/json'})
+	try:
+		job = json.load(urllib2.urlopen(request))
+		print 'Submitted job %s to %s. Status: %s\n' % (job['id'], server, job['status'])
+
+		log = urllib2.urlopen('%s/jobs/%s/log' % (server, job['id']))
+		for line in iter(log.readline, ''):
+			sys.stdout.write(line)
+			sys.stdout.flush()
+
+		job = json.load(urllib2.urlopen('%s/jobs/%s' % (server, job['id'])))
+	except urllib2.HTTPError, error:
+		print '\n**Merge server refused the job: %s' % error.read()
+		return 1
+	except (urllib2.URLError, socket.error), error:
+		print '\n**Could not reach the merge server at %s: %s' % (server, error)
+		return 1
+
+	print '\nJob %s %s.' % (job['id'], job['status'])
+	if job['status'] == 'finished':
+		return 0
+	return job['returncode'] or 1
+
+
+def job_targets(job_options):
+	"""Branches a job merges into. All jobs share the one working copy of the repository, so they all run in turn."""
+	return [GIT_REPO]
+
+
+def add_job(args):
+	"""Queues a run of this script with `args`, returning the job, or None if the arguments are not a valid job."""
+	try:
+		job_options = arg_parser.parse_args(args)
+	except SystemExit:
+		return None
+	if job_options.server or job_options.action == 'serve':
+		return None
+
+	with SERVER_LOCK:
+		# The job directory is created under a new name, so the jobs of an earlier server run are never overwritten
+		server_dir = os.path.join(SCRIPT_DIR, '.merge_server')
+		if not os.path.exists(server_dir):
+			os.makedirs(server_dir)
+		job_dir = tempfile.mkdtemp(prefix=time.strftime('%Y%m%d%H%M%S-'), dir=server_dir)
+		job = {'id': os.path.basename(job_dir), 'dir': job_dir, 'log': os.path.join(job_dir, 'job.log'), 'args': args,
+			   'targets': job_targets(job_options), 'status': 'queued', 'returncode': None,
+			   'submitted': time.time(), 'started': None, 'finished': None}
+		open(job['log'], 'w').close()
+		SERVER_JOBS.append(job)
+		start_jobs()
+	return job
+
+
+def start_jobs():
+	"""
+	Starts each queued job whose targets are not being merged into by a running job, nor by a job queued ahead of it.
+	Jobs sharing a target therefore run one at a time, in the order they were submitted. Called holding `SERVER_LOCK`.
+	"""
+	busy = set()
+	for job in SERVER_JOBS:
+		if job['status'] == 'running':
+			busy.update(job['targets'])
+	for job in SERVER_JOBS:
+		if job['status'] == 'queued':
+			if not busy.intersection(job['targets']):
+				job['status'] = 'running'
+				thread = threading.Thread(target=run_job, args=(job,))
+				thread.daemon = True
+				thread.start()
+			busy.update(job['targets'])
+
+
+def run_job(job):
+	"""Runs a job as a child process of this script, in its own directory so its patches and logs are kept apart."""
+	job['started'] = time.time()
+	command = [sys.executable, '-u', os.path.join(SCRIPT_DIR, os.path.basename(sys.argv[0]))] + job['args'] + \
+			  ['-c', os.path.abspath(config_file)]
+	try:
+		with open(job['log'], 'w') as log:
+			with open(os.devnull, 'r') as devnull:  # No one is there to complete a manual merge
+				with SERVER_LOCK:
+					job['run'] = Run(command, cwd=job['dir'], stdin=devnull, stdout=log, stderr=STDOUT, group=True).start()
+				returncode = job['run'].wait()
+	except Exception, error:
+		with open(job['log'], 'a') as log:
+			log.write('\n**Failed to run job: %s\n' % error)
+		returncode = 1
+
+	with SERVER_LOCK:
+		job['returncode'] = returncode
+		job['finished'] = time.time()
+		if returncode == 0:
+			job['status'] = 'finished'
+		elif returncode is None:
+			job['status'] = 'cancelled'
+		else:
+			job['status'] = 'failed'
+		start_jobs()
+		SERVER_LOCK.notify_all()
+
+
+def job_status(job):
+	return dict((key, job[key]) for key in ['id', 'args', 'targets', 'status', 'returncode', 'submitted', 'started',
+											 'finished'])
+
+
+class MergeRequestHandler(BaseHTTPRequestHandler):
+	"""
+	HTTP API of the merge server:
+
+	DELETE /jobs/<id>		Cancel a job, stopping it if it is running.
+	POST /jobs				Queue a job, e.g. {"args": ["finishFeature", "F01", "-p"]}. Returns the job.
+	GET /jobs				List all jobs.
+	GET /jobs/<id>			Status of a job.
+	GET /jobs/<id>/log		The job's output, streamed until the job finishes.
+	"""
+
+	def send_json(self, code, data):
+		body = json.dumps(data, indent=2)
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def find_job(self, job_id):
+		for job in SERVER_JOBS:
+			if job['id'] == job_id:
+				return job
+		self.send_json(404, {'error': 'No job %s' % job_id})
+		return None
+
+	def do_GET(self):
+		path = self.path.split('?')[0].strip('/').split('/')
+		if path == ['jobs']:
+			self.send_json(200, [job_status(job) for job in SERVER_JOBS])
+		elif len(path) == 2 and path[0] == 'jobs':
+			job = self.find_job(path[1])
+			if job:
+				self.send_json(200, job_status(job))
+		elif len(path) == 3 and path[0] == 'jobs' and path[2] == 'log':
+			job = self.find_job(path[1])
+			if job:
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain')
+				self.end_headers()
+				with io.open(job['log'], 'rb') as log:  # Keeps reading as the log grows
+					while True:
+						finished = job['status'] in ('finished', 'failed', 'cancelled')
+						data = log.read()
+						if data:
+							self.wfile.write(data)
+							self.wfile.flush()
+						elif finished:
+							break
+						else:
+							time.sleep(0.5)
+		else:
+			self.send_json(404, {'error': 'Unknown path %s' % self.path})
+
+	def do_POST(self):
+		if self.path.strip('/') != 'jobs':
+			self.send_json(404, {'error': 'Unknown path %s' % self.path})
+			return
+		try:
+			args = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))['args']
+		except (ValueError, KeyError, TypeError):
+			args = None
+		if not isinstance(args, list) or not all(isinstance(arg, basestring) for arg in args):
+			self.send_json(400, {'error': 'Expected a JSON object with a list of arguments, e.g. '
+											 '{"args": ["finishFeature", "F01", "-p"]}'})
+			return
+		job = add_job([str(arg) for arg in args])
+		if job is None:
+			self.send_json(400, {'error': 'Invalid arguments for a job: %s' % ' '.join(args)})
+		else:
+			self.send_json(201, job_status(job))
+
+
+	def do_DELETE(self):
+		path = self.path.strip('/').split('/')
+		if len(path) != 2 or path[0] != 'jobs':
+			self.send_json(404, {'error': 'Unknown path %s' % self.path})
+			return
+		job = self.find_job(path[1])
+		if job:
+			run = None
+			with SERVER_LOCK:
+				if job['status'] == 'queued':
+					job['status'] = 'cancelled'
+					job['finished'] = time.time()
+					start_jobs()
+					SERVER_LOCK.notify_all()
+				elif job['status'] == 'running':
+					run = job.get('run')
+			if run:
+				run.cancel()  # run_job then marks the job cancelled
+			self.send_json(200, job_status(job))
+
+
+class MergeServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+def serve(listen):
+	"""Serves the merge HTTP API on `listen` (host:port) until interrupted."""
+	host, port = listen.rsplit(':', 1)
+	server = MergeServer((host, int(port)), MergeRequestHandler)
+	print 'Merge server listening on http://%s:%s using %s. Press Ctrl+C to stop.' % (host, port, config_file)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		print '\nStopping merge server.'
+	server.server_close()
+
+
 def main():
-	if ACTION == 'startFeature':
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))  # Runs cancel_runs when stopped
+	if ACTION in ('rpdToText', 'textToRpd'):  # Run by Git, so nothing else may be written to stdout
+		sys.exit(storage_filter(ACTION, NAME))
+
+	if SERVER:
+		# Jobs run in a directory of their own, so give the server full paths to the files named
+		args = job_args(sys.argv[1:])
+		name = NAME
+		if ACTION == 'composePatches':
+			args = job_args(sys.argv[1:], ('-o', '--output')) + ['-o', OUTPUT]
+			name = ','.join(os.path.join(CURRENT_DIR, path.strip()) for path in NAME.split(',') if path.strip())
+		elif ACTION == 'finishFeatures' and os.path.isfile(os.path.join(CURRENT_DIR, NAME)):
+			name = os.path.join(CURRENT_DIR, NAME)
+		sys.exit(submit_job(SERVER, [name if arg == NAME else arg for arg in args]))
+
+	if RPD_STORAGE == 'text':
+		configure_storage()
+
+	if ACTION != 'serve':  # Each job run by the server has a workspace of its own
+		start_workspace()
+
+	if completed_steps(JOURNAL) and cmd(['rev-parse', '-q', '--verify', 'MERGE_HEAD'])[0].strip():
+		print('Aborting the merge left unfinished by the interrupted run.')
+		cmd(['merge', '--abort'])
+
+	if ACTION == 'serve':
+		serve(LISTEN)
+	elif ACTION == 'precompute':
+		precompute(INTERVAL)
+	elif ACTION == 'analyzeConflicts':
+		analyze_conflicts()
+	elif ACTION == 'convertStorage':
+		convert_storage()
+	elif ACTION == 'forgetResolution':
+		forget_resolutions(NAME)
+	elif ACTION == 'composePatches':
+		overlaps = compose_patches([os.path.join(CURRENT_DIR, path.strip()) for path in NAME.split(',') if path.strip()],
+								   OUTPUT)
+		if overlaps != []:
+			sys.exit(1)
+	elif ACTION == 'startFeature':
 		start_feature(NAME)
 	elif ACTION == 'finishFeature':
 		finish_feature(NAME)
+	elif ACTION == 'finishFeatures':
+		finish_features(feature_list(NAME))
 	elif ACTION == 'refreshFeature':
 		refresh_feature(NAME)
 	elif ACTION == 'startRelease':
@@ -625,5 +2792,11 @@ def main():
 	elif ACTION == 'bugfix':
 		bugfix(NAME)
 
+	patch_cache_report()
+	resolution_report()
+	profile_report()
+	if WORKSPACE:
+		finish_workspace()
+
 if __name__ == "__main__":
 	main()
@@ -1,11 +1,25 @@
 import os
+import atexit
 import re
 import sys
+import signal
 import tempfile
+import io
+import json
+import socket
+import urllib2
+import time
+import hashlib
 import platform
+import threading
 from glob import glob
-from shutil import copyfile, rmtree
+from itertools import combinations
+from functools import wraps
+from shutil import copyfile, copyfileobj, rmtree
 from argparse import ArgumentParser
+from SocketServer import ThreadingMixIn
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from xml.etree import cElementTree as ElementTree
 from ConfigParser import SafeConfigParser
 from subprocess import Popen, PIPE, STDOUT, call
 
@@ -18,7 +32,9 @@ try:
 	# ArgumentParser to parse arguments and options
 	arg_parser = ArgumentParser(description="Rittman Mead RPD SVN Merge Script \n(MP/RM Sep 2015)")
 	arg_parser.add_argument('-r', '--original', help="Full path of the Original RPD.")
-	arg_parser.add_argument('-u', '--current', help="Full path of the Current RPD.")
+	arg_parser.add_argument('-u', '--current', action='append',
+						help="Full path of the Current RPD. Give it more than once to merge the changes of several "
+							 "Current RPDs made from the same Original at once.")
 	arg_parser.add_argument('-m', '--modified', help="Full path of the Modified RPD.")
 	arg_parser.add_argument('-p', '--password', help="Password of all the RPDs. Assumed to be the same for this tool.")
 	arg_parser.add_argument('-c', '--config', default='config.ini', help='Config file to be used. Default: "config.ini"')
@@ -31,18 +47,48 @@ try:
 	arg_parser.add_argument('-v', '--verbose', action='count', default=False,
 						help='Enables debug output')
 	arg_parser.add_argument('-t', '--tidyup', action="store_true", default=False,
-						help='If set then all intermediate files will be deleted. ')
+						help='If set then all intermediate files will be deleted, including those kept by earlier runs for '
+							 'inspection.')
 	arg_parser.add_argument('--reverse', action='store_true', default=False,
 						help='Reverse the current/modified merge candidates when doing a three-way merge.')
 	arg_parser.add_argument('--source_url', help='SVN URL for the branch to be merged FROM')
 	arg_parser.add_argument('--target_url', help='SVN URL for the branch to merge changes INTO.')
-	arg_parser.add_argument('--featureName', help='Feature name. Should usually be a JIRA ticket id')
+	arg_parser.add_argument('--featureName', help='Feature name. Should usually be a JIRA ticket id. For finishFeatures, '
+												 'a comma separated list of features or a file listing one per line.')
 	arg_parser.add_argument('--hotfixName', help='Hotfix name. Should usually be a JIRA ticket id')
 	arg_parser.add_argument('--releaseName', help='Release name. Usually an incrementing version number')
 	arg_parser.add_argument('--commitMessage', help='SVN Commit message')
 	arg_parser.add_argument('--action', choices=['startFeature', 'startRelease', 'startReleaseHotfix', 'startHotfix',
-											'finishFeature', 'finishRelease', 'finishReleaseHotfix', 'finishHotfix',
-											'refreshFeature', 'standaloneRPDMerge', 'reintegrate'])
+											'finishFeature', 'finishFeatures', 'finishRelease', 'finishReleaseHotfix',
+											'finishHotfix', 'refreshFeature', 'standaloneRPDMerge', 'reintegrate', 'serve',
+											'precompute', 'analyzeConflicts', 'forgetResolution'])
+	arg_parser.add_argument('--jobs', type=int, default=2,
+						help='Number of conflicted RPDs to merge at the same time. Default: 2')
+	arg_parser.add_argument('--abortOnConflict', action='store_true', default=False,
+						help='Stop patchrpd as soon as it reports a conflict and go straight to the manual merge.')
+	arg_parser.add_argument('--profile', action='store_true', default=False,
+						help='Record the time taken by each phase of the run and print a summary at the end.')
+	arg_parser.add_argument('--profileFile', default='profile.jsonl',
+						help='File to append profile records to as JSON lines. Default: "profile.jsonl"')
+	arg_parser.add_argument('--interval', type=int,
+						help='With precompute, check for new work every this many seconds rather than just once.')
+	arg_parser.add_argument('--listen', default='127.0.0.1:8765',
+						help='Address (host:port) the serve action listens on. Default: 127.0.0.1:8765')
+	arg_parser.add_argument('--server',
+						help='Run the action on a merge server started with the serve action, e.g. '
+							 'http://buildhost:8765, streaming its output.')
+	arg_parser.add_argument('--no-patch-cache', dest='no_patch_cache', action='store_true', default=False,
+						help='Always run comparerpd rather than reusing a cached patch.')
+	arg_parser.add_argument('--no-resolution-cache', dest='no_resolution_cache', action='store_true', default=False,
+						help='Neither reuse nor record resolutions of manual RPD merges.')
+	arg_parser.add_argument('--resolution',
+						help='With forgetResolution, the key of a recorded merge resolution (or its start), or "all".')
+	arg_parser.add_argument('--workspace',
+						help='Directory for intermediate files such as merge candidates, patches and logs, ideally on '
+							 'fast local storage. Overrides WORKSPACE_DIR in [Workspace].')
+	arg_parser.add_argument('--resume', action='store_true', default=False,
+						help='Continue the last interrupted run of the same action and name, skipping the steps it '
+							 'completed.')
 	args = arg_parser.parse_args()
 
 	# Parse config parameters
@@ -78,6 +124,63 @@ try:
 	SVN_RELEASE_HF_BRANCH_ROOT = conf_parser.get('SVN', 'SVN_RELEASE_HF_BRANCH_ROOT')
 	SVN_HF_BRANCH_ROOT = conf_parser.get('SVN', 'SVN_HF_BRANCH_ROOT')
 
+	# Optional working copy pool settings
+	if conf_parser.has_option('SVN', 'SVN_WC_POOL'):
+		SVN_WC_POOL = os.path.abspath(conf_parser.get('SVN', 'SVN_WC_POOL'))
+	else:
+		SVN_WC_POOL = os.path.join(SCRIPT_DIR, '.wc_pool')
+	SVN_SPARSE_PATHS = []
+	if conf_parser.has_option('SVN', 'SVN_SPARSE_PATHS'):
+		SVN_SPARSE_PATHS = [path.strip() for path in conf_parser.get('SVN', 'SVN_SPARSE_PATHS').split(',') if path.strip()]
+
+	# Optional timeouts in seconds for SVN commands and the OBIEE command line tools. Default: none
+	COMMAND_TIMEOUT = None
+	if conf_parser.has_option('Timeouts', 'COMMAND_TIMEOUT'):
+		COMMAND_TIMEOUT = conf_parser.getint('Timeouts', 'COMMAND_TIMEOUT') or None
+	TOOL_TIMEOUT = None
+	if conf_parser.has_option('Timeouts', 'TOOL_TIMEOUT'):
+		TOOL_TIMEOUT = conf_parser.getint('Timeouts', 'TOOL_TIMEOUT') or None
+
+	# Optional patch cache settings
+	if conf_parser.has_option('Cache', 'PATCH_CACHE_DIR'):
+		PATCH_CACHE_DIR = os.path.abspath(conf_parser.get('Cache', 'PATCH_CACHE_DIR'))
+	else:
+		PATCH_CACHE_DIR = os.path.join(SCRIPT_DIR, '.patch_cache')
+	if conf_parser.has_option('Cache', 'PATCH_CACHE_MAX_MB'):
+		PATCH_CACHE_MAX_MB = conf_parser.getint('Cache', 'PATCH_CACHE_MAX_MB')
+	else:
+		PATCH_CACHE_MAX_MB = 2048
+
+	# Optional store of manual merge resolutions, reused when the same merge candidates come up again
+	if conf_parser.has_option('Cache', 'RESOLUTION_CACHE_DIR'):
+		RESOLUTION_CACHE_DIR = os.path.abspath(conf_parser.get('Cache', 'RESOLUTION_CACHE_DIR'))
+	else:
+		RESOLUTION_CACHE_DIR = os.path.join(SCRIPT_DIR, '.resolution_cache')
+	if conf_parser.has_option('Cache', 'RESOLUTION_CACHE_MAX_MB'):
+		RESOLUTION_CACHE_MAX_MB = conf_parser.getint('Cache', 'RESOLUTION_CACHE_MAX_MB')
+	else:
+		RESOLUTION_CACHE_MAX_MB = 4096
+
+	# Optional files recording what refreshFeature and precompute have done so far, for each repository
+	if conf_parser.has_option('Cache', 'REFRESH_STATE_FILE'):
+		REFRESH_STATE_FILE = os.path.abspath(conf_parser.get('Cache', 'REFRESH_STATE_FILE'))
+	else:
+		REFRESH_STATE_FILE = os.path.join(SCRIPT_DIR, '.refresh_state.json')
+	if conf_parser.has_option('Cache', 'PRECOMPUTE_STATE_FILE'):
+		PRECOMPUTE_STATE_FILE = os.path.abspath(conf_parser.get('Cache', 'PRECOMPUTE_STATE_FILE'))
+	else:
+		PRECOMPUTE_STATE_FILE = os.path.join(SCRIPT_DIR, '.precompute_state.json')
+
+	# Optional scratch workspace for intermediate files, e.g. on a local NVMe disk or tmpfs
+	if args.workspace:
+		WORKSPACE_DIR = os.path.abspath(os.path.join(CURRENT_DIR, args.workspace))
+	elif conf_parser.has_option('Workspace', 'WORKSPACE_DIR'):
+		WORKSPACE_DIR = os.path.abspath(conf_parser.get('Workspace', 'WORKSPACE_DIR'))
+	else:
+		WORKSPACE_DIR = os.path.join(SCRIPT_DIR, '.workspace')
+
+	BI_ENV_CACHE_FILE = os.path.join(SCRIPT_DIR, '.bi_env_cache.json')
+
 	# Initiliases bi-init and runcat command variables
 	if platform.system() == 'Linux':
 		# This won't work for multi-instance BI Homes (instance2 etc)
@@ -93,7 +196,7 @@ try:
 		BIINIT_PATH = BIINIT_PATH.replace(' ', '^ ')
 
 	ORIG_RPD = args.original
-	CURR_RPD = args.current
+	CURR_RPDS = args.current
 	MODI_RPD = args.modified
 	OUT_RPD = args.output
 	ACTION = args.action
@@ -106,19 +209,34 @@ try:
 	AUTO_OPEN = args.autoOpen
 	DEPLOY = args.deploy
 	TIDY = args.tidyup
+	RESUME = args.resume
 	COMMIT_MESSAGE = args.commitMessage
 	SOURCE_URL = args.source_url
 	TARGET_URL = args.target_url
 	REVERSE_MERGE_CANDIDATES = args.reverse
+	PATCH_CACHE = not args.no_patch_cache
+	RESOLUTION_CACHE = not args.no_resolution_cache
+	RESOLUTION = args.resolution
+	ABORT_ON_CONFLICT = args.abortOnConflict
+	LISTEN = args.listen
+	INTERVAL = args.interval
+	SERVER = args.server
+	JOBS = max(1, args.jobs)
+	PROFILE_FILE = None
+	if args.profile:
+		PROFILE_FILE = os.path.join(CURRENT_DIR, args.profileFile)
 
 	# Arg validation
-	if ORIG_RPD is not None and CURR_RPD is not None and MODI_RPD is not None and OUT_RPD is not None:
+	if ORIG_RPD is not None and CURR_RPDS is not None and MODI_RPD is not None and OUT_RPD is not None:
 		ORIG_RPD = os.path.join(CURRENT_DIR, args.original)
-		CURR_RPD = os.path.join(CURRENT_DIR, args.current)
+		CURR_RPDS = [os.path.join(CURRENT_DIR, current) for current in args.current]
 		MODI_RPD = os.path.join(CURRENT_DIR, args.modified)
 		OUT_RPD = os.path.join(CURRENT_DIR, args.output)
 		ACTION = 'standaloneRPDMerge'
 
+	# Identifies the run for --resume
+	RUN = (ACTION, OUT_RPD if ACTION == 'standaloneRPDMerge' else FEATURE_NAME or HOTFIX_NAME or RELEASE_NAME)
+
 	if ACTION == 'reintegrate' and (SOURCE_URL is None or TARGET_URL is None or RPD_PASS is None or COMMIT_MESSAGE is None):
 		arg_parser.print_help()
 		print '\n**PROBLEM: If reintegrate is specified then the source and target SVN URLs must be given, along with ' \
@@ -132,7 +250,8 @@ try:
 			  'way merge (even if it ends up not doing). \n\n\n\nExiting.'
 		sys.exit(1)
 
-	if (ACTION == 'startFeature' or ACTION == 'finishFeature' or ACTION == 'refreshFeature') and FEATURE_NAME is None:
+	if (ACTION == 'startFeature' or ACTION == 'finishFeature' or ACTION == 'finishFeatures' or ACTION == 'refreshFeature') \
+			and FEATURE_NAME is None:
 		arg_parser.print_help()
 		print '\n**PROBLEM: FeatureName (--featureName) must be specified.\n\n\n\nExiting.'
 		sys.exit(1)
@@ -154,17 +273,107 @@ try:
 			print '\n**SVN binary not found at %s. \n\tPlease update config.ini. \n\tAborting.' % SVN_BIN
 			sys.exit(1)
 
-	# Misc vars
-	PATCH_FILE = tempfile.NamedTemporaryFile(suffix='.patch.xml', delete=False).name
-	COMPARE_LOG = os.path.join(CURRENT_DIR, 'compareRPD.log')
-	PATCH_LOG = os.path.join(CURRENT_DIR, 'patchRPD.log')
-
 except Exception, err:
 	print '\n\nException caught:\n\n%s ' % err
 	print '\n\n\tFailed to get command line arguments. Exiting.'
 	sys.exit(1)
 
 
+RUN_START = time.time()
+PROFILE_RECORDS = []
+PROFILE_LOCK = threading.Lock()
+
+
+def io_counters():
+	"""Bytes read and written so far by this process (not its children), where the platform reports them."""
+	try:
+		with open('/proc/self/io', 'r') as f:
+			counters = dict(line.split(': ') for line in f.read().splitlines())
+		return int(counters['rchar']), int(counters['wchar'])
+	except (IOError, KeyError, ValueError):
+		return None, None
+
+
+class Phase(object):
+	"""
+	Times a phase of the run when `--profile` is given. Records wall time, CPU time of finished child processes, bytes
+	read and written and the exit status, appending each record as a JSON line to `PROFILE_FILE`.
+
+	E.g.
+
+	with Phase('svn update') as phase:
+		phase.status = p.returncode
+	"""
+
+	def __init__(self, name):
+		self.name = name
+		self.status = None
+
+	def __enter__(self):
+		if PROFILE_FILE:
+			self.start = time.time()
+			self.times = os.times()
+			self.io = io_counters()
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if PROFILE_FILE:
+			times = os.times()
+			io = io_counters()
+			record = {'phase': self.name, 'start': round(self.start, 3), 'wall': round(time.time() - self.start, 3),
+					  'child_cpu': round(times[2] + times[3] - self.times[2] - self.times[3], 3),
+					  'bytes_read': None, 'bytes_written': None, 'status': self.status,
+					  'thread': threading.current_thread().name}
+			if exc_type is not None:
+				record['status'] = exc_type.__name__
+			if io[0] is not None:
+				record['bytes_read'] = io[0] - self.io[0]
+				record['bytes_written'] = io[1] - self.io[1]
+			with PROFILE_LOCK:
+				PROFILE_RECORDS.append(record)
+				with open(PROFILE_FILE, 'a') as f:
+					f.write(json.dumps(record) + '\n')
+		return False
+
+
+def profiled(name):
+	"""Decorator recording each call of a function as a `Phase`. A false return value is recorded as exit status 1."""
+	def decorate(function):
+		@wraps(function)
+		def wrapper(*args, **kwargs):
+			with Phase(name) as phase:
+				result = function(*args, **kwargs)
+				phase.status = 0 if result else 1
+			return result
+		return wrapper
+	return decorate
+
+
+def profile_report():
+	"""Prints a summary of the recorded phases, slowest first."""
+	if not PROFILE_FILE:
+		return
+	phases = {}
+	for record in PROFILE_RECORDS:
+		phase = phases.setdefault(record['phase'], {'count': 0, 'wall': 0, 'child_cpu': 0, 'read': 0, 'written': 0,
+													'failed': 0})
+		phase['count'] += 1
+		phase['wall'] += record['wall']
+		phase['child_cpu'] += record['child_cpu']
+		phase['read'] += record['bytes_read'] or 0
+		phase['written'] += record['bytes_written'] or 0
+		if record['status'] not in (0, None):
+			phase['failed'] += 1
+
+	print '\nProfile (%.1fs in total, details in %s):\n' % (time.time() - RUN_START, PROFILE_FILE)
+	print '\t%-24s %6s %10s %10s %10s %10s %7s' % ('Phase', 'Count', 'Wall (s)', 'CPU (s)', 'Read (MB)', 'Write (MB)',
+												   'Failed')
+	for name, phase in sorted(phases.items(), key=lambda item: -item[1]['wall']):
+		print '\t%-24s %6d %10.1f %10.1f %10.1f %10.1f %7d' % (name, phase['count'], phase['wall'], phase['child_cpu'],
+															   phase['read'] / 1048576.0, phase['written'] / 1048576.0,
+															   phase['failed'])
+
+
 def delete_folders(folder_array):
 	"""Delete folder tree."""
 	for folder in folder_array:
@@ -178,6 +387,142 @@ def delete_folders(folder_array):
 	return True
 
 
+RUNS = []
+RUNS_LOCK = threading.Lock()
+
+
+class Run(object):
+	"""
+	A command run in the background. Each of its stdout and stderr left as `PIPE` is read by a thread of its own and
+	handed line by line to `sinks` (callables such as `list.append` or a log file's `write`), so neither pipe can fill
+	up and stall the command. Stderr goes to `err_sinks`, or to `sinks` as well if not given. The command is stopped
+	if it runs for longer than `timeout` seconds, or when cancelled. With `group` the command is started in a process
+	group of its own, and everything it has started is stopped along with it. Other keyword arguments are passed to
+	`Popen`.
+	"""
+
+	def __init__(self, command, sinks=(), err_sinks=None, timeout=None, stdout=PIPE, stderr=PIPE, group=False,
+				 **kwargs):
+		self.command = command
+		self.timeout = timeout
+		self.group = group
+		self.timed_out = False
+		self.cancelled = False
+		self.streams = [(stdout, list(sinks)), (stderr, list(sinks if err_sinks is None else err_sinks))]
+		self.kwargs = kwargs
+		if group and platform.system() == 'Windows':
+			self.kwargs['creationflags'] = 0x200  # CREATE_NEW_PROCESS_GROUP
+		elif group:
+			self.kwargs['preexec_fn'] = os.setsid
+		self.process = None
+		self.readers = []
+		self.timer = None
+		self.lock = threading.Lock()  # Sinks are never called by both readers at once
+
+	def start(self):
+		# Other commands started at the same time must not inherit these pipes, or they won't close when this one exits
+		self.process = Popen(self.command, stdout=self.streams[0][0], stderr=self.streams[1][0],
+							 close_fds=platform.system() != 'Windows', **self.kwargs)
+		for pipe, (stream, sinks) in zip([self.process.stdout, self.process.stderr], self.streams):
+			if stream == PIPE:
+				reader = threading.Thread(target=self.read, args=(pipe, sinks))
+				reader.daemon = True
+				reader.start()
+				self.readers.append(reader)
+		if self.timeout:
+			self.timer = threading.Timer(self.timeout, self.expire)
+			self.timer.daemon = True
+			self.timer.start()
+		with RUNS_LOCK:
+			RUNS.append(self)
+		return self
+
+	def read(self, pipe, sinks):
+		for line in iter(pipe.readline, ''):
+			with self.lock:
+				for sink in sinks:
+					sink(line)
+		pipe.close()
+
+	def expire(self):
+		self.timed_out = True
+		self.cancel()
+
+	def cancel(self):
+		"""Stops the command, killing it if it hasn't exited five seconds after being asked to."""
+		self.cancelled = True
+		self.stop(False)
+		for i in range(0, 50):
+			if self.process.poll() is not None:
+				break
+			time.sleep(0.1)
+		if self.group or self.process.poll() is None:
+			self.stop(True)
+
+	def stop(self, kill):
+		try:
+			if self.group and platform.system() == 'Windows':
+				with open(os.devnull, 'w') as devnull:
+					call(['taskkill', '/T', '/F', '/PID', str(self.process.pid)], stdout=devnull, stderr=STDOUT)
+			elif self.group:
+				os.killpg(self.process.pid, signal.SIGKILL if kill else signal.SIGTERM)
+			elif kill:
+				self.process.kill()
+			else:
+				self.process.terminate()
+		except OSError:
+			pass  # Already exited
+
+	def wait(self):
+		"""Waits for the command and its output. Returns the exit code, or None if the command was stopped."""
+		returncode = self.process.wait()
+		for reader in self.readers:
+			reader.join(5 if self.cancelled else None)  # Anything the command started may still hold its pipes
+		if self.timer:
+			self.timer.cancel()
+		with RUNS_LOCK:
+			if self in RUNS:
+				RUNS.remove(self)
+		if self.cancelled:
+			return None
+		return returncode
+
+
+def run_commands(commands, timeout=None, merge_stderr=False, **kwargs):
+	"""
+	Runs independent commands side by side and waits for all of them. Returns the exit code (None if it timed out),
+	stdout and stderr of each, in order. With `merge_stderr` stderr is interleaved with stdout.
+	"""
+	outputs = [([], []) for command in commands]
+	runs = [Run(command, [out.append], None if merge_stderr else [err.append], timeout, **kwargs).start()
+			for command, (out, err) in zip(commands, outputs)]
+	results = []
+	for run, (out, err) in zip(runs, outputs):
+		returncode = run.wait()
+		if run.timed_out:
+			name = run.command if isinstance(run.command, basestring) else os.path.basename(run.command[0])
+			(out if merge_stderr else err).append('Error: %s timed out after %d seconds.\n' % (name, timeout))
+		results.append((returncode, ''.join(out), ''.join(err)))
+	return results
+
+
+def run_command(command, timeout=None, merge_stderr=False, **kwargs):
+	"""Runs a command to completion, as `Popen.communicate` would but with a timeout. See `run_commands`."""
+	return run_commands([command], timeout, merge_stderr, **kwargs)[0]
+
+
+def cancel_runs():
+	"""Stops every command still running, when this run exits early."""
+	with RUNS_LOCK:
+		runs = list(RUNS)
+	for run in runs:
+		run.cancel()
+
+
+atexit.register(cancel_runs)
+
+
+@profiled('svn checkout')
 def svn_checkout(url, wc, force=False):
 	"""Checks out SVN repository from an SVN URL to a specific director."""
 
@@ -194,9 +539,7 @@ def svn_checkout(url, wc, force=False):
 	script = [SVN_BIN, 'checkout', url, wc]
 
 	try:
-		p = Popen(script, stdout=PIPE, stderr=STDOUT)
-		p.wait()
-		data = p.communicate()
+		data = run_command(script, COMMAND_TIMEOUT, merge_stderr=True)[1:]
 		if 'Checked out revision' in data[0]:
 			return True
 		else:
@@ -206,24 +549,83 @@ def svn_checkout(url, wc, force=False):
 		return False
 
 
+SVN_INFO_CACHE = {}
+SVN_LS_CACHE = {}
+
+
+@profiled('svn info')
+def svn_info(url):
+	"""
+	Returns remote metadata for a URL from a single `svn info --xml` call: its kind, revision and last changed revision,
+	author and date. Returns None if the URL does not exist. Answers are cached until this run commits.
+	"""
+	if url not in SVN_INFO_CACHE:
+		script = [SVN_BIN, 'info', '--xml', url]
+		try:
+			returncode, stdout, stderr = run_command(script, COMMAND_TIMEOUT)
+		except Exception, error:
+			print '\n**Error during info. \n\tScript: %s\n\tError: %s ' % (script, error)
+			return None
+
+		info = None
+		if returncode == 0:
+			entry = ElementTree.fromstring(stdout).find('entry')
+			if entry is not None:
+				commit = entry.find('commit')
+				info = {'kind': entry.get('kind'), 'url': entry.findtext('url'), 'revision': int(entry.get('revision')),
+						'last_changed_revision': int(commit.get('revision')), 'last_changed_author': commit.findtext('author'),
+						'last_changed_date': commit.findtext('date')}
+		SVN_INFO_CACHE[url] = info
+	return SVN_INFO_CACHE[url]
+
+
+@profiled('svn ls')
+def svn_ls(url):
+	"""
+	Lists a remote directory with a single `svn ls --xml` call, returning the name, kind and last changed revision of
+	each entry, or None if the URL does not exist. Answers are cached until this run commits.
+	"""
+	if url not in SVN_LS_CACHE:
+		script = [SVN_BIN, 'ls', '--xml', url]
+		try:
+			returncode, stdout, stderr = run_command(script, COMMAND_TIMEOUT)
+		except Exception, error:
+			print '\n**Error during ls. \n\tScript: %s\n\tError: %s ' % (script, error)
+			return None
+
+		entries = None
+		if returncode == 0:
+			entries = []
+			for entry in ElementTree.fromstring(stdout).iter('entry'):
+				entries.append({'name': entry.findtext('name'), 'kind': entry.get('kind'),
+								'last_changed_revision': int(entry.find('commit').get('revision'))})
+		SVN_LS_CACHE[url] = entries
+	return SVN_LS_CACHE[url]
+
+
+def svn_forget():
+	"""Clears cached remote metadata after this run has changed the repository."""
+	SVN_INFO_CACHE.clear()
+	SVN_LS_CACHE.clear()
+
+
+@profiled('svn copy')
 def svn_copy(srcurl, dsturl, commit_message=None):
 	if commit_message is None:
 		commit_message = 'Branch from %s' % srcurl
 
 	script = [SVN_BIN, 'copy', srcurl, dsturl, '-m', commit_message]
 
-	tmpwc = tempfile.mkdtemp(prefix='rm_rpdco')
-	if svn_checkout(dsturl, tmpwc, True):
+	if svn_info(dsturl) is not None:
 		print '\n**Destination already exists in SVN repository!'
 		print '\n\tError encountered when trying to do svn copy %s %s' % (srcurl, dsturl)
 		return False
 
 	try:
-		p = Popen(script, stdout=PIPE, stderr=STDOUT)
-		p.wait()
-		data = p.communicate()
+		data = run_command(script, COMMAND_TIMEOUT, merge_stderr=True)[1:]
 		if 'Committed revision' in data[0]:
 			print data[0]
+			svn_forget()
 			return True
 		else:
 			print '\n** Failed to copy.\n\t%s' % data[0]
@@ -233,22 +635,21 @@ def svn_copy(srcurl, dsturl, commit_message=None):
 		return False
 
 
+@profiled('svn merge')
 def svn_merge(srcurl, target_wc, accept='postpone', re_integrate=True):
 	if not os.path.exists(target_wc):
 		print '\n**Target Working Copy (%s) does not exist. Aborting merge.' % target_wc
 		return False
 
 	if re_integrate:
-		reintegrate_arg = '--reintegrate'
+		reintegrate_arg = ['--reintegrate']
 	else:
-		reintegrate_arg = ''
+		reintegrate_arg = []
 
-	script = [SVN_BIN, 'merge', reintegrate_arg, '--accept', accept, srcurl, target_wc]
+	script = [SVN_BIN, 'merge'] + reintegrate_arg + ['--accept', accept, srcurl, target_wc]
 
 	try:
-		p = Popen(script, stdout=PIPE, stderr=STDOUT)
-		p.wait()
-		data = p.communicate()
+		data = run_command(script, COMMAND_TIMEOUT, merge_stderr=True)[1:]
 		if 'Recording mergeinfo for merge' in data[0]:
 			return data[0]
 		elif data[0] == '':
@@ -261,6 +662,7 @@ def svn_merge(srcurl, target_wc, accept='postpone', re_integrate=True):
 		return False
 
 
+@profiled('svn commit')
 def svn_commit(wc, commit_message):
 	if not os.path.exists(wc):
 		print '\n**Working Copy (%s) does not exist. Aborting commit.' % wc
@@ -269,15 +671,14 @@ def svn_commit(wc, commit_message):
 	script = [SVN_BIN, 'commit', '-m', commit_message, wc]
 
 	try:
-		p = Popen(script, stdout=PIPE, stderr=STDOUT)
-		p.wait()
-		data = p.communicate()
+		data = run_command(script, COMMAND_TIMEOUT, merge_stderr=True)[1:]
 		regex_pattern = '.*(Committed revision [0-9]*)\..*'
 		match = re.findall(regex_pattern, data[0])
 
 		if match:
 			print 'Commit successful!  -->   %s' % match[0]
-			return True
+			svn_forget()
+			return int(match[0].split()[-1])  # The revision committed
 		else:
 			print '\n** Failed to commit.\n\t%s' % data[0]
 			return False
@@ -286,6 +687,488 @@ def svn_commit(wc, commit_message):
 		return False
 
 
+@profiled('svn update')
+def svn_update(wc):
+	"""Updates a working copy to the latest revision."""
+	script = [SVN_BIN, 'update', wc]
+
+	try:
+		data = run_command(script, COMMAND_TIMEOUT, merge_stderr=True)[1:]
+		if re.search('(At|Updated to) revision', data[0]):
+			return True
+		else:
+			print '\n** Failed to update.\n\t%s' % data[0]
+			return False
+	except Exception, error:
+		print '\n**Error during update. \n\tScript: %s\n\tError: %s ' % (script, error)
+		return False
+
+
+@profiled('svn status')
+def svn_out_of_date(wc):
+	"""Lists the paths of a working copy changed in the repository since it was updated, so a commit would fail."""
+	data = run_command([SVN_BIN, 'status', '--show-updates', '--quiet', wc], COMMAND_TIMEOUT, merge_stderr=True)[1:]
+	return [line[9:].split(None, 1)[-1] for line in data[0].splitlines() if line[8:9] == '*']
+
+
+@profiled('svn undo')
+def svn_undo(url, wc, revision, commit_message):
+	"""Undoes a committed `revision` of `url` by reverse merging it into `wc`, an otherwise clean working copy of it."""
+	if not svn_update(wc):
+		return False
+	script = [SVN_BIN, 'merge', '-c', '-%d' % revision, url, wc]
+	data = run_command(script, COMMAND_TIMEOUT, merge_stderr=True)[1:]
+	if re.search('^C ', data[0], re.MULTILINE):
+		print '\n** Failed to undo r%d.\n\t%s' % (revision, data[0])
+		return False
+	return svn_commit(wc, 'Undo r%d: %s' % (revision, commit_message))
+
+
+@profiled('svn revert')
+def svn_revert(wc):
+	"""Reverts all local changes in a working copy, including unversioned leftovers of a failed merge."""
+	script = [SVN_BIN, 'revert', '--recursive', wc]
+
+	try:
+		run_command(script, COMMAND_TIMEOUT, merge_stderr=True)
+		data = run_command([SVN_BIN, 'status', wc], COMMAND_TIMEOUT, merge_stderr=True)[1:]
+		for line in data[0].splitlines():
+			if line.startswith('?'):
+				path = line[8:].strip()
+				if os.path.isdir(path):
+					delete_folders([path])
+				else:
+					delete_file(path)
+		return True
+	except Exception, error:
+		print '\n**Error during revert. \n\tScript: %s\n\tError: %s ' % (script, error)
+		return False
+
+
+POOL_LOCKS = []
+
+
+def pid_alive(pid):
+	"""Checks whether a process is still running."""
+	if platform.system() == 'Windows':
+		import ctypes
+		handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+		if not handle:
+			return False
+		exit_code = ctypes.c_ulong()
+		ctypes.windll.kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+		ctypes.windll.kernel32.CloseHandle(handle)
+		return exit_code.value == 259  # STILL_ACTIVE
+	try:
+		os.kill(pid, 0)
+		return True
+	except OSError:
+		return False
+
+
+def lock_pooled_wc(wc):
+	"""Takes the lock on a pooled working copy, clearing locks left by runs that have died."""
+	lock = wc + '.lock'
+	for attempt in range(2):
+		try:
+			fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+			os.write(fd, str(os.getpid()))
+			os.close(fd)
+			POOL_LOCKS.append(lock)
+			return True
+		except OSError:
+			try:
+				with open(lock, 'r') as f:
+					owner = int(f.read() or 0)
+			except (IOError, ValueError):
+				owner = 0
+			if owner and pid_alive(owner):
+				return False
+			delete_file(lock)
+	return False
+
+
+def release_pool_locks():
+	"""Releases the locks on all pooled working copies taken by this run."""
+	while POOL_LOCKS:
+		delete_file(POOL_LOCKS.pop())
+
+
+atexit.register(release_pool_locks)
+
+
+WORKSPACE = None  # This run's directory in WORKSPACE_DIR
+WORKSPACE_MANIFEST = {}
+WORKSPACE_LOCK = threading.Lock()
+WORKSPACE_RPD_COPIES = 6  # Merge candidates, output and the tools' working copies, per RPD
+
+
+def read_manifest(run_dir):
+	"""Returns the manifest of a run's workspace directory, or None if it has none (yet)."""
+	try:
+		with open(os.path.join(run_dir, 'manifest.json'), 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
+
+
+def write_manifest():
+	"""Saves this run's manifest, replacing the old one only once written so a crash never leaves it unreadable."""
+	manifest = os.path.join(WORKSPACE, 'manifest.json')
+	tmp = '%s.%d.tmp' % (manifest, os.getpid())
+	with open(tmp, 'w') as f:
+		json.dump(WORKSPACE_MANIFEST, f)
+	if os.path.exists(manifest):
+		os.remove(manifest)  # Windows will not rename over an existing file
+	os.rename(tmp, manifest)
+
+
+def start_workspace(tidy=True):
+	"""
+	Creates this run's directory in `WORKSPACE_DIR`, with a manifest of the intermediate files the run creates. Unless
+	`tidy` is False, files left by runs that crashed are removed first, and with `--tidyup` those kept by finished runs.
+	With `--resume`, the directory of the last interrupted run of the same action and name is taken over instead.
+	"""
+	global WORKSPACE
+	if not os.path.exists(WORKSPACE_DIR):
+		os.makedirs(WORKSPACE_DIR)
+	if RESUME:
+		resume_workspace(*RUN)
+	if tidy:
+		tidy_workspace(TIDY)
+	if WORKSPACE:
+		return
+	WORKSPACE = tempfile.mkdtemp(prefix='run-%s-%d-' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid()), dir=WORKSPACE_DIR)
+	WORKSPACE_MANIFEST.update({'pid': os.getpid(), 'action': RUN[0], 'name': RUN[1], 'started': time.time(),
+							   'finished': None, 'paths': []})
+	write_manifest()
+
+
+def track(*paths):
+	"""Records intermediate files or directories in this run's manifest, so they are removed even if the run crashes."""
+	with WORKSPACE_LOCK:
+		for path in paths:
+			path = os.path.abspath(path)
+			if path not in WORKSPACE_MANIFEST['paths']:
+				WORKSPACE_MANIFEST['paths'].append(path)
+		write_manifest()
+
+
+def workspace_dir(*names):
+	"""Returns a directory for intermediate files in this run's workspace, creating it if need be."""
+	path = os.path.join(WORKSPACE, *names)
+	if not os.path.exists(path):
+		os.makedirs(path)
+		track(path)
+	return path
+
+
+def remove_run(run_dir, manifest):
+	"""Removes exactly the files a run recorded in its manifest, then its workspace directory."""
+	for path in reversed(manifest['paths']):
+		if os.path.isdir(path):
+			rmtree(path, True)
+		elif os.path.exists(path):
+			delete_file(str(path))
+	rmtree(run_dir, True)
+
+
+def tidy_workspace(everything=False):
+	"""
+	Removes the intermediate files of runs that died without finishing, and if `everything` is set those of finished
+	runs that kept theirs for inspection. Runs still going are left alone, as are interrupted runs of other actions
+	that `--resume` could continue.
+	"""
+	for run_dir in sorted(glob(os.path.join(WORKSPACE_DIR, 'run-*'))):
+		manifest = read_manifest(run_dir)
+		if run_dir == WORKSPACE or manifest is None:
+			continue
+		if manifest['finished'] is None and pid_alive(manifest['pid']):
+			continue
+		if manifest['finished'] is None and not everything and (manifest['action'], manifest.get('name')) != RUN \
+				and completed_steps(read_journal(run_dir)):
+			print 'Kept the interrupted run of %s, which can be continued with --resume.' % run_label(manifest)
+			continue
+		if manifest['finished'] is None or everything:
+			remove_run(run_dir, manifest)
+			print 'Removed the intermediate files of %s, %s on %s.' \
+				  % (run_label(manifest), 'finished' if manifest['finished'] else 'unfinished',
+					 time.strftime('%Y-%m-%d %H:%M', time.localtime(manifest['started'])))
+
+
+def finish_workspace():
+	"""
+	Removes this run's intermediate files if none are left over, e.g. the logs of a failed merge, or `--tidyup` is set.
+	Otherwise the run is marked finished, keeping them until a run with `--tidyup`.
+	"""
+	inside = os.path.join(WORKSPACE, '')
+	journal_dir = os.path.join(WORKSPACE, 'journal')
+	kept = [path for path in WORKSPACE_MANIFEST['paths'] if not path.startswith(inside) and os.path.exists(path)]
+	kept += [name for folder, dirs, files in os.walk(WORKSPACE) if folder != journal_dir
+			 for name in files if name not in ('manifest.json', 'journal.json')]
+	if TIDY or not kept:
+		remove_run(WORKSPACE, WORKSPACE_MANIFEST)
+		return
+	WORKSPACE_MANIFEST['finished'] = time.time()
+	write_manifest()
+	print '\nIntermediate files of this run are kept in %s. Run with --tidyup to remove them.' % WORKSPACE
+	if completed_steps(JOURNAL):
+		print 'Run again with --resume to skip the %d step(s) this run completed.' % completed_steps(JOURNAL)
+
+
+JOURNAL = {}  # Steps of this run, and of the interrupted run it resumes, by name
+JOURNAL_LOCK = threading.Lock()
+
+
+def run_label(manifest):
+	"""Describes a run by its action and name, e.g. "finishRelease v1.00"."""
+	return '%s%s' % (manifest['action'], ' ' + manifest['name'] if manifest.get('name') else '')
+
+
+def read_journal(run_dir):
+	"""Returns the step journal of a run's workspace directory, or None if it has none."""
+	try:
+		with open(os.path.join(run_dir, 'journal.json'), 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return None
+
+
+def write_journal():
+	"""Saves this run's step journal, replacing the old one only once written so a crash never leaves it unreadable."""
+	journal = os.path.join(WORKSPACE, 'journal.json')
+	tmp = '%s.%d.tmp' % (journal, os.getpid())
+	with open(tmp, 'w') as f:
+		json.dump(JOURNAL, f)
+	if os.path.exists(journal):
+		os.remove(journal)  # Windows will not rename over an existing file
+	os.rename(tmp, journal)
+
+
+def completed_steps(journal):
+	"""Counts the steps a journal records as completed."""
+	return len([entry for entry in (journal or {}).values() if entry.get('done')])
+
+
+def resume_workspace(action, name):
+	"""
+	Takes over the workspace directory and step journal of the latest run of `action` and `name` that was interrupted
+	or failed, so the steps it completed are skipped. Returns False, having said so, if there is none.
+	"""
+	global WORKSPACE
+	runs = []
+	for run_dir in glob(os.path.join(WORKSPACE_DIR, 'run-*')):
+		manifest = read_manifest(run_dir)
+		journal = read_journal(run_dir)
+		if manifest is None or not completed_steps(journal) or (manifest['action'], manifest.get('name')) != (action, name):
+			continue
+		if manifest['finished'] is None and pid_alive(manifest['pid']):
+			continue  # Still going
+		runs.append((manifest['started'], run_dir, manifest, journal))
+	if not runs:
+		print 'No interrupted run of %s to resume, starting afresh.' % run_label({'action': action, 'name': name})
+		return False
+
+	started, WORKSPACE, manifest, journal = max(runs)
+	WORKSPACE_MANIFEST.update(manifest)
+	WORKSPACE_MANIFEST.update({'pid': os.getpid(), 'finished': None, 'resumed': time.time()})
+	write_manifest()
+	JOURNAL.update(journal)
+	print 'Resuming %s started %s, which completed %d step(s).' \
+		  % (run_label(manifest), time.strftime('%Y-%m-%d %H:%M', time.localtime(started)), completed_steps(journal))
+	journal_rescue()
+	return True
+
+
+def journal_rescue():
+	"""
+	Copies the files journalled by the interrupted run that are still intact but outside the workspace into it, before
+	resuming reverts the merge that left them in the repository or working copy.
+	"""
+	inside = os.path.join(WORKSPACE, '')
+	for step, entry in JOURNAL.items():
+		if not entry.get('done'):
+			continue
+		for path, digest in entry['artefacts'].items():
+			path = str(path)
+			if path.startswith(inside) or not os.path.exists(path) or file_hash(path) != digest:
+				continue
+			copy = os.path.join(workspace_dir('journal'), hashlib.sha1(step).hexdigest() + os.path.splitext(path)[1])
+			stage_file(path, copy, keep_source=True)
+			journal_record(step, artefacts={copy: digest})
+
+
+def journal_record(step, **fields):
+	"""Updates the journal entry of `step` with `fields` and saves the journal."""
+	with JOURNAL_LOCK:
+		entry = JOURNAL.setdefault(step, {'started': time.time(), 'done': None, 'result': None, 'artefacts': {}})
+		entry.update(fields)
+		write_journal()
+
+
+def step_completed(step):
+	"""
+	Returns the journal entry of `step` if the interrupted run being resumed completed it and the files it produced are
+	unchanged since, saying the step is skipped. Returns None otherwise.
+	"""
+	with JOURNAL_LOCK:
+		entry = JOURNAL.get(step)
+	if not entry or not entry.get('done'):
+		return None
+	for path, digest in entry['artefacts'].items():
+		if not os.path.exists(path) or file_hash(path) != digest:
+			print '\nRedoing %s, as %s has changed since the interrupted run.' % (step, path)
+			return None
+	print '\nSkipping %s, completed by the interrupted run.' % step
+	return entry
+
+
+def journaled(step, function, *args, **kwargs):
+	"""
+	Calls `function` as the step `step` of this run, journalling it as completed unless it returns False. When resuming,
+	a step the interrupted run completed is skipped and the result it recorded returned instead.
+	"""
+	entry = step_completed(step)
+	if entry:
+		return entry['result']
+	journal_record(step, started=time.time(), done=None)
+	result = function(*args, **kwargs)
+	if result is not False:
+		journal_record(step, done=time.time(), result=result)
+	return result
+
+
+def journal_keep(step, path):
+	"""
+	Journals `step` as completed with the path and hash of the file it produced, for `journal_restore`. The file is
+	only copied into the workspace should `--resume` need it, see `journal_rescue`.
+	"""
+	journal_record(step, done=time.time(), artefacts={os.path.abspath(path): file_hash(path)})
+
+
+def journal_moved(src, dest):
+	"""Follows a journalled file moved from `src` to `dest`."""
+	src = os.path.abspath(src)
+	with JOURNAL_LOCK:
+		steps = [step for step, entry in JOURNAL.items() if src in entry['artefacts']]
+	for step in steps:
+		journal_record(step, artefacts={os.path.abspath(dest): JOURNAL[step]['artefacts'][src]})
+
+
+def journal_restore(step, path):
+	"""Puts the file journalled for `step` at `path`, if the run being resumed completed it. Returns True if so."""
+	entry = step_completed(step)
+	if not entry:
+		return False
+	journalled = str(entry['artefacts'].keys()[0])
+	if os.path.abspath(journalled) != os.path.abspath(path):
+		stage_file(journalled, path, keep_source=True)
+	return True
+
+
+def free_space(path):
+	"""Returns the free space in bytes on the filesystem holding `path`."""
+	if platform.system() == 'Windows':
+		import ctypes
+		free = ctypes.c_ulonglong(0)
+		ctypes.windll.kernel32.GetDiskFreeSpaceExW(ctypes.c_wchar_p(unicode(path)), None, None, ctypes.byref(free))
+		return free.value
+	stat = os.statvfs(path)
+	return stat.f_bavail * stat.f_frsize
+
+
+def check_free_space(rpds):
+	"""
+	Checks up front that the workspace has room to merge `rpds`, `JOBS` at a time, each needing about
+	`WORKSPACE_RPD_COPIES` times its size. Returns False, having said so, if not.
+	"""
+	sizes = sorted([os.path.getsize(rpd) for rpd in rpds if os.path.exists(rpd)], reverse=True)
+	needed = sum(sizes[:JOBS]) * WORKSPACE_RPD_COPIES
+	free = free_space(WORKSPACE)
+	if needed > free:
+		print '\n**Not enough free space in %s: merging needs about %d MB, %d MB is free. Set WORKSPACE_DIR in ' \
+			  '[Workspace] or --workspace to somewhere with more space.' % (WORKSPACE_DIR, needed / 1048576, free / 1048576)
+		return False
+	return True
+
+
+def svn_wc_url(wc):
+	"""Returns the repository URL a working copy is checked out from, or None if it is not a working copy."""
+	data = run_command([SVN_BIN, 'info', wc], COMMAND_TIMEOUT, merge_stderr=True)[1:]
+	match = re.search('^URL: (.*)$', data[0], re.MULTILINE)
+	if match:
+		return match.group(1).strip()
+	return None
+
+
+def same_url(url, other):
+	"""Compares two repository URLs, whether percent-encoded or not and with or without a trailing slash."""
+	if url is None or other is None:
+		return False
+	return urllib2.unquote(url).rstrip('/') == urllib2.unquote(other).rstrip('/')
+
+
+def svn_sparse_checkout(url, wc):
+	"""Checks out only the `SVN_SPARSE_PATHS` of a branch, or the whole branch if none are configured."""
+	if not SVN_SPARSE_PATHS:
+		return svn_checkout(url, wc, True)
+
+	if os.path.exists(wc) and not delete_folders([wc]):
+		return False
+	data = run_command([SVN_BIN, 'checkout', '--depth', 'empty', url, wc], COMMAND_TIMEOUT, merge_stderr=True)[1:]
+	if 'Checked out revision' not in data[0]:
+		print '\n** Failed to checkout.\n\t%s' % data[0]
+		return False
+	for path in SVN_SPARSE_PATHS:
+		script = [SVN_BIN, 'update', '--parents', '--set-depth', 'infinity', os.path.join(wc, path)]
+		data = run_command(script, COMMAND_TIMEOUT, merge_stderr=True)[1:]
+		if not re.search('(At|Updated to) revision', data[0]):
+			print '\n** Failed to checkout %s.\n\t%s' % (path, data[0])
+			return False
+	return True
+
+
+@profiled('working copy')
+def svn_pooled_wc(url):
+	"""
+	Returns a clean working copy of `url` from the pool in `SVN_WC_POOL`. An existing copy is cleaned up, reverted and
+	updated (or switched, if it points elsewhere) instead of being checked out again. If the pooled copy is in use by
+	another run, a temporary working copy is checked out instead. Returns None on failure.
+	"""
+	name = '%s-%s' % (re.sub('[^A-Za-z0-9_.-]', '_', url.rstrip('/').split('/')[-1]), hashlib.sha1(url).hexdigest()[:8])
+	wc = os.path.join(SVN_WC_POOL, name)
+	if not os.path.exists(SVN_WC_POOL):
+		os.makedirs(SVN_WC_POOL)
+
+	if not lock_pooled_wc(wc):
+		print '\nPooled working copy %s is in use, checking out a temporary copy.' % wc
+		wc = tempfile.mkdtemp(prefix='wc-', dir=WORKSPACE)
+		track(wc)
+		if svn_sparse_checkout(url, wc):
+			return wc
+		return None
+
+	if os.path.exists(os.path.join(wc, '.svn')):
+		print '\nRefreshing pooled working copy %s...' % wc
+		run_command([SVN_BIN, 'cleanup', wc], COMMAND_TIMEOUT, merge_stderr=True)
+		svn_revert(wc)
+		if not same_url(svn_wc_url(wc), url):
+			run_command([SVN_BIN, 'switch', url, wc], COMMAND_TIMEOUT, merge_stderr=True)
+		if same_url(svn_wc_url(wc), url) and svn_update(wc):
+			return wc
+		print '\nCould not refresh %s, checking it out again.' % wc
+
+	if svn_sparse_checkout(url, wc):
+		return wc
+	return None
+
+
+def release_wc(wc):
+	"""Removes a working copy from `svn_pooled_wc` once done with, if it is a temporary one. Pooled copies are kept."""
+	if wc.startswith(os.path.join(WORKSPACE, '')):
+		rmtree(wc, True)
+
+
 def check_file_exists(file_path):
 	"""Check if file exists and quit on failure."""
 	if file_path is not None:
@@ -319,32 +1202,102 @@ def copy_file(orig, dest, delete=False):
 			delete_file(f)
 
 
+FICLONE = 0x40049409  # Linux ioctl sharing a file's extents with another on copy-on-write filesystems (Btrfs, XFS)
+
+
+def reflink(src, dest):
+	"""Clones `src` to `dest` without copying its data, where the platform and filesystem support it."""
+	if platform.system() != 'Linux':
+		return False
+	import fcntl
+	try:
+		with open(src, 'rb') as s:
+			with open(dest, 'wb') as d:
+				fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+		return True
+	except (IOError, OSError):
+		delete_file(dest)
+		return False
+
+
+def stage_file(src, dest, keep_source=False, link=True):
+	"""
+	Puts `src` at `dest` writing as little as possible: a rename when the source isn't kept, otherwise a hardlink
+	(unless `link` is False, for files that will be modified in place) or a reflink, and only failing those a streamed
+	copy. Returns the number of bytes written.
+	"""
+	delete_file(dest)
+	if not keep_source:
+		try:
+			os.rename(src, dest)
+			return 0
+		except OSError:
+			pass
+	elif link:
+		try:
+			os.link(src, dest)
+			return 0
+		except (OSError, AttributeError):  # No hardlinks across filesystems, or on Windows in Python 2
+			pass
+	if reflink(src, dest):
+		written = 0
+	else:
+		with open(src, 'rb') as s:
+			with open(dest, 'wb') as d:
+				copyfileobj(s, d, 1048576)
+		written = os.path.getsize(dest)
+	if not keep_source:
+		delete_file(src)
+	return written
+
+
 def read_file(filename, skip_lines=0):
 	"""Read file and return the full output. `skip_lines` will allow headers (and other content) to be ignored."""
-	output = ''
 	with open(filename, 'r') as f:
 		f.seek(0)
 		for i in range(skip_lines):
 			next(f)
 
-		for line in f:
-			output += line
-
-		f.close()
+		output = ''.join(f)
 	return output
 
 
+BI_ENV = {}
+
+
 def source(script, service=None):
 	"""
-	Update environment variables to allow execution of 11g BI commands.
+	Returns the environment variables needed to execute 11g BI commands, leaving this process's environment untouched.
 	Accepts a path to the `bi-init` shell or Windows command file.
 	Optionally accepts a `service` argument of "BI_Server" or "Presentation_Server" when an application needs to be
 	specified.
+	The environment is sourced once and persisted in `BI_ENV_CACHE_FILE`, keyed by the script path, its modification
+	time and `service`, so it is only sourced again when bi-init changes. Returns None on failure.
 	"""
 	try:
+		script_path = script.replace('^ ', ' ')
+		if os.path.exists(script_path):
+			mtime = os.path.getmtime(script_path)
+		else:
+			mtime = 0
+		cache_key = '%s|%s|%s' % (script, mtime, service)
+		if cache_key in BI_ENV:
+			return BI_ENV[cache_key]
+
+		cached = {}
+		if os.path.exists(BI_ENV_CACHE_FILE):
+			try:
+				with open(BI_ENV_CACHE_FILE, 'r') as f:
+					cached = json.load(f)
+			except ValueError:
+				cached = {}  # Corrupt cache, source again
+		if cache_key in cached:
+			BI_ENV[cache_key] = dict((k.encode('latin-1'), v.encode('latin-1')) for k, v in cached[cache_key].items())
+			return BI_ENV[cache_key]
+
 		# Based on http://pythonwise.blogspot.fr/2010/04/sourcing-shell-script.html
 		if platform.system() == 'Linux':
-			pipe = Popen(". %s; env" % script, stdout=PIPE, shell=True)
+			command = ". %s; env" % script
 		else:
 			# On a OBIEE-server install, bi-init.cmd will open a command window unless we pass in a dummy command for it.
 			# bi-init.cmd (as installed with OBIEE server) != bi_init.bat (as installed with OBIEE admin tools).
@@ -360,15 +1313,49 @@ def source(script, service=None):
 
 			command = '%s %s rem & set' % (script, application)
 
-			pipe = Popen(command, stdout=PIPE, shell=True)
-		data = pipe.communicate()[0]
-		env = dict(line.split("=", 1) for line in data.splitlines())
-		os.environ.update(env)
-		return True
+		data = run_command(command, COMMAND_TIMEOUT, shell=True)[1]
+		env = dict(line.split("=", 1) for line in data.splitlines() if '=' in line)
+		BI_ENV[cache_key] = env
+
+		# Drop snapshots of older versions of the same script and service
+		for key in cached.keys():
+			if key.rsplit('|', 2)[0] == script and key.rsplit('|', 1)[1] == str(service):
+				del cached[key]
+		cached[cache_key] = env
+		tmp = '%s.%d.tmp' % (BI_ENV_CACHE_FILE, os.getpid())
+		try:
+			with open(tmp, 'w') as f:
+				json.dump(cached, f, encoding='latin-1')  # Round-trips any console code page
+			delete_file(BI_ENV_CACHE_FILE)
+			os.rename(tmp, BI_ENV_CACHE_FILE)
+		except (IOError, OSError), error:
+			print '\tCould not save BI environment cache %s: %s' % (BI_ENV_CACHE_FILE, error)
+		return env
 	except Exception, error:
 		print '\n\nError in source() routine\nException caught: %s ' % error
 		print '\nExiting.'
-		return False
+		return None
+
+
+def bi_env():
+	"""Environment for OBIEE tool processes: the sourced bi-init environment on 11g, otherwise None (inherited)."""
+	if OBIEE_VERSION == '12':
+		return None
+	return source(BIINIT_PATH, 'BI_Server')
+
+
+def find_executable(command, env):
+	"""Resolves a command against the PATH in `env`, as Windows would otherwise search this process's own PATH."""
+	variables = dict((key.upper(), value) for key, value in env.items())
+	extensions = ['']
+	if platform.system() != 'Linux':
+		extensions += variables.get('PATHEXT', '.EXE;.CMD;.BAT').lower().split(';')
+	for folder in variables.get('PATH', '').split(os.pathsep):
+		for extension in extensions:
+			executable = os.path.join(folder.strip('"'), command + extension)
+			if os.path.isfile(executable):
+				return executable
+	return command
 
 
 def bi_command(command, server=False):
@@ -388,31 +1375,516 @@ def bi_command(command, server=False):
 		else:
 			executable += '.cmd'
 	else:
-		if not source(BIINIT_PATH, 'BI_Server'):
+		env = bi_env()
+		if env is None:
 			print '\n**Failed to set BI Environment (bi-init). Aborting.'
 			return False
-		executable = command
+		executable = find_executable(command, env)
 	return executable
 
 
-def create_patch(orig_rpd, orig_pass, curr_rpd, curr_pass, patch_file):
-	"""Create XML patch from RPD comparison using OBIEE's `compareRPD` method."""
+PATCH_CACHE_STATS = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+RESOLUTION_STATS = {'reused': 0, 'recorded': 0, 'evicted': 0}
+FILE_HASHES = {}
 
-	print '\nCreating patch...\n'
-	compare_log = os.path.join(CURRENT_DIR, 'compareRPD.log')
-	log = open(compare_log, 'w')
-	script = [bi_command('comparerpd'), '-C', curr_rpd, '-p', curr_pass, '-G', orig_rpd, '-W', orig_pass, '-D', patch_file]
-	p = Popen(script, stdout=log, stderr=STDOUT)
-	p.wait()
-
-	if os.path.exists(patch_file):
-		print '\tPatch created successfully.'
-		delete_file(log)
+
+def file_hash(filename):
+	"""Returns the SHA-1 of a file's contents, read in chunks. Memoised by path, size and modification time."""
+	stat = os.stat(filename)
+	memo_key = (os.path.abspath(filename), stat.st_size, stat.st_mtime)
+	if memo_key not in FILE_HASHES:
+		sha = hashlib.sha1()
+		with open(filename, 'rb') as f:
+			for chunk in iter(lambda: f.read(1024 * 1024), ''):
+				sha.update(chunk)
+		FILE_HASHES[memo_key] = sha.hexdigest()
+	return FILE_HASHES[memo_key]
+
+
+def patch_cache_key(orig_rpd, orig_pass, curr_rpd, curr_pass):
+	"""Key for a `comparerpd` patch: content hashes of both RPDs plus a hash (never the value) of the passwords."""
+	key = hashlib.sha1()
+	key.update(file_hash(orig_rpd))
+	key.update(file_hash(curr_rpd))
+	key.update(hashlib.sha1('%s\0%s' % (orig_pass, curr_pass)).hexdigest())
+	return key.hexdigest()
+
+
+def patch_cache_path(key):
+	"""Path of the cached patch XML for `key`. Sidecar files for the same entry share the `key.` prefix."""
+	return os.path.join(PATCH_CACHE_DIR, '%s.xml' % key)
+
+
+def patch_cache_get(key, patch_file):
+	"""Copies a cached patch to `patch_file`. Returns True on a cache hit."""
+	cached = patch_cache_path(key)
+	try:
+		copyfile(cached, patch_file)
+		os.utime(cached, None)  # Mark as recently used for LRU eviction
+	except (IOError, OSError):
+		PATCH_CACHE_STATS['misses'] += 1
+		return False
+	PATCH_CACHE_STATS['hits'] += 1
+	return True
+
+
+def patch_cache_put(key, patch_file):
+	"""Stores a patch in the cache, then evicts the least recently used entries over `PATCH_CACHE_MAX_MB`."""
+	cached = patch_cache_path(key)
+	tmp = '%s.%d.tmp' % (cached, os.getpid())
+	try:
+		if not os.path.exists(PATCH_CACHE_DIR):
+			os.makedirs(PATCH_CACHE_DIR)
+		copyfile(patch_file, tmp)
+		if os.path.exists(cached):
+			os.remove(cached)  # Windows will not rename over an existing file
+		os.rename(tmp, cached)
+	except (IOError, OSError), error:
+		print '\tCould not store patch in cache %s: %s' % (PATCH_CACHE_DIR, error)
+		delete_file(tmp)
+		return False
+	PATCH_CACHE_STATS['stored'] += 1
+	PATCH_CACHE_STATS['evicted'] += cache_evict(PATCH_CACHE_DIR, patch_cache_path, PATCH_CACHE_MAX_MB)
+	return True
+
+
+def cache_entries(cache_dir):
+	"""Groups the files of an on-disk cache by entry key, the part of each name before the first dot."""
+	entries = {}
+	for f in glob(os.path.join(cache_dir, '*')):
+		if not f.endswith('.tmp'):
+			entries.setdefault(os.path.basename(f).split('.')[0], []).append(f)
+	return entries
+
+
+def cache_evict(cache_dir, entry_path, max_mb):
+	"""
+	Removes least recently used entries of an on-disk cache, including their sidecar files, until under `max_mb`. An
+	entry's last use is the modification time of its `entry_path(key)`. Returns the number of entries removed.
+	"""
+	entries = {}
+	for key, files in cache_entries(cache_dir).items():
+		entry = entries.setdefault(key, {'files': [], 'size': 0, 'used': 0})
+		for f in files:
+			try:
+				entry['size'] += os.path.getsize(f)
+				if f == entry_path(key):
+					entry['used'] = os.path.getmtime(f)
+			except OSError:
+				continue  # Removed by a concurrent run
+			entry['files'].append(f)
+
+	evicted = 0
+	total = sum(entry['size'] for entry in entries.values())
+	for key, entry in sorted(entries.items(), key=lambda item: item[1]['used']):
+		if total <= max_mb * 1024 * 1024:
+			break
+		for f in entry['files']:
+			delete_file(f)
+		total -= entry['size']
+		evicted += 1
+	return evicted
+
+
+def patch_cache_report():
+	"""Prints patch cache usage for this run, if the cache was consulted."""
+	if PATCH_CACHE_STATS['hits'] or PATCH_CACHE_STATS['misses']:
+		print '\nPatch cache: %(hits)d hit(s), %(misses)d miss(es), %(stored)d stored, %(evicted)d evicted.' \
+			  % PATCH_CACHE_STATS
+
+
+def merge_key(orig_rpd, curr_rpd, mod_rpd, rpd_pass):
+	"""
+	Identifies a three way merge: content hashes of the original, current and modified RPDs, in those roles, plus a hash
+	(never the value) of the password.
+	"""
+	key = hashlib.sha1()
+	for rpd in (orig_rpd, curr_rpd, mod_rpd):
+		key.update(file_hash(rpd))
+	key.update(hashlib.sha1(rpd_pass or '').hexdigest())
+	return key.hexdigest()
+
+
+def resolution_key(orig_rpd, curr_rpd, mod_rpd, rpd_pass):
+	"""Key for a merge resolution, see `merge_key`. None when the resolution cache is turned off."""
+	if not RESOLUTION_CACHE:
+		return None
+	return merge_key(orig_rpd, curr_rpd, mod_rpd, rpd_pass)
+
+
+def resolution_path(key):
+	"""Path of the resolved RPD recorded for `key`. Its details are kept beside it in `key.json`."""
+	return os.path.join(RESOLUTION_CACHE_DIR, '%s.rpd' % key)
+
+
+def resolution_details(key):
+	"""Reads the details recorded with a resolution, or an empty dict if they are missing."""
+	try:
+		with open(os.path.join(RESOLUTION_CACHE_DIR, '%s.json' % key), 'r') as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return {}
+
+
+def resolution_get(key, out_rpd):
+	"""Copies the resolution recorded for `key` to `out_rpd`. Returns True if there was one."""
+	recorded = resolution_path(key) if key else None
+	if not recorded or not os.path.exists(recorded):
+		return False
+	try:
+		copyfile(recorded, out_rpd)
+		os.utime(recorded, None)  # Mark as recently used for LRU eviction
+	except (IOError, OSError), error:
+		print '\tCould not reuse recorded resolution %s: %s' % (recorded, error)
+		delete_file(out_rpd)
+		return False
+	RESOLUTION_STATS['reused'] += 1
+	print '\n\tReused the merge resolution recorded %s for the same merge candidates (%s).' \
+		  % (resolution_details(key).get('recorded', 'earlier'), key[:12])
+	print '\tIf it is no longer wanted, run --action forgetResolution --resolution %s and merge again.' % key[:12]
+	return True
+
+
+def resolution_put(key, out_rpd, candidates):
+	"""
+	Records `out_rpd` as the resolution of the merge of `candidates` (original, current and modified RPDs), then evicts
+	the least recently used resolutions over `RESOLUTION_CACHE_MAX_MB`.
+	"""
+	if not key:
+		return False
+	recorded = resolution_path(key)
+	tmp = '%s.%d.tmp' % (recorded, os.getpid())
+	try:
+		if not os.path.exists(RESOLUTION_CACHE_DIR):
+			os.makedirs(RESOLUTION_CACHE_DIR)
+		copyfile(out_rpd, tmp)
+		if os.path.exists(recorded):
+			os.remove(recorded)  # Windows will not rename over an existing file
+		os.rename(tmp, recorded)
+		with open(os.path.join(RESOLUTION_CACHE_DIR, '%s.json' % key), 'w') as f:
+			run = ' '.join(filter(None, [ACTION, FEATURE_NAME, RELEASE_NAME, HOTFIX_NAME]))
+			json.dump({'recorded': time.strftime('%Y-%m-%d %H:%M:%S'), 'action': run,
+					   'candidates': dict(zip(('original', 'current', 'modified'), candidates))}, f, indent=1)
+	except (IOError, OSError), error:
+		print '\tCould not record merge resolution in %s: %s' % (RESOLUTION_CACHE_DIR, error)
+		delete_file(tmp)
+		return False
+	RESOLUTION_STATS['recorded'] += 1
+	print '\tRecorded the merge resolution (%s) for reuse.' % key[:12]
+	RESOLUTION_STATS['evicted'] += cache_evict(RESOLUTION_CACHE_DIR, resolution_path, RESOLUTION_CACHE_MAX_MB)
+	return True
+
+
+def forget_resolutions(name):
+	"""
+	Lists the recorded merge resolutions if `name` is not given. Otherwise forgets those whose key starts with `name`,
+	or all of them if it is "all", so the next merge of their candidates is done afresh.
+	"""
+	entries = cache_entries(RESOLUTION_CACHE_DIR)
+	if not name:
+		if not entries:
+			print 'No merge resolutions recorded in %s.' % RESOLUTION_CACHE_DIR
+		for key in sorted(entries, key=lambda key: resolution_details(key).get('recorded')):
+			details = resolution_details(key)
+			candidates = details.get('candidates', {})
+			print '%s  %s  %s' % (key[:12], details.get('recorded', '?'), details.get('action', '?'))
+			for role in ('original', 'current', 'modified'):
+				print '\t%s:\t%s' % (role.capitalize(), candidates.get(role, '?'))
 		return True
-	else:
-		print '\n\tFailed to create patch. See %s for details.\n'\
-			  % os.path.abspath(compare_log)
+
+	keys = [key for key in entries if name == 'all' or key.startswith(name)]
+	if not keys:
+		print '\n**No recorded merge resolution matches %s.' % name
 		return False
+	for key in keys:
+		for f in entries[key]:
+			delete_file(f)
+	print 'Forgot %d recorded merge resolution(s).' % len(keys)
+	return True
+
+
+def resolution_report():
+	"""Prints merge resolution cache usage for this run, if any resolution was reused or recorded."""
+	if RESOLUTION_STATS['reused'] or RESOLUTION_STATS['recorded']:
+		print '\nMerge resolutions: %(reused)d reused, %(recorded)d recorded, %(evicted)d evicted.' % RESOLUTION_STATS
+
+
+TOOL_MATCHERS = [
+	('conflict', re.compile('Conflicts are found')),
+	('error', re.compile('\\[nQSError|^\\s*Error|Exception', re.IGNORECASE)),
+	('progress', re.compile('^\\s*(Loading|Reading|Comparing|Equalizing|Applying|Patching|Writing|Saving)',
+							re.IGNORECASE)),
+]
+
+
+PATCH_OPERATIONS = {'DECLARE': 'declare', 'DELETE': 'delete'}
+XSI_NAMESPACE = 'http://www.w3.org/2001/XMLSchema-instance'
+ElementTree.register_namespace('xsi', XSI_NAMESPACE)  # Keeps the usual prefix when patches are rewritten
+
+
+def index_patch(patch_file, index_file):
+	"""
+	Writes an index of the repository objects a patch touches to `index_file`, one object per line with its operation,
+	type, qualified name and UID, tab separated. The patch is parsed as a stream and each object is dropped once read,
+	so memory use stays flat however big the patch. Returns the number of objects indexed per operation, or None if the
+	patch could not be parsed.
+	"""
+	counts = {}
+	elements = []
+	names = []
+	operation = None
+	tmp = '%s.%d.tmp' % (index_file, os.getpid())
+	try:
+		with open(tmp, 'w') as index:
+			for event, element in ElementTree.iterparse(patch_file, events=('start', 'end')):
+				tag = element.tag.split('}')[-1]
+				if event == 'start':
+					elements.append(element)
+					if len(elements) == 2:  # DECLARE or DELETE section
+						operation = PATCH_OPERATIONS.get(tag.upper(), tag.lower())
+					elif len(elements) > 2:  # An object, or a property of the object it is nested in
+						name = element.get('name')
+						parent = element.get('parentName') or (names[-1] if names else None)
+						if name is None:
+							names.append(parent)
+						elif parent:
+							names.append('%s."%s"' % (parent, name))
+						else:
+							names.append('"%s"' % name)
+					continue
+
+				elements.pop()
+				if len(elements) >= 2:
+					name = names.pop()
+					if element.get('name') is not None:
+						uid = element.get('uid') or element.get('id') or ''
+						line = '\t'.join([operation, tag, name, uid]).replace('\n', ' ')
+						index.write(line.encode('utf-8') + '\n')
+						counts[operation] = counts.get(operation, 0) + 1
+				if elements:
+					elements[-1].remove(element)  # Always its only child by now, as earlier ones were removed too
+		if os.path.exists(index_file):
+			os.remove(index_file)  # Windows will not rename over an existing file
+		os.rename(tmp, index_file)
+	except (SyntaxError, IOError, OSError), error:  # ElementTree.ParseError is a SyntaxError
+		print '\tCould not index patch %s: %s' % (patch_file, error)
+		delete_file(tmp)
+		return None
+	return counts
+
+
+def read_patch_index(index_file):
+	"""Yields (operation, type, qualified name, UID) for each object in a patch index, reading it as a stream."""
+	with open(index_file, 'r') as index:
+		for line in index:
+			yield tuple(line.decode('utf-8').rstrip('\n').split('\t'))
+
+
+def patch_index(key, patch_file, summary=True):
+	"""
+	Returns the path of the index stored beside a cached patch, indexing `patch_file` first if it hasn't been.
+	Optionally prints a summary of what the patch changes.
+	"""
+	index_file = '%s.idx' % os.path.splitext(patch_cache_path(key))[0]
+	if os.path.exists(index_file):
+		if not summary:
+			return index_file
+		counts = {}
+		for entry in read_patch_index(index_file):
+			counts[entry[0]] = counts.get(entry[0], 0) + 1
+	else:
+		counts = index_patch(patch_file, index_file)
+		if counts is None:
+			return None
+	if summary:
+		print '\tPatch touches %d object(s): %s.' % (sum(counts.values()), ', '.join(
+			'%d %s' % (count, operation) for operation, count in sorted(counts.items())) or 'none')
+	return index_file
+
+
+def print_conflict_report(changes, objects):
+	"""
+	Prints the pairs of features changing the same objects, most shared objects first, and a suggested merge order.
+	`changes` is the number of objects changed by each feature, and `objects` the features changing each object.
+	"""
+	pairs = {}
+	shared = dict((feature, 0) for feature in changes)
+	for key, features in objects.items():
+		if len(features) > 1:
+			for feature in features:
+				shared[feature] += 1
+			for pair in combinations(sorted(features), 2):
+				pairs.setdefault(pair, []).append(key)
+
+	print '\nConflict report for %d open feature(s)\n' % len(changes)
+	if pairs:
+		print 'Features changing the same objects, most first:\n'
+		for pair, keys in sorted(pairs.items(), key=lambda item: (-len(item[1]), item[0])):
+			examples = ', '.join('%s %s' % (object_type, name) for rpd, object_type, name in sorted(keys)[:3])
+			print '\t%4d\t%s and %s\t(%s%s)' % (len(keys), pair[0], pair[1], examples, ', ...' if len(keys) > 3 else '')
+	else:
+		print 'No two features change the same objects.'
+
+	print '\nSuggested merge order, fewest objects shared with other features first:\n'
+	order = sorted(changes, key=lambda feature: (shared[feature], changes[feature], feature))
+	for i, feature in enumerate(order):
+		print '\t%2d. %s\t(%d of %d changed objects shared)' % (i + 1, feature, shared[feature], changes[feature])
+
+
+def patch_objects(patch_file):
+	"""
+	Yields (section, object) for each top level object of a patch, with `section` the tag of the DECLARE or DELETE
+	section it is in. The patch is parsed as a stream and each object is dropped once yielded.
+	"""
+	elements = []
+	for event, element in ElementTree.iterparse(patch_file, events=('start', 'end')):
+		if event == 'start':
+			elements.append(element)
+			continue
+		elements.pop()
+		if len(elements) == 2:
+			yield elements[1].tag, element
+			elements[1].remove(element)
+
+
+def patch_object_key(element):
+	"""Returns the type of a patch object, its UID (or qualified name if it has no UID) and its qualified name."""
+	name = element.get('name') or ''
+	if element.get('parentName'):
+		name = '%s."%s"' % (element.get('parentName'), name)
+	return element.tag.split('}')[-1], element.get('uid') or element.get('id') or name, name
+
+
+def compose_patches(patch_files, output):
+	"""
+	Folds patches into one with the effect of applying them in order, for patches made against the same original (or
+	each against the result of the one before). Objects touched by several patches are reported as overlaps, as applying
+	the patches one at a time would have merged or conflicted on them, and as keeping any one patch's version would
+	drop the others' changes, nothing is written then. Patches are read as streams, first to find the patches touching
+	each object, then once per section to write the objects, so only object keys are held in memory. Returns the
+	overlaps as a list of (type, name, patch numbers), or None if a patch could not be read.
+	"""
+	touched = {}
+	names = {}
+	sections = []
+	tmp = '%s.%d.tmp' % (output, os.getpid())
+	try:
+		for number, patch_file in enumerate(patch_files, 1):
+			for section, element in patch_objects(patch_file):
+				object_type, uid, name = patch_object_key(element)
+				names[object_type, uid] = name
+				if number not in touched.setdefault((object_type, uid), []):
+					touched[object_type, uid].append(number)
+				if section not in sections:
+					sections.append(section)
+
+		overlaps = sorted((key[0], names[key], numbers) for key, numbers in touched.items() if len(numbers) > 1)
+		if overlaps:
+			print '\tCould not compose %d patch(es): %d object(s) are touched by more than one patch.' \
+				  % (len(patch_files), len(overlaps))
+			for object_type, name, numbers in overlaps[:10]:
+				print '\t\t%s %s: patches %s' % (object_type, name, ', '.join(str(number) for number in numbers))
+			if len(overlaps) > 10:
+				print '\t\t... and %d more' % (len(overlaps) - 10)
+			return overlaps
+
+		with open(tmp, 'w') as f:
+			f.write('<?xml version="1.0" encoding="UTF-8" ?>\n<Repository xmlns:xsi="%s">\n' % XSI_NAMESPACE)
+			for section in sections:
+				f.write('<%s>\n' % section.split('}')[-1])
+				for number, patch_file in enumerate(patch_files, 1):
+					for object_section, element in patch_objects(patch_file):
+						if object_section == section and touched[patch_object_key(element)[:2]][-1] == number:
+							element.tail = '\n'
+							f.write(ElementTree.tostring(element))
+				f.write('</%s>\n' % section.split('}')[-1])
+			f.write('</Repository>\n')
+		if os.path.exists(output):
+			os.remove(output)  # Windows will not rename over an existing file
+		os.rename(tmp, output)
+	except (SyntaxError, IOError, OSError), error:  # ElementTree.ParseError is a SyntaxError
+		print '\tCould not compose patches: %s' % error
+		delete_file(tmp)
+		return None
+
+	print '\tComposed %d patch(es) into %s: %d object(s).' % (len(patch_files), output, len(touched))
+	return overlaps
+
+
+def run_tool(script, log_file, abort_on_conflict=False):
+	"""
+	Runs an OBIEE command line tool, streaming its output line by line into `log_file` so memory use stays flat.
+	Progress lines are echoed as they arrive and conflicts are reported the moment they appear. With
+	`abort_on_conflict` the tool is stopped at the first conflict, as the merge will have to be finished manually.
+	The tool is also stopped if it runs for longer than `TOOL_TIMEOUT`.
+	Returns the exit code (None if stopped) and a count of the lines matching each of `TOOL_MATCHERS`.
+	"""
+	found = dict((marker, 0) for marker, pattern in TOOL_MATCHERS)
+	log = open(log_file, 'w')
+
+	def scan(line):
+		log.write(line)
+		for marker, pattern in TOOL_MATCHERS:
+			if pattern.search(line):
+				found[marker] += 1
+				if marker == 'progress':
+					print '\t%s' % line.strip()
+				elif marker == 'conflict' and found[marker] == 1:
+					print '\n\tConflicts detected. Can resolve manually using the Admin Tool.'
+					if abort_on_conflict:
+						print '\tStopping %s early.' % os.path.basename(script[0])
+						run.cancel()
+				break
+
+	run = Run(script, [scan], timeout=TOOL_TIMEOUT, env=bi_env())
+	returncode = run.start().wait()
+	log.close()
+	if run.timed_out:
+		print '\n\t%s timed out after %d seconds.' % (os.path.basename(script[0]), TOOL_TIMEOUT)
+	return returncode, found
+
+
+PATCHES_IN_FLIGHT = {}
+PATCHES_IN_FLIGHT_LOCK = threading.Lock()
+
+
+@profiled('comparerpd')
+def create_patch(orig_rpd, orig_pass, curr_rpd, curr_pass, patch_file, log_dir=None):
+	"""
+	Create XML patch from RPD comparison using OBIEE's `compareRPD` method. A merge needing a patch that a concurrent
+	merge is already creating waits for it and then takes it from the cache, rather than comparing the RPDs again.
+	"""
+
+	print '\nCreating patch...\n'
+	cache_key = None
+	in_flight = threading.Lock()
+	if PATCH_CACHE:
+		cache_key = patch_cache_key(orig_rpd, orig_pass, curr_rpd, curr_pass)
+		with PATCHES_IN_FLIGHT_LOCK:
+			in_flight = PATCHES_IN_FLIGHT.setdefault(cache_key, in_flight)
+
+	with in_flight:
+		if cache_key and patch_cache_get(cache_key, patch_file):
+			print '\tPatch found in cache (%s).' % cache_key
+			patch_index(cache_key, patch_file)
+			return True
+
+		delete_file(patch_file)  # A stale or placeholder file must not be mistaken for comparerpd output
+		compare_log = os.path.join(log_dir or WORKSPACE, 'compareRPD.log')
+		script = [bi_command('comparerpd'), '-C', curr_rpd, '-p', curr_pass, '-G', orig_rpd, '-W', orig_pass, '-D',
+				  patch_file]
+		run_tool(script, compare_log)
+
+		if os.path.exists(patch_file):
+			print '\tPatch created successfully.'
+			delete_file(compare_log)
+			if cache_key and patch_cache_put(cache_key, patch_file):
+				patch_index(cache_key, patch_file)
+			return True
+		else:
+			print '\n\tFailed to create patch. See %s for details.\n'\
+				  % os.path.abspath(compare_log)
+			return False
 
 
 def admin_tool():
@@ -424,48 +1896,62 @@ def admin_tool():
 		else:
 			executable = os.path.join(OBIEE_CLIENT, 'bi', 'bitools', 'bin', 'admintool.cmd')
 	else:
-		if not source(BIINIT_PATH, 'BI_Server'):
+		env = bi_env()
+		if env is None:
 			print '\n**Failed to set BI Environment (bi-init). Aborting.'
 			return False
-		executable = 'admintool.exe'
+		executable = find_executable('admintool.exe', env)
 	return executable
 
 
+ADMIN_TOOL_LOCK = threading.Lock()
+
+
 def open_rpd(rpd, password, prompt=True):
-	"""Programatically pens an RPD using the Admin Tool."""
+	"""Programatically pens an RPD using the Admin Tool. Concurrent merges take turns using the Admin Tool."""
 
-	with open('openRPD.txt', 'w') as f:
-		f.write('OpenOffline %s %s' % (rpd, password))
-		f.close()
+	with ADMIN_TOOL_LOCK:
+		command_file = os.path.join(WORKSPACE, 'openRPD.txt')
+		with open(command_file, 'w') as f:
+			f.write('OpenOffline %s %s' % (rpd, password))
+			f.close()
 
-	if prompt:
-		raw_input('\nWill open RPD using the Admin Tool. \n\nPress Enter key to continue.'
-				  '\n\nYou must close the AdminTool after completing the merge manually in order for this'
-				  ' script to continue.\n\n')
+		if prompt:
+			try:
+				raw_input('\nWill open RPD using the Admin Tool. \n\nPress Enter key to continue.'
+						  '\n\nYou must close the AdminTool after completing the merge manually in order for this'
+						  ' script to continue.\n\n')
+			except EOFError:  # E.g. run by the merge server
+				print '\n**No one is available to complete the merge in the Admin Tool.'
+				return False
 
-	call([admin_tool(), '/Command', 'openRPD.txt'])
-	delete_file('openRPD.txt')
+		call([admin_tool(), '/Command', command_file], env=bi_env())
+		delete_file(command_file)
 	return True
 
 
+@profiled('patchrpd')
 def patch_rpd(mod_rpd, mod_pass, orig_rpd, orig_pass, patch_file, out_rpd, out_pass, patch_pass, curr_rpd=False,
-			  curr_pass=False, auto_open=False, delete_patch=False):
+			  curr_pass=False, auto_open=False, delete_patch=False, log_dir=None):
 	"""
 	Patches RPD with an XML patch. If conflicts arise, the RPD is opened in the Admin Tool, prompting the user to complete
 	the merge manually.
 	Current RPD and Password are not mandatory. If not specified, there must NOT be conflicts.
 	"""
 	print '\nPatching RPD...\n'
-	patch_log = os.path.join(CURRENT_DIR, 'patch_rpd.log')
-	log = open(patch_log, 'w')
+	patch_log = os.path.join(log_dir or WORKSPACE, 'patch_rpd.log')
 
 	# Ref: OBIEE 11g Administration Tool: Patch Repository Merge Not Working (Doc ID 1999105.1)
 	# -A flag tells patchrpd to skip subset patching and apply patch using input rpds
 	script = [bi_command('patchrpd'), '-A', '-C', mod_rpd, '-p', mod_pass, '-G', orig_rpd, '-Q', orig_pass, '-I',
 			  patch_file, '-S', patch_pass, '-O', out_rpd]
 
-	p = Popen(script, stdout=log, stderr=STDOUT)
-	p.wait()
+	side_dirs = set(os.path.dirname(os.path.abspath(rpd)) for rpd in (mod_rpd, orig_rpd, out_rpd))
+	existing = set(f for directory in side_dirs for f in rpd_side_files(directory))
+	returncode, found = run_tool(script, patch_log, ABORT_ON_CONFLICT)
+	track(*[f for directory in side_dirs for f in rpd_side_files(directory) if f not in existing])
+	if returncode is None:
+		delete_file(out_rpd)  # Partially written before patchrpd was stopped
 
 	if delete_patch:
 		delete_file(patch_file)
@@ -477,9 +1963,7 @@ def patch_rpd(mod_rpd, mod_pass, orig_rpd, orig_pass, patch_file, out_rpd, out_p
 		return True
 	else:
 		print '\tFailed to patch RPD. See %s for details.' % patch_log
-		log_contents = read_file(patch_log)
-		if re.search('Conflicts are found.', log_contents):
-			print '\n\tConflicts detected. Can resolve manually using the Admin Tool.'
+		if found['conflict'] and curr_rpd:
 			if manual_merge(orig_rpd, mod_rpd, curr_rpd, curr_pass, out_rpd):
 				return True
 			else:
@@ -488,10 +1972,12 @@ def patch_rpd(mod_rpd, mod_pass, orig_rpd, orig_pass, patch_file, out_rpd, out_p
 			return False
 
 
+@profiled('manual merge')
 def manual_merge(orig_rpd, mod_rpd, curr_rpd, curr_pass, out_rpd):
 	"""Prompts for a manual merge using the Admin Tool after detecting conflicts whilst attempting to automatically
-	patch.
+	patch. A successful merge is recorded in the resolution cache for reuse.
 	"""
+	resolution = resolution_key(orig_rpd, curr_rpd, mod_rpd, curr_pass)  # Before the Admin Tool can touch the RPDs
 
 	if os.path.basename(orig_rpd) == 'original.rpd':
 		orig_copy = os.path.join(os.path.dirname(orig_rpd), 'original1.rpd')
@@ -513,42 +1999,60 @@ def manual_merge(orig_rpd, mod_rpd, curr_rpd, curr_pass, out_rpd):
 	print '\tModified RPD:\t%s (%s)' % (mod_rpd, os.path.basename(mod_copy))
 	print '\nPerform a full repository merge using the Admin Tool and keep the output name as the default or %s' % out_rpd
 
-	copyfile(curr_rpd, curr_copy)
-	copyfile(orig_rpd, orig_copy)
-	copyfile(mod_rpd,  mod_copy)
+	track(orig_copy, mod_copy, curr_copy)
+	# The Admin Tool only reads the original and modified RPDs, but may write to the current RPD it opens
+	stage_file(curr_rpd, curr_copy, keep_source=True, link=False)
+	stage_file(orig_rpd, orig_copy, keep_source=True)
+	stage_file(mod_rpd, mod_copy, keep_source=True)
 
-	open_rpd(curr_copy, curr_pass)
+	if not open_rpd(curr_copy, curr_pass):
+		delete_file(orig_copy)
+		delete_file(mod_copy)
+		delete_file(curr_copy)
+		return False
 
 	output_file = os.path.basename(os.path.splitext(curr_copy)[0])
 	output_file += '(1).rpd'
 	output_file = os.path.join(os.path.dirname(curr_rpd), output_file)
+	track(output_file)
 
 	if not os.path.exists(out_rpd):
 		if os.path.exists(output_file):
-			copyfile(output_file, out_rpd)
-			delete_file(output_file)
+			stage_file(output_file, out_rpd)
 			delete_file(orig_copy)
 			delete_file(mod_copy)
 			delete_file(curr_copy)
-			return True
 		else:
 			print '\nError: Output RPD not found. Looking for %s or %s.' % (out_rpd, output_file)
 			return False
+	resolution_put(resolution, out_rpd, (orig_rpd, curr_rpd, mod_rpd))
 	return True
 
 
+RPD_SIDE_FILES = ['*_equalized.rpd', '*_patched.rpd', '*.merge_log.csv']  # Written by patchrpd next to its inputs
+
+
+def rpd_side_files(directory):
+	"""Lists the files patchrpd writes next to its inputs found in `directory`."""
+	return [os.path.abspath(f) for pattern in RPD_SIDE_FILES for f in glob(os.path.join(directory, pattern))]
+
+
 def cleanup_rpd_files(directory):
-	"""Remove temporary RPD files (from a patch merge)."""
+	"""Remove temporary RPD files (from a patch merge), leaving any this run did not create."""
 
-	for f in glob(os.path.join(directory, '*_equalized.rpd')):
-		delete_file(f)
-	for f in glob(os.path.join(directory, '*_patched.rpd')):
-		delete_file(f)
-	for f in glob(os.path.join(directory, '*.merge_log.csv')):
-		delete_file(f)
+	for f in rpd_side_files(directory):
+		if f in WORKSPACE_MANIFEST['paths']:
+			delete_file(f)
 
 
-def do_three_way_merge(orig_rpd, curr_rpd, modi_rpd, out_rpd, rpd_pass, tidy):
+@profiled('three way merge')
+def do_three_way_merge(orig_rpd, curr_rpd, modi_rpd, out_rpd, rpd_pass, tidy, work_dir=None):
+	"""
+	Three way merge of RPDs. `work_dir` holds the patch and tool logs, defaulting to the workspace. A recorded resolution
+	of the same merge candidates is reused rather than merging again, as is the merged RPD of an interrupted run.
+	"""
+	patch_file = os.path.join(work_dir or WORKSPACE, 'patch.xml')
+
 	if orig_rpd == out_rpd or curr_rpd == out_rpd or modi_rpd == out_rpd:
 		print '\nOutput RPD filename cannot be the same as any of the input RPD filename. Exiting.'
 		return False
@@ -562,7 +2066,10 @@ def do_three_way_merge(orig_rpd, curr_rpd, modi_rpd, out_rpd, rpd_pass, tidy):
 		print 'Exiting'
 		return False
 
-	if not create_patch(orig_rpd, rpd_pass, curr_rpd, rpd_pass, PATCH_FILE):
+	step = 'RPD merge %s' % merge_key(orig_rpd, curr_rpd, modi_rpd, rpd_pass)
+	reused = resolution_get(resolution_key(orig_rpd, curr_rpd, modi_rpd, rpd_pass), out_rpd) or \
+		journal_restore(step, out_rpd)
+	if not reused and not create_patch(orig_rpd, rpd_pass, curr_rpd, rpd_pass, patch_file, work_dir):
 		print '\n**create_patch failed. Aborting.'
 		return False
 
@@ -571,9 +2078,11 @@ def do_three_way_merge(orig_rpd, curr_rpd, modi_rpd, out_rpd, rpd_pass, tidy):
 	else:
 		delete_patch = False
 
-	if patch_rpd(modi_rpd, rpd_pass, orig_rpd, rpd_pass, PATCH_FILE,  out_rpd, rpd_pass, rpd_pass, curr_rpd, rpd_pass,
-				 AUTO_OPEN, delete_patch):
-		if TIDY:
+	if reused or patch_rpd(modi_rpd, rpd_pass, orig_rpd, rpd_pass, patch_file, out_rpd, rpd_pass, rpd_pass, curr_rpd,
+						   rpd_pass, AUTO_OPEN, delete_patch, work_dir):
+		if not reused:
+			journal_keep(step, out_rpd)
+		if tidy:
 			cleanup_rpd_files(os.path.dirname(curr_rpd))
 
 			delete_file(curr_rpd)
@@ -588,7 +2097,141 @@ def do_three_way_merge(orig_rpd, curr_rpd, modi_rpd, out_rpd, rpd_pass, tidy):
 		return False
 
 
-def reintegrate(src_url, target_url, rpd_pass, commit_message=None):
+def run_jobs(function, jobs):
+	"""
+	Calls `function` with each tuple of arguments in `jobs`, at most `JOBS` at a time, and returns the results in the
+	same order. Threads are enough as each job spends its time waiting on the OBIEE tools.
+	"""
+	results = [False] * len(jobs)
+	pending = list(enumerate(jobs))
+	lock = threading.Lock()
+
+	def worker():
+		while True:
+			with lock:
+				if not pending:
+					return
+				i, args = pending.pop(0)
+			try:
+				results[i] = function(*args)
+			except Exception, error:
+				print '\n**Error during %s%s\n\t%s' % (function.__name__, args, error)
+
+	threads = [threading.Thread(target=worker) for i in range(0, min(JOBS, len(jobs)))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	return results
+
+
+@profiled('batch merge')
+def batch_merge(orig_rpd, curr_rpds, modi_rpd, out_rpd, rpd_pass, tidy):
+	"""
+	Merges the changes each of `curr_rpds` made to `orig_rpd` into `modi_rpd` with a single `patchrpd` run: their
+	patches are created side by side and composed into one, so only the output RPD is written. If the patches overlap,
+	or the composed patch conflicts, the Current RPDs are merged one at a time instead, each into the output of the one
+	before (reusing the patches from the cache), so overlapping changes are merged and conflicts resolved as usual.
+	"""
+	inputs = [orig_rpd, modi_rpd] + curr_rpds
+	if out_rpd in inputs:
+		print '\nOutput RPD filename cannot be the same as any of the input RPD filename. Exiting.'
+		return False
+	for rpd in inputs:
+		check_file_exists(rpd)
+	if not check_free_space([modi_rpd]):
+		return False
+	if not delete_file(out_rpd):
+		print '\n** Could not delete output RPD. Is it open in the Administration Tool or write-protected?'
+		return False
+
+	work_dirs = [workspace_dir('batch', str(number)) for number in range(1, len(curr_rpds) + 1)]
+	patches = [os.path.join(work_dir, 'patch.xml') for work_dir in work_dirs]
+	results = run_jobs(create_patch, [(orig_rpd, rpd_pass, curr_rpd, rpd_pass, patch_file, work_dir)
+									  for curr_rpd, patch_file, work_dir in zip(curr_rpds, patches, work_dirs)])
+	if not all(results):
+		print '\n**create_patch failed for %s. Aborting.' % ', '.join(
+			curr_rpd for curr_rpd, result in zip(curr_rpds, results) if not result)
+		return False
+
+	print '\nComposing %d patches...\n' % len(patches)
+	composed = os.path.join(workspace_dir('batch'), 'composed.xml')
+	overlaps = compose_patches(patches, composed)
+	merged = False
+	if overlaps:
+		print '\nThe Current RPDs change some of the same objects.'
+	elif overlaps is not None:
+		merged = patch_rpd(modi_rpd, rpd_pass, orig_rpd, rpd_pass, composed, out_rpd, rpd_pass, rpd_pass,
+						   auto_open=AUTO_OPEN, delete_patch=tidy, log_dir=workspace_dir('batch'))
+
+	if not merged:
+		print '\nMerging the Current RPDs one at a time instead.'
+		previous = modi_rpd
+		for number, (curr_rpd, work_dir) in enumerate(zip(curr_rpds, work_dirs), 1):
+			step_rpd = out_rpd if number == len(curr_rpds) else os.path.join(work_dir, 'merged.rpd')
+			if not do_three_way_merge(orig_rpd, curr_rpd, previous, step_rpd, rpd_pass, False, work_dir):
+				return False
+			if previous != modi_rpd:
+				delete_file(previous)
+			previous = step_rpd
+
+	if tidy:
+		for rpd in inputs:
+			cleanup_rpd_files(os.path.dirname(rpd))
+			delete_file(rpd)
+	print '\nMerged %d Current RPDs into %s.\n' % (len(curr_rpds), out_rpd)
+	return True
+
+
+def merge_conflicted_rpd(conflicting_rpd_file, original_rpd, current_rpd, modified_rpd, rpd_pass, work_dir,
+						 base_url=None):
+	"""
+	Resolves one conflicted RPD in a working copy with a three way merge, replacing it with the merged RPD. The merge
+	runs on copies of the candidates in `work_dir`, so the files the tools write next to them stay in the workspace.
+	With `base_url`, the RPD at that URL is merged against instead of `original_rpd`.
+	"""
+	output_rpd = os.path.join(work_dir, 'merged.rpd')
+	candidates = [os.path.join(work_dir, name) for name in ('a.rpd', 'b.rpd', 'c.rpd')]
+	written = 0
+	if base_url:
+		if not svn_cat([base_url], candidates[:1]):
+			print '\n**Failed to get %s' % base_url
+			return False
+		written += os.path.getsize(candidates[0])
+	else:
+		written += stage_file(original_rpd, candidates[0], keep_source=True)
+	for candidate, staged in zip([modified_rpd, current_rpd], candidates[1:]):
+		written += stage_file(candidate, staged, keep_source=True)
+	print 'Staged merge candidates for %s (%.1f MB written).' % (conflicting_rpd_file, written / 1048576.0)
+
+	if do_three_way_merge(orig_rpd=candidates[0], modi_rpd=candidates[1], curr_rpd=candidates[2], out_rpd=output_rpd,
+						  rpd_pass=rpd_pass, tidy=True, work_dir=work_dir):
+		print 'Three way merge of %s successful!' % conflicting_rpd_file
+		try:
+			for rpd in (conflicting_rpd_file, original_rpd, current_rpd, modified_rpd):
+				delete_file(rpd)  # The conflicted RPD and Subversion's merge-left/right copies of it
+			stage_file(output_rpd, conflicting_rpd_file)
+			journal_moved(output_rpd, conflicting_rpd_file)
+		except Exception as error:
+			print '\n**Failed to rename %s to %s\n\t%s' % (output_rpd, conflicting_rpd_file, error)
+			return False
+		rmtree(work_dir, True)
+		return True
+	else:
+		print 'Three way merge of %s failed. See %s for details.' % (conflicting_rpd_file, work_dir)
+		return False
+
+
+@profiled('reintegrate')
+def reintegrate(src_url, target_url, rpd_pass, commit_message=None, wc=None, sync=False, bases=None, commit=True):
+	"""
+	Reintegrates `src_url` into `target_url`, resolving RPD conflicts with a three way merge, and commits the result.
+	An existing working copy of the target can be passed as `wc`, in which case it is updated rather than checked out.
+	With `sync`, only the revisions of `src_url` not yet merged into the target are merged, as when refreshing a
+	feature. `bases` maps RPD paths to (pegged URL, revision) of the version to merge against, where the version
+	Subversion picks is older, see `refresh_feature`.
+	Without `commit`, the merged working copy is returned uncommitted instead, see `fan_out`.
+	"""
 	action = 'Reintegrate Merge from %s to %s' % (src_url, target_url)
 	if ACTION == 'reintegrate':
 		print action
@@ -599,17 +2242,25 @@ def reintegrate(src_url, target_url, rpd_pass, commit_message=None):
 		print 'RPD password must be supplied. Aborting'
 		return False
 
-	wc = tempfile.mkdtemp(prefix='rm_rpdmerge')
+	own_wc = wc is None
+	if own_wc:
+		wc = svn_pooled_wc(target_url)
 
-	if not svn_checkout(url=target_url, wc=wc, force=True):
-		print '\n**Failed to checkout %s to %s' % (target_url, wc)
+		if wc is None:
+			print '\n**Failed to checkout %s' % target_url
+			return False
+	elif not svn_update(wc):
+		print '\n**Failed to update %s' % wc
 		return False
 
-	merge_output = svn_merge(srcurl=src_url, target_wc=wc, re_integrate=True, accept='postpone')
+	# Subversion refuses --reintegrate into a sparse working copy, so sparse copies rely on automatic reintegration
+	merge_output = svn_merge(srcurl=src_url, target_wc=wc, re_integrate=not (SVN_SPARSE_PATHS or sync),
+							 accept='postpone')
 
 	if merge_output:
 		if 'Text conflicts' in merge_output:
 			print '\n** Conflicts detected'
+			merges = []
 			lines = merge_output.split('\n')
 			for line in lines:
 				pattern = re.compile('^C    ')
@@ -649,22 +2300,25 @@ def reintegrate(src_url, target_url, rpd_pass, commit_message=None):
 						current_rpd = modified_rpd
 						modified_rpd = current_rpd_tmp
 
-					output_rpd = '%s.merged.rpd' % modified_rpd
-
-					if do_three_way_merge(orig_rpd=original_rpd, modi_rpd=modified_rpd, curr_rpd=current_rpd,
-										  out_rpd=output_rpd, rpd_pass=rpd_pass, tidy=True):
-						print 'Three way merge successful!'
-						try:
-							delete_file(conflicting_rpd_file)
-							delete_file(original_rpd)
-							delete_file(modified_rpd)
-							os.rename(output_rpd, conflicting_rpd_file)
-						except Exception as error:
-							print '\n**Failed to rename %s to %s\n\t%s' % (output_rpd, conflicting_rpd_file, error)
-							return False
-					else:
-						print 'Three way merge failed'
-						return False
+					base_url = None
+					path = os.path.relpath(os.path.abspath(conflicting_rpd_file), os.path.abspath(wc)).replace('\\', '/')
+					left = re.search('merge-left\.r(\d+)$', original_rpd)
+					if path in (bases or {}) and (left is None or int(left.group(1)) < bases[path][1]):
+						base_url = bases[path][0]
+						print 'Merging %s against %s rather than r%s.' % (path, base_url, left.group(1) if left else '?')
+
+					# Each merge gets its own workspace directory for its candidates, patch, logs and output
+					work_dir = tempfile.mkdtemp(prefix='merge-', dir=WORKSPACE)
+					track(work_dir)
+					merges.append((conflicting_rpd_file, original_rpd, current_rpd, modified_rpd, rpd_pass, work_dir,
+								   base_url))
+
+			if not check_free_space([merge[0] for merge in merges]):
+				return False
+			results = run_jobs(merge_conflicted_rpd, merges)
+			if not all(results):
+				print '\n**Failed to merge %s' % ', '.join(merge[0] for merge, result in zip(merges, results) if not result)
+				return False
 
 		if 'Tree conflicts' in merge_output:
 			print '\n**Tree conflicts detected in output. This is bad, because we can\'t fix that for you automagically.' \
@@ -675,8 +2329,13 @@ def reintegrate(src_url, target_url, rpd_pass, commit_message=None):
 
 			return False
 
+		if not commit:
+			return wc
+
 		if svn_commit(wc, commit_message):
 			print 'Successfully commited WC. All good.'
+			if own_wc:
+				release_wc(wc)
 			return True
 		else:
 			print '\n**Commit failed. Working copy %s is probably in a mess and should be cleaned up.' % wc
@@ -687,6 +2346,52 @@ def reintegrate(src_url, target_url, rpd_pass, commit_message=None):
 		return False
 
 
+@profiled('fan out')
+def fan_out(src_url, target_urls, rpd_pass, commit_message):
+	"""
+	Reintegrates `src_url` into each of `target_urls` at the same time, each in a working copy of its own, and then
+	commits either all of them or none. Subversion commits each working copy on its own, so if a later commit fails,
+	those already made are undone. Each commit is journalled, so resuming an interrupted run only merges into the
+	targets not yet committed.
+	"""
+	steps = dict((target_url, 'reintegrate %s into %s' % (src_url, target_url)) for target_url in target_urls)
+	target_urls = [target_url for target_url in target_urls if not step_completed(steps[target_url])]
+	wcs = run_jobs(reintegrate, [(src_url, target_url, rpd_pass, commit_message, None, False, None, False)
+								 for target_url in target_urls])
+	failed = [target_url for target_url, wc in zip(target_urls, wcs) if not wc]
+	if not failed:
+		failed = [target_url for target_url, wc in zip(target_urls, wcs) if svn_out_of_date(wc)]
+		if failed:
+			print '\n**%s changed while merging.' % ', '.join(failed)
+	if failed:
+		print '\n**Nothing is committed, as %s could not be merged into %s.' % (src_url, ', '.join(failed))
+		for wc in wcs:
+			if wc:
+				svn_revert(wc)
+				release_wc(wc)
+		return False
+
+	committed = []
+	for target_url, wc in zip(target_urls, wcs):
+		revision = svn_commit(wc, commit_message)
+		if not revision:
+			print '\n**Commit to %s failed. Undoing the commits already made so no target has the change.' % target_url
+			for done_url, done_wc, done_revision in committed:
+				journal_record(steps[done_url], done=None)
+				if not svn_undo(done_url, done_wc, done_revision, commit_message):
+					print '\n**Could not undo r%d of %s. Revert it by hand.' % (done_revision, done_url)
+			for wc in wcs:
+				svn_revert(wc)
+				release_wc(wc)
+			return False
+		committed.append((target_url, wc, revision))
+		journal_record(steps[target_url], done=time.time(), result=revision)
+
+	for wc in wcs:
+		release_wc(wc)
+	return True
+
+
 def start_release(release_name):
 	release_branch_name = '%s-%s' % (SVN_RELEASE_BRANCH_ROOT, release_name)
 	source_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
@@ -766,7 +2471,8 @@ def finish_feature(feature_name, delete_feature=False):
 	else:
 		commit_message = COMMIT_MESSAGE
 
-	if reintegrate(src_url=source_url, target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message):
+	if journaled('reintegrate %s into %s' % (source_url, dest_url), reintegrate, src_url=source_url, target_url=dest_url,
+				 rpd_pass=RPD_PASS, commit_message=commit_message):
 		print '\nSuccessfully reintegrated feature %s back into develop\n\n**It would be good practice to now delete ' \
 			  'the feature branch**' % feature_branch_name
 		return True
@@ -785,7 +2491,8 @@ def finish_release(release_name, delete_feature=False):
 	else:
 		commit_message = COMMIT_MESSAGE
 
-	if reintegrate(src_url=source_url, target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message):
+	if journaled('reintegrate %s into %s' % (source_url, dest_url), reintegrate, src_url=source_url, target_url=dest_url,
+				 rpd_pass=RPD_PASS, commit_message=commit_message):
 		print '\nSuccessfully reintegrated release %s into trunk\n\n**It would be good practice to now delete the ' \
 			  'release branch**' % feature_branch_name
 		return True
@@ -805,19 +2512,14 @@ def finish_release_hotfix(release_name, hotfix_name, delete_feature=False):
 	else:
 		commit_message = COMMIT_MESSAGE
 
-	if reintegrate(src_url=source_url, target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message):
-		print '\n(1 of 2) Successfully reintegrated hotfix release %s into release branch %s\n\n' % (release_hotfix_branch_name,release_branch_name)
-		dest_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
-		if reintegrate(src_url=source_url, target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message):
-			print '\n(2 of 2) Successfully reintegrated hotfix release %s into develop branch\n\n**It would be good ' \
-				  'practice to now delete the release hotfix branch**' % release_hotfix_branch_name
-			return True
-		else:
-			print '\n**Failed to reintegrate hotfix release %s into develop' % release_hotfix_branch_name
-
+	develop_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
+	if fan_out(source_url, [dest_url, develop_url], RPD_PASS, commit_message):
+		print '\nSuccessfully reintegrated hotfix release %s into release branch %s and develop\n\n**It would be ' \
+			  'good practice to now delete the release hotfix branch**' % (release_hotfix_branch_name, release_branch_name)
+		return True
 	else:
-		print '\nFailed to reintegrate hotfix release %s into release branch%s' % (release_hotfix_branch_name,
-																				   release_branch_name)
+		print '\nFailed to reintegrate hotfix release %s into release branch %s and develop' \
+			  % (release_hotfix_branch_name, release_branch_name)
 		return False
 
 
@@ -831,22 +2533,68 @@ def finish_hotfix(hotfix_name, delete_feature=False):
 	else:
 		commit_message = COMMIT_MESSAGE
 
-	if reintegrate(src_url=source_url, target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message):
-		print '\n(1 of 2) Successfully reintegrated hotfix %s into trunk\n\n' % hotfix_branch_name
-		dest_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
-		if reintegrate(src_url=source_url, target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message):
-			print '\n(2 of 2) Successfully reintegrated hotfix %s into develop branch\n\n**It would be good practice to ' \
-				  'now delete the hotfix branch**' % hotfix_branch_name
-			return True
-		else:
-			print '\n**Failed to reintegrate hotfix %s into develop' % hotfix_branch_name
-
+	develop_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
+	if fan_out(source_url, [dest_url, develop_url], RPD_PASS, commit_message):
+		print '\nSuccessfully reintegrated hotfix %s into trunk and develop\n\n**It would be good practice to now ' \
+			  'delete the hotfix branch**' % hotfix_branch_name
+		return True
 	else:
-		print '\nFailed to reintegrate hotfix %s into trunk ' % hotfix_branch_name
+		print '\nFailed to reintegrate hotfix %s into trunk and develop' % hotfix_branch_name
+		return False
+
+
+def feature_list(names):
+	"""Reads feature names from a comma separated list, or from a file with one name per line."""
+	path = os.path.join(CURRENT_DIR, names)
+	if os.path.isfile(path):
+		with open(path, 'r') as f:
+			names = ','.join(line.split('#')[0] for line in f)
+	return [name.strip() for name in names.split(',') if name.strip()]
+
+
+def finish_features(feature_names):
+	"""
+	Finishes a queue of features in one go, reintegrating each into a single working copy of develop that is checked
+	out once and updated between features. A feature that fails to merge is reverted and skipped.
+	"""
+	dest_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
+	wc = svn_pooled_wc(dest_url)
+	if wc is None:
+		print '\n**Failed to checkout %s' % dest_url
 		return False
 
+	results = []
+	for feature_name in feature_names:
+		feature_branch_name = '%s-%s' % (SVN_DEV_BRANCH_ROOT, feature_name)
+		source_url = '%s/%s' % (SVN_BASE_URL, feature_branch_name)
+		if COMMIT_MESSAGE is None:
+			commit_message = '%s: Finish Feature    [via merge_rpd.py]' % feature_name
+		else:
+			commit_message = COMMIT_MESSAGE
+
+		if journaled('reintegrate %s into %s' % (source_url, dest_url), reintegrate, src_url=source_url,
+					 target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message, wc=wc):
+			results.append((feature_branch_name, 'Merged'))
+		else:
+			svn_revert(wc)
+			results.append((feature_branch_name, 'FAILED'))
+
+	release_wc(wc)
+	merged = sum(1 for _, result in results if result == 'Merged')
+	print '\nReintegrated %d of %d features into develop:' % (merged, len(results))
+	for feature_branch_name, result in results:
+		print '\t%s\t%s' % (result, feature_branch_name)
+	return merged == len(results)
+
 
 def refresh_feature(feature_name, delete_feature = False):
+	"""
+	Merges the develop revisions not yet merged into a feature branch. Each refresh records the develop revision
+	absorbed and its RPDs, keyed by feature branch, in `REFRESH_STATE_FILE`. A refresh when develop has
+	not changed since is skipped without a checkout, and a conflicted RPD is merged against the develop RPD last
+	absorbed should Subversion pick an older one, so only develop's changes since the last refresh are compared and
+	patched.
+	"""
 	feature_branch_name = '%s-%s' % (SVN_DEV_BRANCH_ROOT, feature_name)
 	source_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
 	dest_url = '%s/%s' % (SVN_BASE_URL, feature_branch_name)
@@ -855,17 +2603,567 @@ def refresh_feature(feature_name, delete_feature = False):
 	else:
 		commit_message = COMMIT_MESSAGE
 
-	if reintegrate(src_url=source_url, target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message):
-		print '\nSuccessfully refreshed feature %s from develop' % feature_branch_name
+	# The record is dropped if the branch has been recreated since
+	state = load_refresh_state()
+	previous = state.get(feature_branch_name)
+	branched = svn_branched(dest_url)
+	if previous and previous['branched'] != branched:
+		print '\n%s has been recreated since its last refresh.' % feature_branch_name
+		previous = None
+	develop = svn_info(source_url)
+	if develop is None:
+		print '\nFailed to refresh feature %s from develop, %s not found' % (feature_branch_name, source_url)
+		return False
+	if previous and develop['last_changed_revision'] <= previous['develop']:
+		print '\nFeature %s is up to date with develop (r%d)' % (feature_branch_name, previous['develop'])
 		return True
-	else:
-		print '\nFailed to refresh feature %s from develop' % feature_branch_name
+
+	bases = {}
+	if previous:
+		bases = dict((path, ('%s/%s@%d' % (source_url, path, previous['develop']), previous['develop']))
+					 for path in previous['rpds'])
+	wc = svn_pooled_wc(dest_url)
+	if wc is None:
+		print '\n**Failed to checkout %s' % dest_url
 		return False
 
+	try:
+		if not reintegrate(src_url=source_url, target_url=dest_url, rpd_pass=RPD_PASS, commit_message=commit_message,
+						   wc=wc, sync=True, bases=bases):
+			print '\nFailed to refresh feature %s from develop' % feature_branch_name
+			return False
+
+		# The develop revision absorbed, for the next refresh to merge only what came after
+		rpds = {}
+		for path in svn_rpds(source_url):
+			info = svn_info('%s/%s@%d' % (source_url, path, develop['revision']))
+			rpds[path] = {'develop': info and info['last_changed_revision']}
+		state[feature_branch_name] = {'branched': branched, 'develop': develop['revision'], 'time': time.time(),
+									  'rpds': rpds}
+		save_refresh_state(state)
+	finally:
+		release_wc(wc)
+	print '\nSuccessfully refreshed feature %s from develop' % feature_branch_name
+	return True
+
+
+def load_state(state_file):
+	"""Returns what `state_file` records for this repository (`SVN_BASE_URL`)."""
+	if os.path.exists(state_file):
+		with open(state_file, 'r') as f:
+			return json.load(f).get(SVN_BASE_URL, {})
+	return {}
+
+
+def save_state(state_file, state):
+	"""Records `state` for this repository in `state_file`, keeping what it records for other repositories."""
+	states = {}
+	if os.path.exists(state_file):
+		with open(state_file, 'r') as f:
+			states = json.load(f)
+	elif not os.path.exists(os.path.dirname(state_file)):
+		os.makedirs(os.path.dirname(state_file))
+	states[SVN_BASE_URL] = state
+	tmp = '%s.%d.tmp' % (state_file, os.getpid())
+	with open(tmp, 'w') as f:
+		json.dump(states, f)
+	if os.path.exists(state_file):
+		os.remove(state_file)  # Windows will not rename over an existing file
+	os.rename(tmp, state_file)
+
+
+def load_refresh_state():
+	"""What each feature branch absorbed from develop at its last refresh, see `refresh_feature`."""
+	return load_state(REFRESH_STATE_FILE)
+
+
+def save_refresh_state(state):
+	"""Records what each feature branch absorbed from develop at its last refresh."""
+	save_state(REFRESH_STATE_FILE, state)
+
+
+def svn_cat(urls, dests):
+	"""
+	Writes each file in `urls` from the repository to the file of the same position in `dests`, all at the same time
+	and streaming them rather than reading them into memory. Returns True if all were written.
+	"""
+	files = [open(dest, 'wb') for dest in dests]
+	try:
+		runs = [Run([SVN_BIN, 'cat', url], err_sinks=[], timeout=COMMAND_TIMEOUT, stdout=f).start()
+				for url, f in zip(urls, files)]
+		return all([run.wait() == 0 for run in runs])
+	finally:
+		for f in files:
+			f.close()
+
+
+def svn_rpds(url):
+	"""Paths of the RPDs under a remote directory, relative to it."""
+	stdout = run_command([SVN_BIN, 'ls', '-R', url], COMMAND_TIMEOUT)[1]
+	return [path.strip() for path in stdout.splitlines() if path.strip().lower().endswith('.rpd')]
+
+
+def branched_from(log):
+	"""The revision a branch was copied from, given the `svn log --xml -v` of its first revision."""
+	if log[0] != 0:
+		return None
+	for path in ElementTree.fromstring(log[1]).iter('path'):
+		if path.get('copyfrom-rev'):
+			return int(path.get('copyfrom-rev'))
+	return None
+
+
+def branch_log(url):
+	"""The command listing the first revision of a branch, from which `branched_from` reads where it was copied."""
+	return [SVN_BIN, 'log', '--xml', '-v', '-q', '--stop-on-copy', '-r', '1:HEAD', '--limit', '1', url]
+
+
+def svn_branched(url):
+	"""The revision a branch was copied from, or None if it cannot be told."""
+	return branched_from(run_command(branch_log(url), COMMAND_TIMEOUT))
+
+
+def svn_last_synced(feature_url, develop_url):
+	"""
+	The last revision of develop merged into a feature branch, or else the revision it was branched from. This is the
+	original a reintegrate of the feature into develop will merge against.
+	"""
+	mergeinfo, log = run_commands([  # Both at once, as the log is needed whenever nothing has been merged
+		[SVN_BIN, 'mergeinfo', '--show-revs', 'merged', develop_url, feature_url], branch_log(feature_url)],
+		COMMAND_TIMEOUT)
+	merged = [int(line.strip().lstrip('r')) for line in mergeinfo[1].splitlines() if line.strip()]
+	if merged:
+		return max(merged)
+	return branched_from(log)
+
+
+def open_features():
+	"""Returns the URL of the branch root and the names of the open feature branches under it."""
+	branch_root = '%s/%s' % (SVN_BASE_URL, os.path.dirname(SVN_DEV_BRANCH_ROOT))
+	prefix = '%s-' % os.path.basename(SVN_DEV_BRANCH_ROOT)
+	return branch_root, sorted(entry['name'] for entry in svn_ls(branch_root) or []
+							   if entry['kind'] == 'dir' and entry['name'].startswith(prefix))
+
+
+def remote_patch(state, pair, orig_url, curr_url, work_dir):
+	"""
+	Returns the patch cache key for the changes between two files in the repository, given as pegged URLs, creating the
+	patch unless `state` records it for `pair` already. Returns None if the patch could not be created.
+	"""
+	if pair in state and os.path.exists(patch_cache_path(state[pair])):
+		return state[pair]
+
+	# Named by URL, as file hashes are memoised by path
+	orig_rpd = os.path.join(work_dir, '%s.rpd' % hashlib.sha1(orig_url).hexdigest())
+	curr_rpd = os.path.join(work_dir, '%s.rpd' % hashlib.sha1(curr_url).hexdigest())
+	patch_file = os.path.join(work_dir, 'patch.xml')
+	key = None
+	if svn_cat([orig_url, curr_url], [orig_rpd, curr_rpd]) and \
+			create_patch(orig_rpd, RPD_PASS, curr_rpd, RPD_PASS, patch_file, work_dir):
+		key = state[pair] = patch_cache_key(orig_rpd, RPD_PASS, curr_rpd, RPD_PASS)
+	delete_file(orig_rpd)
+	delete_file(curr_rpd)
+	delete_file(patch_file)
+	return key
+
+
+def load_precompute_state():
+	"""The pairs of RPD revisions already compared, mapped to their patch cache keys."""
+	return load_state(PRECOMPUTE_STATE_FILE)
+
+
+def save_precompute_state(state):
+	"""Records the pairs of RPD revisions compared so far, see `load_precompute_state`."""
+	save_state(PRECOMPUTE_STATE_FILE, state)
+
+
+def precompute_patches():
+	"""
+	Creates ahead of time the patches that finishing each open feature will need, so that `finishFeature` finds them in
+	the patch cache and only has to run `patchrpd`. Reintegrating a feature patches the changes made to each RPD on
+	develop since the feature was branched or last refreshed. Pairs of RPD revisions already done are recorded in
+	`PRECOMPUTE_STATE_FILE`, so only features or develop RPDs that have moved are looked at again.
+	"""
+	if not PATCH_CACHE:
+		print '\n**Precomputed patches are kept in the patch cache, which is turned off (--no-patch-cache).'
+		return False
+
+	svn_forget()
+	state = load_precompute_state()
+	develop_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
+	branch_root, features = open_features()
+	rpds = svn_rpds(develop_url)
+
+	work_dir = workspace_dir('precompute')
+	stored = PATCH_CACHE_STATS['stored']
+	try:
+		for feature in features:
+			synced = svn_last_synced('%s/%s' % (branch_root, feature), develop_url)
+			for path in rpds:
+				info = svn_info('%s/%s' % (develop_url, path))
+				if synced is None or info is None or info['last_changed_revision'] <= synced:
+					continue  # Unchanged on develop, so the feature's changes apply without a three way merge
+				if '%s@%d:%d' % (path, synced, info['last_changed_revision']) not in state:
+					print '\nPrecomputing the patch of %s for %s...' % (path, feature)
+				remote_patch(state, '%s@%d:%d' % (path, synced, info['last_changed_revision']),
+							 '%s/%s@%d' % (develop_url, path, synced),
+							 '%s/%s@%d' % (develop_url, path, info['last_changed_revision']), work_dir)
+	finally:
+		rmtree(work_dir, True)
+		save_precompute_state(state)
+	print '\nPrecomputed %d patch(es) for %d open feature branch(es).' \
+		  % (PATCH_CACHE_STATS['stored'] - stored, len(features))
+	return True
+
+
+def precompute(interval=None):
+	"""Precomputes patches for open features once, or every `interval` seconds until interrupted."""
+	try:
+		while precompute_patches() and interval:
+			print 'Checking again in %d seconds. Press Ctrl+C to stop.' % interval
+			time.sleep(interval)
+	except KeyboardInterrupt:
+		print '\nStopping.'
+
+
+def analyze_conflicts():
+	"""
+	Reports which open features change the same repository objects, without merging them. The objects each feature
+	changes are read from the index of its patch against develop as of its last sync (created if not in the patch
+	cache), and an inverted index from object to features gives the overlapping pairs in a single pass. Features are
+	then suggested in merge order, those sharing the fewest objects with other features first.
+	"""
+	if not PATCH_CACHE:
+		print '\n**Conflict analysis reads patches from the patch cache, which is turned off (--no-patch-cache).'
+		return False
+
+	svn_forget()
+	state = load_precompute_state()
+	develop_url = '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)
+	branch_root, features = open_features()
+
+	changes = dict((feature, 0) for feature in features)
+	objects = {}
+	work_dir = workspace_dir('analyze')
+	try:
+		for feature in features:
+			feature_url = '%s/%s' % (branch_root, feature)
+			synced = svn_last_synced(feature_url, develop_url)
+			if synced is None:
+				print '\n**Could not tell when %s was last synced with develop, leaving it out.' % feature
+				continue
+			for path in svn_rpds(feature_url):
+				info = svn_info('%s/%s' % (feature_url, path))
+				if info is None or svn_info('%s/%s@%d' % (develop_url, path, synced)) is None:
+					continue  # Added on the feature
+				pair = '%s/%s@%d:%d' % (feature, path, synced, info['last_changed_revision'])
+				if pair not in state:
+					print '\nCreating the patch of %s in %s...' % (path, feature)
+				key = remote_patch(state, pair, '%s/%s@%d' % (develop_url, path, synced),
+								   '%s/%s@%d' % (feature_url, path, info['last_changed_revision']), work_dir)
+				index_file = patch_index(key, patch_cache_path(key), False) if key else None
+				if index_file is None:
+					print '\n**Could not read the changes of %s in %s, leaving it out.' % (path, feature)
+					continue
+				for operation, object_type, name, uid in read_patch_index(index_file):
+					touched = objects.setdefault((path, object_type, name), set())
+					if feature not in touched:
+						touched.add(feature)
+						changes[feature] += 1
+	finally:
+		rmtree(work_dir, True)
+		save_precompute_state(state)
+
+	print_conflict_report(changes, objects)
+	return True
+
+
+SERVER_JOBS = []
+SERVER_LOCK = threading.Condition()
+
+
+def job_args(argv, drop=()):
+	"""
+	Arguments of a job submitted to a merge server: this run's arguments less the server and config options, and any
+	options in `drop`.
+	"""
+	args = []
+	skip = False
+	options = ('--server', '-c', '--config') + tuple(drop)
+	for arg in argv:
+		if skip:
+			skip = False
+		elif arg in options:
+			skip = True
+		elif not any(arg.startswith(option + '=') for option in options if option.startswith('--')):
+			args.append(arg)
+	return args
+
+
+def submit_job(server, args):
+	"""Submits a run to a merge server, then streams its log until it finishes. Returns the exit code of the run."""
+	server = server.rstrip('/')
+	request = urllib2.Request(server + '/jobs', json.dumps({'args': args}), {'Content-Type': 'application/json'})
+	try:
+		job = json.load(urllib2.urlopen(request))
+		print 'Submitted job %s to %s. Status: %s\n' % (job['id'], server, job['status'])
+
+		log = urllib2.urlopen('%s/jobs/%s/log' % (server, job['id']))
+		for line in iter(log.readline, ''):
+			sys.stdout.write(line)
+			sys.stdout.flush()
+
+		job = json.load(urllib2.urlopen('%s/jobs/%s' % (server, job['id'])))
+	except urllib2.HTTPError, error:
+		print '\n**Merge server refused the job: %s' % error.read()
+		return 1
+	except (urllib2.URLError, socket.error), error:
+		print '\n**Could not reach the merge server at %s: %s' % (server, error)
+		return 1
+
+	print '\nJob %s %s.' % (job['id'], job['status'])
+	if job['status'] == 'finished':
+		return 0
+	return job['returncode'] or 1
+
+
+def job_targets(job_options):
+	"""URLs of the branches a job merges into, so jobs merging into the same branch run in turn."""
+	action = job_options.action
+	if action in ('finishFeature', 'finishFeatures'):
+		return ['%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)]
+	elif action == 'refreshFeature':
+		return ['%s/%s-%s' % (SVN_BASE_URL, SVN_DEV_BRANCH_ROOT, job_options.featureName)]
+	elif action == 'finishRelease':
+		return ['%s/%s' % (SVN_BASE_URL, SVN_TRUNK)]
+	elif action == 'finishHotfix':
+		return ['%s/%s' % (SVN_BASE_URL, SVN_TRUNK), '%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)]
+	elif action == 'finishReleaseHotfix':
+		return ['%s/%s-%s' % (SVN_BASE_URL, SVN_RELEASE_BRANCH_ROOT, job_options.releaseName),
+				'%s/%s' % (SVN_BASE_URL, SVN_DEVELOP)]
+	elif action == 'reintegrate':
+		return [job_options.target_url]
+	return []  # Standalone merges and new branches don't touch a shared working copy
+
+
+def add_job(args):
+	"""Queues a run of this script with `args`, returning the job, or None if the arguments are not a valid job."""
+	try:
+		job_options = arg_parser.parse_args(args)
+	except SystemExit:
+		return None
+	if job_options.server or job_options.action == 'serve':
+		return None
+
+	with SERVER_LOCK:
+		# The job directory is created under a new name, so the jobs of an earlier server run are never overwritten
+		server_dir = os.path.join(SCRIPT_DIR, '.merge_server')
+		if not os.path.exists(server_dir):
+			os.makedirs(server_dir)
+		job_dir = tempfile.mkdtemp(prefix=time.strftime('%Y%m%d%H%M%S-'), dir=server_dir)
+		job = {'id': os.path.basename(job_dir), 'dir': job_dir, 'log': os.path.join(job_dir, 'job.log'), 'args': args,
+			   'targets': job_targets(job_options), 'status': 'queued', 'returncode': None,
+			   'submitted': time.time(), 'started': None, 'finished': None}
+		open(job['log'], 'w').close()
+		SERVER_JOBS.append(job)
+		start_jobs()
+	return job
+
+
+def start_jobs():
+	"""
+	Starts each queued job whose targets are not being merged into by a running job, nor by a job queued ahead of it.
+	Jobs sharing a target therefore run one at a time, in the order they were submitted. Called holding `SERVER_LOCK`.
+	"""
+	busy = set()
+	for job in SERVER_JOBS:
+		if job['status'] == 'running':
+			busy.update(job['targets'])
+	for job in SERVER_JOBS:
+		if job['status'] == 'queued':
+			if not busy.intersection(job['targets']):
+				job['status'] = 'running'
+				thread = threading.Thread(target=run_job, args=(job,))
+				thread.daemon = True
+				thread.start()
+			busy.update(job['targets'])
+
+
+def run_job(job):
+	"""Runs a job as a child process of this script, in its own directory so its patches and logs are kept apart."""
+	job['started'] = time.time()
+	command = [sys.executable, '-u', os.path.join(SCRIPT_DIR, os.path.basename(sys.argv[0]))] + job['args'] + \
+			  ['-c', os.path.abspath(config_file)]
+	try:
+		with open(job['log'], 'w') as log:
+			with open(os.devnull, 'r') as devnull:  # No one is there to complete a manual merge
+				with SERVER_LOCK:
+					job['run'] = Run(command, cwd=job['dir'], stdin=devnull, stdout=log, stderr=STDOUT, group=True).start()
+				returncode = job['run'].wait()
+	except Exception, error:
+		with open(job['log'], 'a') as log:
+			log.write('\n**Failed to run job: %s\n' % error)
+		returncode = 1
+
+	with SERVER_LOCK:
+		job['returncode'] = returncode
+		job['finished'] = time.time()
+		if returncode == 0:
+			job['status'] = 'finished'
+		elif returncode is None:
+			job['status'] = 'cancelled'
+		else:
+			job['status'] = 'failed'
+		start_jobs()
+		SERVER_LOCK.notify_all()
+
+
+def job_status(job):
+	return dict((key, job[key]) for key in ['id', 'args', 'targets', 'status', 'returncode', 'submitted', 'started',
+											 'finished'])
+
+
+class MergeRequestHandler(BaseHTTPRequestHandler):
+	"""
+	HTTP API of the merge server:
+
+	DELETE /jobs/<id>		Cancel a job, stopping it if it is running.
+	POST /jobs				Queue a job, e.g. {"args": ["--action", "finishFeature", "--featureName", "F01"]}. Returns the job.
+	GET /jobs				List all jobs.
+	GET /jobs/<id>			Status of a job.
+	GET /jobs/<id>/log		The job's output, streamed until the job finishes.
+	"""
+
+	def send_json(self, code, data):
+		body = json.dumps(data, indent=2)
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def find_job(self, job_id):
+		for job in SERVER_JOBS:
+			if job['id'] == job_id:
+				return job
+		self.send_json(404, {'error': 'No job %s' % job_id})
+		return None
+
+	def do_GET(self):
+		path = self.path.split('?')[0].strip('/').split('/')
+		if path == ['jobs']:
+			self.send_json(200, [job_status(job) for job in SERVER_JOBS])
+		elif len(path) == 2 and path[0] == 'jobs':
+			job = self.find_job(path[1])
+			if job:
+				self.send_json(200, job_status(job))
+		elif len(path) == 3 and path[0] == 'jobs' and path[2] == 'log':
+			job = self.find_job(path[1])
+			if job:
+				self.send_response(200)
+				self.send_header('Content-Type', 'text/plain')
+				self.end_headers()
+				with io.open(job['log'], 'rb') as log:  # Keeps reading as the log grows
+					while True:
+						finished = job['status'] in ('finished', 'failed', 'cancelled')
+						data = log.read()
+						if data:
+							self.wfile.write(data)
+							self.wfile.flush()
+						elif finished:
+							break
+						else:
+							time.sleep(0.5)
+		else:
+			self.send_json(404, {'error': 'Unknown path %s' % self.path})
+
+	def do_POST(self):
+		if self.path.strip('/') != 'jobs':
+			self.send_json(404, {'error': 'Unknown path %s' % self.path})
+			return
+		try:
+			args = json.loads(self.rfile.read(int(self.headers.getheader('Content-Length', 0))))['args']
+		except (ValueError, KeyError, TypeError):
+			args = None
+		if not isinstance(args, list) or not all(isinstance(arg, basestring) for arg in args):
+			self.send_json(400, {'error': 'Expected a JSON object with a list of arguments, e.g. '
+											 '{"args": ["--action", "finishFeature", "--featureName", "F01"]}'})
+			return
+		job = add_job([str(arg) for arg in args])
+		if job is None:
+			self.send_json(400, {'error': 'Invalid arguments for a job: %s' % ' '.join(args)})
+		else:
+			self.send_json(201, job_status(job))
+
+
+	def do_DELETE(self):
+		path = self.path.strip('/').split('/')
+		if len(path) != 2 or path[0] != 'jobs':
+			self.send_json(404, {'error': 'Unknown path %s' % self.path})
+			return
+		job = self.find_job(path[1])
+		if job:
+			run = None
+			with SERVER_LOCK:
+				if job['status'] == 'queued':
+					job['status'] = 'cancelled'
+					job['finished'] = time.time()
+					start_jobs()
+					SERVER_LOCK.notify_all()
+				elif job['status'] == 'running':
+					run = job.get('run')
+			if run:
+				run.cancel()  # run_job then marks the job cancelled
+			self.send_json(200, job_status(job))
+
+
+class MergeServer(ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+
+def serve(listen):
+	"""Serves the merge HTTP API on `listen` (host:port) until interrupted."""
+	host, port = listen.rsplit(':', 1)
+	server = MergeServer((host, int(port)), MergeRequestHandler)
+	print 'Merge server listening on http://%s:%s using %s. Press Ctrl+C to stop.' % (host, port, config_file)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		print '\nStopping merge server.'
+	server.server_close()
+
 
 def main():
-	if ACTION == 'standaloneRPDMerge':
-		do_three_way_merge(ORIG_RPD, CURR_RPD, MODI_RPD, OUT_RPD, RPD_PASS, TIDY)
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))  # Runs cancel_runs when stopped
+	if SERVER:
+		if ACTION == 'standaloneRPDMerge':  # The server runs elsewhere, so give it full paths to the RPDs
+			args = job_args(sys.argv[1:], ('-r', '--original', '-u', '--current', '-m', '--modified', '-o', '--output'))
+			args += ['-r', ORIG_RPD, '-m', MODI_RPD, '-o', OUT_RPD]
+			for current in CURR_RPDS:
+				args += ['-u', current]
+		elif ACTION == 'finishFeatures' and os.path.isfile(os.path.join(CURRENT_DIR, FEATURE_NAME)):
+			args = job_args(sys.argv[1:], ('--featureName',))
+			args += ['--featureName', os.path.join(CURRENT_DIR, FEATURE_NAME)]
+		else:
+			args = job_args(sys.argv[1:])
+		sys.exit(submit_job(SERVER, args))
+
+	if ACTION != 'serve':  # Each job run by the server has a workspace of its own
+		start_workspace()
+
+	if ACTION == 'serve':
+		serve(LISTEN)
+	elif ACTION == 'precompute':
+		precompute(INTERVAL)
+	elif ACTION == 'analyzeConflicts':
+		analyze_conflicts()
+	elif ACTION == 'forgetResolution':
+		forget_resolutions(RESOLUTION)
+	elif ACTION == 'standaloneRPDMerge':
+		if len(CURR_RPDS) > 1:
+			batch_merge(ORIG_RPD, CURR_RPDS, MODI_RPD, OUT_RPD, RPD_PASS, TIDY)
+		else:
+			do_three_way_merge(ORIG_RPD, CURR_RPDS[0], MODI_RPD, OUT_RPD, RPD_PASS, TIDY)
 	elif ACTION == 'reintegrate':
 		reintegrate(src_url=SOURCE_URL, target_url=TARGET_URL, rpd_pass=RPD_PASS, commit_message=COMMIT_MESSAGE)
 	elif ACTION == 'startFeature':
@@ -878,6 +3176,8 @@ def main():
 		start_hotfix(HOTFIX_NAME)
 	elif ACTION == 'finishFeature':
 		finish_feature(FEATURE_NAME)
+	elif ACTION == 'finishFeatures':
+		finish_features(feature_list(FEATURE_NAME))
 	elif ACTION == 'finishRelease':
 		finish_release(RELEASE_NAME)
 	elif ACTION == 'finishReleaseHotfix':
@@ -887,5 +3187,11 @@ def main():
 	elif ACTION == 'refreshFeature':
 		refresh_feature(FEATURE_NAME)
 
+	patch_cache_report()
+	resolution_report()
+	profile_report()
+	if WORKSPACE:
+		finish_workspace()
+
 if __name__ == "__main__":
 	main()